@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library is a small client for the Github REST API, used by ghscraper.py.
+#
+# It's deliberately thin: it fetches json and follows pagination links, and
+# leaves the decisions about what to fetch to the scraper. The interesting
+# part is that one client can be shared by many threads, which all draw
+# requests from one rate limit budget.
+#
+# Github rate limit headers
+# -------------------------
+#
+# Every API response includes three headers:
+#
+#  - X-RateLimit-Limit: requests allowed per hour (usually 5,000)
+#  - X-RateLimit-Remaining: requests left in this hour
+#  - X-RateLimit-Reset: when the hour is up, in seconds since the epoch
+#
+# Rather than hammering the API until it says no, we keep a count of the
+# requests we have left and make threads wait for the reset time once
+# the count runs out. If we're given more than one token, requests are
+# spread across the tokens, and we only sleep once all of them run out.
+#
+# Errors
+# ------
+#
+# Not every error means we should wait for the rate limit to reset:
+#
+#  - Rate limited (403 with no requests remaining, or 429): sleep until
+#    the reset time, or for as long as the Retry-After header asks.
+#  - Transient (5xx, connection errors, timeouts): retry with jittered
+#    exponential backoff, and give up with a TransientError after a while.
+#  - Permanent (any other 4xx, e.g. a deleted issue): raise a PermanentError
+#    straight away, so the caller can log it and move on.
+#
+# The base URL can be changed, so the client can be pointed at a local
+# mock server that serves canned json (and rate limit headers) for testing.
+#
+# Response cache
+# --------------
+#
+# The client can keep the json github sends in a local SQLite database,
+# keyed by the URL and query string of the request. The cache has three modes:
+#
+#  - record: always ask github, and store what it answers
+#  - replay: never ask github; answer from the cache, and treat anything
+#    that isn't cached as a permanent error
+#  - revalidate: send a conditional request with the cached ETag, and use
+#    the cached json if github answers 304 Not Modified (which doesn't count
+#    against the rate limit)
+#
+# Replaying a recorded scrape needs no network or token, which makes it a
+# deterministic stand in for github when testing or benchmarking the scraper.
+
+import datetime
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+
+GITHUB_API_URL = 'https://api.github.com'
+
+# Ask for the same media type github3.py asked for,
+# so the json we write contains body, body_text and body_html.
+GITHUB_MEDIA_TYPE = 'application/vnd.github.v3.full+json'
+
+# Github returns at most 100 items per page.
+GITHUB_PAGE_SIZE = 100
+
+# Seconds to wait for github to answer before treating it as a transient error
+GITHUB_TIMEOUT = 60
+
+# Backoff for transient errors: 2, 4, 8, ... seconds, up to 5 minutes,
+# for up to 8 retries (about 10 minutes in total).
+BACKOFF_BASE = 2
+BACKOFF_MAX = 5*60
+MAX_RETRIES = 8
+
+CACHE_NAME = 'responses.sqlite'
+CACHE_MODES = ['record', 'replay', 'revalidate']
+# The headers the scraper looks at, other than the rate limit headers
+CACHED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Link']
+
+class GitHubError(Exception):
+    def __init__(self, url, reason):
+        Exception.__init__(self, url + ': ' + str(reason))
+        self.url = url
+        self.reason = reason
+
+class TransientError(GitHubError):
+    """Github or the network failed, and kept failing after we retried."""
+
+class PermanentError(GitHubError):
+    """Github refused the request, and will refuse it again if we retry."""
+
+def backoffDelay(attempt):
+    """Seconds to wait before retry number attempt (starting at 1)."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**(attempt - 1))
+    # Jitter, so threads that failed together don't retry together.
+    return random.uniform(delay / 2, delay)
+
+class RateLimitBudget:
+    """Rate limit state for one set of Github credentials."""
+
+    def __init__(self, auth):
+        # auth is either an OAuth token, or a (username, password) tuple
+        self.auth = auth
+        # We don't know our budget until the first response comes back.
+        self.remaining = None
+        self.reset = 0
+        # Set by a Retry-After, which the rate limit headers don't know about
+        self.pausedUntil = 0
+        self.inFlight = 0
+
+    def usable(self, now):
+        if now < self.pausedUntil:
+            return False
+        if self.remaining is None or self.remaining > 0:
+            return True
+        if now >= self.reset:
+            # The hour is up. Let requests through until
+            # a response tells us the new budget.
+            self.remaining = None
+            return True
+        return False
+
+    def estimate(self):
+        if self.remaining is None:
+            return float('inf')
+        return self.remaining
+
+    def update(self, response):
+        if 'X-RateLimit-Remaining' not in response.headers:
+            return
+        # The header doesn't know about requests still in flight.
+        remaining = max(0, int(response.headers['X-RateLimit-Remaining']) - self.inFlight)
+        reset = int(response.headers.get('X-RateLimit-Reset', 0))
+        # Responses can come back out of order, and an older one has a higher
+        # count. Until the limit resets, the count only goes down.
+        if reset == self.reset and self.remaining is not None:
+            remaining = min(remaining, self.remaining)
+        self.remaining = remaining
+        self.reset = reset
+
+    def pause(self, seconds):
+        # Kept apart from reset, so that a response to another thread's
+        # request can't cut the pause short.
+        self.pausedUntil = max(self.pausedUntil, time.time() + seconds)
+
+    def resumeTime(self):
+        """When an unusable budget can be used again: the later of the
+        rate limit reset and the end of any pause."""
+        if self.remaining is not None and self.remaining <= 0:
+            return max(self.reset, self.pausedUntil)
+        return self.pausedUntil
+
+class TokenPool:
+    """Hands out credentials to threads, so that all threads share one budget.
+
+    Threads call acquire() before sending a request and release() with the
+    response. acquire() picks the credentials with the most requests left,
+    and blocks until the earliest reset time once all of them are used up."""
+
+    def __init__(self, auths):
+        self.cond = threading.Condition()
+        self.budgets = [RateLimitBudget(auth) for auth in auths]
+        self.sleepingUntil = 0
+
+    def remaining(self):
+        """Requests left across all tokens, or None if we haven't heard from github yet."""
+        with self.cond:
+            known = [b.remaining for b in self.budgets if b.remaining is not None]
+            if not known:
+                return None
+            return sum(known)
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                now = time.time()
+                usable = [b for b in self.budgets if b.usable(now)]
+                if usable:
+                    budget = max(usable, key=lambda b: b.estimate())
+                    if budget.remaining is not None:
+                        budget.remaining -= 1
+                    budget.inFlight += 1
+                    return budget
+                wake = min(b.resumeTime() for b in self.budgets)
+                if wake != self.sleepingUntil:
+                    self.sleepingUntil = wake
+                    print('Github rate limit at 0, sleeping until',
+                          datetime.datetime.fromtimestamp(wake))
+                self.cond.wait(max(0, wake - now))
+
+    def release(self, budget, response):
+        with self.cond:
+            budget.inFlight -= 1
+            if response is not None:
+                budget.update(response)
+                retryAfter = response.headers.get('Retry-After')
+                if isRateLimited(response) and retryAfter:
+                    # Secondary (abuse) rate limits say how long to back off
+                    budget.pause(int(retryAfter))
+                elif isRateLimited(response):
+                    budget.remaining = 0
+            self.cond.notify_all()
+
+    def waitsFor(self, budget):
+        """Whether acquire() will wait before using a rate limited budget again,
+        i.e. github told us when the limit resets, and that's still to come."""
+        with self.cond:
+            return budget.resumeTime() > time.time()
+
+    def pause(self, budget, seconds):
+        with self.cond:
+            budget.pause(seconds)
+            self.cond.notify_all()
+
+def isRateLimited(response):
+    if response.status_code == 429:
+        return True
+    return (response.status_code == 403 and
+            (response.headers.get('X-RateLimit-Remaining') == '0' or
+             'Retry-After' in response.headers))
+
+def requestKey(url, params=None):
+    """The full URL of a GET request, including the query string."""
+    return requests.Request('GET', url, params=params).prepare().url
+
+def cachedResponse(url, status, headers, body):
+    """Build a response object for json that didn't come from the network."""
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = 'utf-8'
+    response._content = body
+    return response
+
+class ResponseCache:
+    """Stores successful responses by request URL. Safe to share between threads."""
+
+    def __init__(self, path, mode):
+        assert mode in CACHE_MODES
+        self.mode = mode
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, CACHE_NAME), check_same_thread=False)
+        with self.lock:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                headers TEXT NOT NULL,
+                                body BLOB NOT NULL,
+                                fetched REAL NOT NULL)''')
+            self.db.commit()
+
+    def lookup(self, key):
+        """Returns the cached response for a request, or None."""
+        with self.lock:
+            row = self.db.execute('SELECT headers, body FROM responses WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        return cachedResponse(key, 200, json.loads(row[0]), row[1])
+
+    def store(self, key, response):
+        headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                            (key, json.dumps(headers), response.content, time.time()))
+            self.db.commit()
+
+class GitHubClient:
+    """Fetch json from the Github API. Safe to share between threads."""
+
+    def __init__(self, auths, baseUrl=GITHUB_API_URL, cache=None):
+        self.baseUrl = baseUrl.rstrip('/')
+        self.pool = TokenPool(auths)
+        # A ResponseCache, or None to always ask github
+        self.cache = cache
+        # requests sessions aren't thread safe, so each thread gets its own.
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            session = requests.Session()
+            session.headers['Accept'] = GITHUB_MEDIA_TYPE
+            self.local.session = session
+        return self.local.session
+
+    def url(self, *parts):
+        return '/'.join([self.baseUrl] + [str(p) for p in parts])
+
+    def repoUrl(self, owner, repo, *parts):
+        return self.url('repos', owner, repo, *parts)
+
+    def send(self, budget, url, params, headers):
+        headers = dict(headers)
+        auth = None
+        if isinstance(budget.auth, tuple):
+            auth = budget.auth
+        elif budget.auth:
+            headers['Authorization'] = 'token ' + budget.auth
+        return self.session().get(url, params=params, headers=headers, auth=auth,
+                                  timeout=GITHUB_TIMEOUT)
+
+    def get(self, url, params=None, etag=None):
+        """GET a URL, waiting for the rate limit if needed. Returns the response.
+
+        If etag is given, the request is conditional, and the response
+        may be a 304 Not Modified (which doesn't count against the rate limit).
+        Raises TransientError or PermanentError if the request fails."""
+        if self.cache is None:
+            return self.fetch(url, params, etag)
+
+        key = requestKey(url, params)
+        cached = self.cache.lookup(key)
+        if self.cache.mode == 'replay':
+            if cached is None:
+                raise PermanentError(url, 'not in the response cache')
+            if etag and cached.headers.get('ETag') == etag:
+                return cachedResponse(key, 304, dict(cached.headers), b'')
+            return cached
+
+        if self.cache.mode == 'revalidate' and cached is not None and 'ETag' in cached.headers:
+            response = self.fetch(url, params, cached.headers['ETag'])
+            if response.status_code == 304:
+                # The caller only wants a 304 if it has seen this version, too.
+                if etag == cached.headers['ETag']:
+                    return response
+                return cached
+        else:
+            response = self.fetch(url, params, etag)
+        if response.status_code == 200:
+            self.cache.store(key, response)
+        return response
+
+    def fetch(self, url, params=None, etag=None):
+        """GET a URL from github, bypassing the cache."""
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        attempt = 0
+        while True:
+            budget = self.pool.acquire()
+            response = None
+            try:
+                response = self.send(budget, url, params, headers)
+                reason = response.status_code
+            except (requests.ConnectionError, requests.Timeout) as e:
+                reason = e
+            finally:
+                self.pool.release(budget, response)
+
+            if response is not None:
+                # The pool has seen the headers, and will make
+                # us wait until the limit resets.
+                if isRateLimited(response) and self.pool.waitsFor(budget):
+                    continue
+                # If github didn't say when (or said a time that's past),
+                # back off instead of trying again straight away.
+                if isRateLimited(response):
+                    attempt += 1
+                    if attempt > MAX_RETRIES:
+                        raise TransientError(url, reason)
+                    delay = backoffDelay(attempt)
+                    print('Rate limited fetching', url, '- retrying in', '%.0f' % delay, 'seconds')
+                    self.pool.pause(budget, delay)
+                    continue
+                if response.status_code < 400:
+                    return response
+                if response.status_code < 500:
+                    raise PermanentError(url, reason)
+
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                raise TransientError(url, reason)
+            delay = backoffDelay(attempt)
+            print('Error fetching', url + ':', reason, '- retrying in', '%.0f' % delay, 'seconds')
+            time.sleep(delay)
+
+    def iterate(self, url, params=None, etags=None, etagKey=None):
+        """Yield every item of a paginated list, following the Link headers.
+
+        If an etags dictionary is given, the request for the first page is
+        conditional on the ETag stored for that request (or under etagKey),
+        and nothing is yielded if the list hasn't changed. The new ETag is
+        stored in the dictionary."""
+        params = dict(params or {})
+        params.setdefault('per_page', GITHUB_PAGE_SIZE)
+        key = etagKey or requestKey(url, params)
+        etag = None
+        if etags is not None:
+            etag = etags.get(key)
+        response = self.get(url, params, etag)
+        if response.status_code == 304:
+            return
+        if etags is not None and 'ETag' in response.headers:
+            etags[key] = response.headers['ETag']
+        while True:
+            for item in response.json():
+                yield item
+            # The next link already has the query string in it
+            url = response.links.get('next', {}).get('url')
+            if not url:
+                break
+            response = self.get(url)
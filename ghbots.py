@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program finds the bots in a scraped repository, and writes them to
+# owner/repo/bots.txt, one per line:
+#
+#   username, reasons it was classified as a bot, number of json files
+#
+# Bots write a lot of the comments on busy projects, and they aren't people
+# we want to measure. The scrub, categorize, and stats scripts read bots.txt
+# (with loadBots) and drop anything a bot wrote.
+#
+# A user is a bot if:
+#
+#  - github says so (the user type is 'Bot', e.g. github apps), or
+#  - their username ends in [bot], or
+#  - they're a bot we know about (KNOWN_BOTS, or a bot in bot-commands.txt), or
+#  - they wrote at least MIN_FILES issues, pull requests, or comments, and
+#    at least two of these are true:
+#     - their username looks like a bot's (e.g. foo-bot, foobot, foo-robot)
+#     - their comments are templates: at most TEMPLATE_SHAPES of them
+#       are different once numbers are taken out
+#     - they post more than BUSY_RATE comments on the days they're active
+#
+# You can edit bots.txt by hand, but it's overwritten when this is re-run.
+# If there's no bots.txt, the known bots are used. To write it, run:
+#
+# python ghbots.py GITHUB_REPO_NAME GITHUB_OWNER_NAME
+
+import os
+import re
+import json
+import hashlib
+import argparse
+from ghstore import openStore
+from ghtrie import trieRegex
+
+BOTS_NAME = 'bots.txt'
+BOT_COMMANDS_NAME = 'bot-commands.txt'
+
+# Bots we knew about before we looked for them
+KNOWN_BOTS = ['bors', 'bors-servo', 'googlebot', 'highfive', 'k8s-ci-robot', 'k8s-merge-robot',
+              'k8s-reviewable', 'rust-highfive', 'rfcbot']
+
+MIN_FILES = 20
+TEMPLATE_SHAPES = 0.2
+BUSY_RATE = 30
+
+botNamePattern = re.compile(r'(?:bot|robot|[-_]ci)$|^bot[-_]|[-_]bot[-_]', re.IGNORECASE)
+numberPattern = re.compile(r'[0-9a-f]*[0-9][0-9a-f]*')
+spacePattern = re.compile(r'\s+')
+
+class BotCommands:
+    """The commands people send to bots, and the role each command implies.
+    See bot-commands.txt."""
+
+    def __init__(self, text):
+        self.bots = {}
+        self.roles = {}
+        for line in text.split('\n'):
+            if not line.strip() or line.startswith('#'):
+                continue
+            bot, role, command = line.strip().split(None, 2)
+            if role not in ('merger', 'none'):
+                raise ValueError('Unknown role for bot command: ' + line)
+            self.bots[command] = bot
+            self.roles[command] = role
+        # Changes to the table change the results, like changes to the code.
+        self.digest = hashlib.sha1('\n'.join(sorted('%s %s %s' % (self.bots[c], self.roles[c], c)
+                                                    for c in self.roles)).encode('utf-8')).hexdigest()
+        # Commands are at the start of a line, and end at whitespace or punctuation.
+        self.pattern = re.compile(r'^[ \t]*(' + trieRegex(self.roles) + r')(?![^\s.,;:!?])', re.MULTILINE)
+
+    def commandRoles(self, text):
+        """Returns the set of roles implied by the commands in a comment's text."""
+        roles = set(self.roles[m.group(1)] for m in self.pattern.finditer(text))
+        roles.discard('none')
+        return roles
+
+def loadBotCommands(repoPath):
+    """Returns the repository's bot command table, or the default one next to this script."""
+    path = os.path.join(repoPath, BOT_COMMANDS_NAME)
+    if not os.path.exists(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), BOT_COMMANDS_NAME)
+    with open(path) as f:
+        return BotCommands(f.read())
+
+# Bot command tables, by repository path
+repoBotCommands = {}
+
+def getBotCommands(repoPath):
+    if repoPath not in repoBotCommands:
+        repoBotCommands[repoPath] = loadBotCommands(repoPath)
+    return repoBotCommands[repoPath]
+
+def knownBots(repoPath):
+    return set(KNOWN_BOTS) | set(getBotCommands(repoPath).bots.values())
+
+def bodyShape(body):
+    """Returns a comment body with the parts that change between uses of a template
+    (numbers, hashes, and whitespace) taken out."""
+    body = spacePattern.sub(' ', numberPattern.sub('0', body.lower()))
+    return body[:200]
+
+class UserActivity:
+    """What one user wrote, for telling bots from people."""
+
+    def __init__(self):
+        self.files = 0
+        self.comments = 0
+        self.types = set()
+        self.shapes = set()
+        self.days = set()
+
+def collectActivity(store):
+    """Returns a dictionary of username to UserActivity, from one pass over the json."""
+    activity = {}
+    processed = 0
+    for issueDir, files in store.iterRaw():
+        for name, data in files:
+            try:
+                soup = json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+            if not soup.get('user'):
+                continue
+            user = activity.setdefault(soup['user']['login'], UserActivity())
+            user.files += 1
+            if soup['user'].get('type'):
+                user.types.add(soup['user']['type'])
+            if name.startswith('comment-') or name.startswith('pr-comment-'):
+                user.comments += 1
+                user.shapes.add(hash(bodyShape(soup.get('body') or '')))
+                if soup.get('created_at'):
+                    user.days.add(soup['created_at'][:10])
+        processed += 1
+        if (processed % 1000) == 0:
+            print('Processed', processed, 'issues')
+    return activity
+
+def botReasons(login, user, known):
+    """Returns the list of reasons a user is a bot, or an empty list if they're a person."""
+    if 'Bot' in user.types:
+        return ['type']
+    if login.endswith('[bot]'):
+        return ['name']
+    if login in known:
+        return ['known']
+    if user.files < MIN_FILES:
+        return []
+    reasons = []
+    if botNamePattern.search(login):
+        reasons.append('name')
+    if user.comments >= MIN_FILES and len(user.shapes) <= TEMPLATE_SHAPES * user.comments:
+        reasons.append('template')
+    if user.days and user.comments / len(user.days) > BUSY_RATE:
+        reasons.append('busy')
+    if len(reasons) < 2:
+        return []
+    return reasons
+
+def classifyBots(repoPath):
+    """Returns a sorted list of (username, reasons, number of json files) for the bots in a repository."""
+    known = knownBots(repoPath)
+    activity = collectActivity(openStore(repoPath))
+    bots = []
+    for login, user in sorted(activity.items()):
+        reasons = botReasons(login, user, known)
+        if reasons:
+            bots.append((login, reasons, user.files))
+    return bots
+
+def writeBots(repoPath, bots):
+    with open(os.path.join(repoPath, BOTS_NAME), 'w') as f:
+        for login, reasons, files in bots:
+            f.write(login + '\t' + ','.join(reasons) + '\t' + str(files) + '\n')
+
+def loadBots(repoPath):
+    """Returns the set of bot usernames for a repository, from bots.txt,
+    or the known bots if ghbots.py hasn't been run."""
+    path = os.path.join(repoPath, BOTS_NAME)
+    if not os.path.exists(path):
+        return knownBots(repoPath)
+    with open(path) as f:
+        return set(line.split('\t')[0].strip() for line in f if line.strip() and not line.startswith('#'))
+
+# Bots, by repository path
+repoBots = {}
+
+def getRepoBots(repoPath):
+    """Like loadBots(), but only reads bots.txt once."""
+    if repoPath not in repoBots:
+        repoBots[repoPath] = loadBots(repoPath)
+    return repoBots[repoPath]
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the bots in scraped github data, and write them to bots.txt.')
+    parser.add_argument('repository', help='github repository name')
+    parser.add_argument('owner', help='github username of repository owner')
+    args = parser.parse_args()
+
+    repoPath = os.path.join(args.owner, args.repository)
+    bots = classifyBots(repoPath)
+    writeBots(repoPath, bots)
+    for login, reasons, files in bots:
+        print(login, '(' + ', '.join(reasons) + ')', files, 'json files')
+    print('Found', len(bots), 'bots')
+
+if __name__ == "__main__":
+    main()
@@ -36,6 +36,7 @@
 #    This contains a contributor's first interaction with the project.
 #    They could have opened an issue, commented on an issue,
 #    opened a pull request, or commented on a pull request.
+#    Lines are sorted by date, then username.
 #
 #  - reporters.txt
 #    'reporter', date, username, path to issue json file
@@ -73,21 +74,61 @@
 #
 #    This file contains people who merge pull requests (which may be their own)
 #    Note that this file may contain bots who are merging in code on command.
+#    It's the only file that does: bots (see ghbots.py) are left out of the others.
 #    We attempt to find the user who issued the command and record them as a merger,
-#    in addition to the bot doing the merging.
+#    in addition to the bot doing the merging. The commands each bot accepts are
+#    listed in bot-commands.txt (or owner/repo/bot-commands.txt, if there is one).
+#    A command can start any line of a comment, and only counts if the pull
+#    request was merged.
 #
-# - connectors.txt
+#  - mentions.txt
+#    'mention', date, username, path to json file, username they @mentioned
 #
-#   FIXME: add this.
-#   This file contains people who tag another person who comments on an issue or PR.
-#   These people are crucial for getting the right people to review a problem,
-#   especially issues opened by newcomers who don't know who to tag.
+#    This file is an index of every @mention in an issue, pull request, or comment
+#    body. Mentions in code and in quoted replies aren't counted, and neither are
+#    people mentioning themselves. A pull request's description is indexed from
+#    its pull request json file, not its issue json file.
+#
+#  - connectors.txt
+#    'connector', date, username, path to json file with the mention
+#
+#    This file contains people who tag another person who then comments on the
+#    issue or PR. These people are crucial for getting the right people to review
+#    a problem, especially issues opened by newcomers who don't know who to tag.
+#    Each issue's mentions and comments are swept once, in date order; a comment
+#    at the same time as a mention isn't a reply to it.
+#
+#  - events.npz
+#
+#    All of the above as one table of events, in columns, for the analysis
+#    scripts to load quickly (see ghevents.py).
+#
+# With --incremental, the results for each issue directory are kept in
+# categorize-state.sqlite, along with a fingerprint of the directory's files
+# (see ghstore.py). The next run only categorizes directories whose fingerprint
+# changed, and rewrites the files above from the stored results. A user's
+# first interaction only ever moves earlier, even if the file it came from
+# is removed.
 
 import os
 import re
 import json
+import hashlib
+import sqlite3
 import argparse
-from datetime import datetime
+from multiprocessing import Pool
+from ghstore import openStore, getStore, changedDirs
+from ghwalk import fileKind, issueSortKey, ISSUE, PR, REVIEW_COMMENT
+from ghevents import buildEvents, categorizedRows, firstInteractions, writeEvents
+from ghbots import getBotCommands, getRepoBots
+
+# Number of issue directories each worker process categorizes at a time
+CHUNK_SIZE = 1000
+
+STATE_NAME = 'categorize-state.sqlite'
+# Bump this whenever a change here changes the results for an issue directory,
+# so that --incremental starts over instead of mixing old and new results.
+CATEGORIZE_VERSION = 9
 
 # Github lesson 2:
 #
@@ -103,42 +144,49 @@ def getUserDate(json):
     date = json['created_at']
     return user, date
 
+# Every issue directory is read once, and each json file is decoded once.
+# The Categorizer visits the directories one at a time, and the functions
+# below are passed the directory's files as a list of (file name, json).
+#
+# Issue directories are visited in order of their id, and the files in each
+# directory in order of their name, so the output doesn't depend on the
+# order the filesystem lists files in. With --jobs, chunks of directories
+# are categorized in separate processes, and merged back in the same order.
+
 # Track issue reporters
 # Make a note when someone opened an issue (not a PR)
-def appendIssueReporters(issueDir, issueReporters):
+def appendIssueReporters(dirPath, files, issueReporters):
     """If an issue is not a pull request, append issue reporter information to the issueReporters list.
     Return the username of the issue reporter, or None if this is a pull request."""
     # Grab the json from the issue File
-    for jsonFile in os.listdir(issueDir):
+    for jsonFile, issueJson in files:
         if jsonFile.startswith('issue-'):
-            with open(os.path.join(issueDir, jsonFile)) as issueFile:
-                issueJson = json.load(issueFile)
-                break
+            break
+    else:
+        return None
     if 'pull_request' in issueJson:
         return None
     user, date = getUserDate(issueJson)
-    issueReporters.append(('reporter', date, user, os.path.join(issueDir, jsonFile)))
+    issueReporters.append(('reporter', date, user, os.path.join(dirPath, jsonFile)))
     return user
 
 # Track issue responders
 # Make a note when someone responded on an issue (not a PR) that is not their own
-def appendIssueResponders(issueDir, issueResponders, issueCreator):
-    for jsonFile in os.listdir(issueDir):
+def appendIssueResponders(dirPath, files, issueResponders, issueCreator):
+    for jsonFile, commentJson in files:
         if not jsonFile.startswith('comment-'):
             continue
-        with open(os.path.join(issueDir, jsonFile)) as commentFile:
-            commentJson = json.load(commentFile)
         user, date = getUserDate(commentJson)
         if user == issueCreator:
             continue
-        issueResponders.append(('responder', date, user, os.path.join(issueDir, jsonFile)))
+        issueResponders.append(('responder', date, user, os.path.join(dirPath, jsonFile)))
 
 # FIXME: ugh, we could avoid pattern matching if we renamed pr-comment to review-comment
 def jsonIsPullRequest(filename):
-    return re.match(r'pr-[0-9]+', filename)
+    return fileKind(filename) == PR
 
 def jsonIsPullRequestComment(filename):
-    return re.match(r'pr-comment-[0-9]+', filename)
+    return fileKind(filename) == REVIEW_COMMENT
 
 # Track contributors with a merged pull request,
 # submitters who opened a pull request that wasn't merged,
@@ -152,154 +200,359 @@ def jsonIsPullRequestComment(filename):
 #
 # Can look for merged_by to get the user who merged it
 # Not sure what happens when a 'ghost' has merged in a file
-def appendContributor(issueDir, contributors, mergers, submitters):
+def appendContributor(dirPath, files, contributors, mergers, submitters):
     """If an issue is a pull request, append issue reporter information to the issueReporters list.
     Return the username of the issue reporter, or None if this is a pull request."""
     # Grab the json from the pull request file
     prJson = None
-    for jsonFile in os.listdir(issueDir):
+    for jsonFile, soup in files:
         if jsonIsPullRequest(jsonFile):
-            with open(os.path.join(issueDir, jsonFile)) as prFile:
-                prJson = json.load(prFile)
-                break
+            prJson = soup
+            break
     if not prJson:
         return None
+    prPath = os.path.join(dirPath, jsonFile)
 
     user, date = getUserDate(prJson)
     merged_at = prJson['merged_at']
     merger = prJson['merged_by']
     if merged_at:
-        contributors.append(('contributor', date, user, os.path.join(issueDir, jsonFile)))
+        contributors.append(('contributor', date, user, prPath))
         if not merger:
-            mergers.append(('merger', merged_at, 'ghost', os.path.join(issueDir, jsonFile)))
+            mergers.append(('merger', merged_at, 'ghost', prPath))
         else:
-            mergers.append(('merger', merged_at, merger['login'], os.path.join(issueDir, jsonFile)))
+            mergers.append(('merger', merged_at, merger['login'], prPath))
     else:
-        submitters.append(('submitter', date, user, os.path.join(issueDir, jsonFile)))
+        submitters.append(('submitter', date, user, prPath))
     return user
 
-def checkForBotCommand(json, commandList):
+def checkForBotCommand(json, commands):
     """If this was a command sent to a bot, return
-    the username of the person who issued the command
-    and the date of the command."""
-    if not 'body_text' in json:
-        return None
-    for command in commandList:
-        # FIXME: bot may check for commands in the middle of a comment?
-        if json['body_text'] is not None:
-            if json['body_text'].startswith(command):
-                user, date = getUserDate(json)
-                return user, date
-    return None, None
+    the username of the person who issued the command,
+    the date of the command, and the set of roles the commands imply."""
+    # Comments imported from event archives (see ghimport.py) only have the markdown body
+    body = json.get('body_text') or json.get('body')
+    if not body:
+        return None, None, set()
+    roles = commands.commandRoles(body)
+    if not roles:
+        return None, None, set()
+    user, date = getUserDate(json)
+    return user, date, roles
 
 # Track pull request reviewers, who may make an issue comment, or a PR review comment.
 # If someone tagged a bot in order for that bot to merge the code in, add them as a merger.
-def appendReviewers(issueDir, contributor, reviewers, mergers):
-    for jsonFile in os.listdir(issueDir):
+def appendReviewers(dirPath, files, reviewers, mergers, commands):
+    # It's possible that the command was issued to a bot,
+    # but it rejected the pull request because it didn't pass,
+    # so only count merge commands if the pull request was merged.
+    merged = any(soup.get('merged') for jsonFile, soup in files if jsonIsPullRequest(jsonFile))
+    for jsonFile, commentJson in files:
         if not jsonFile.startswith('comment-') and not jsonFile.startswith('pr-comment-'):
             continue
-        with open(os.path.join(issueDir, jsonFile)) as commentFile:
-            commentJson = json.load(commentFile)
         user, date = getUserDate(commentJson)
-        merger, mergeDate = checkForBotCommand(commentJson, ['@bors: r+'])
-        # FIXME: it's possible that the command was issued to bors,
-        # but it rejected the pull request because it didn't pass.
-        # Need to also check the 'merged' flag in the pr-*.json file.
-        if merger and mergeDate:
-            mergers.append(('merger', mergeDate, merger, os.path.join(issueDir, jsonFile)))
-        if user == contributor:
-            continue
-        reviewers.append(('reviewer', date, user, os.path.join(issueDir, jsonFile)))
+        merger, mergeDate, roles = checkForBotCommand(commentJson, commands)
+        if merged and 'merger' in roles:
+            mergers.append(('merger', mergeDate, merger, os.path.join(dirPath, jsonFile)))
+        reviewers.append(('reviewer', date, user, os.path.join(dirPath, jsonFile)))
 
-def createStats(repoPath):
-    issueReporters = []
-    issueResponders = []
-    submitters = []
-    contributors = []
-    reviewers = []
-    mergers = []
-
-    processed = 0
-    for directory in os.listdir(repoPath):
-        if not directory.startswith('issue-'):
-            continue
-        dirPath = os.path.join(repoPath, directory)
-        issueCreator = appendIssueReporters(dirPath, issueReporters)
-        if issueCreator:
-            appendIssueResponders(dirPath, issueResponders, issueCreator)
-        else:
-            prCreator = appendContributor(dirPath, contributors, mergers, submitters)
-            if prCreator:
-                appendReviewers(dirPath, contributors, reviewers, mergers)
-        processed += 1
-        if (processed % 1000) == 0:
-            print('Processed', processed, 'issues')
-    statsList = [(issueReporters, 'reporters.txt'),
-                 (issueResponders, 'responders.txt'),
-                 (submitters, 'submitters.txt'),
-                 (contributors, 'contributors.txt'),
-                 (reviewers, 'reviewers.txt'),
-                 (mergers, 'mergers.txt')]
-    return statsList
-
-def insertUser(users, dirPath, jsonFile):
+def insertUser(users, dirPath, jsonFile, soup):
     """Helps create a dictionary of the user's first interactions with a project.
     Given a json file describing an opened issue or PR, or a comment,
     Insert user into the dictionary, but only overwrite the dict entry
     if this interaction is older than the one stored."""
 
-    with open(os.path.join(dirPath, jsonFile)) as issueFile:
-        soup = json.load(issueFile)
-        key, date = getUserDate(soup)
+    key, date = getUserDate(soup)
     if not key in users:
         users[key] = (dirPath, jsonFile, date)
-    else:
-        stored = datetime.strptime(users[key][2], "%Y-%m-%dT%H:%M:%SZ")
-        new = datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
-        if new < stored:
-            users[key] = (dirPath, jsonFile, date)
-
-def findUsers(repoPath):
-    """Returns a dictionary of username keys, with values being issue ID,
-    the file name of the issue comment/review comment/pull request ID,
-    and date of first interaction with the project."""
-    users = {}
-    for directory in os.listdir(repoPath):
-        if not directory.startswith('issue-'):
-            continue
-        dirPath = os.path.join(repoPath, directory)
-
-        dirList = os.listdir(dirPath)
-        prFile = None
-        # First, look whether this is an issue or a PR.
-        # If it's a PR, make sure to insert that into the list,
-        # because when a PR is opened, an issue is opened
-        # with the same timestamp, and it's racy
-        # which order listdir will return the file names in.
-        for jsonFile in dirList:
-            if jsonIsPullRequest(jsonFile):
-                insertUser(users, dirPath, jsonFile)
-                prFile = jsonFile
-
-        for jsonFile in dirList:
-            if not prFile or (prFile and prFile != jsonFile):
-                insertUser(users, dirPath, jsonFile)
+    # Github dates are all formatted as %Y-%m-%dT%H:%M:%SZ,
+    # so comparing the strings compares the dates.
+    elif date < users[key][2]:
+        users[key] = (dirPath, jsonFile, date)
+
+def findUsers(users, dirPath, files):
+    """Add the first interactions in an issue directory to the users dictionary
+    of username keys, with values being issue ID, the file name of the
+    issue comment/review comment/pull request ID, and date of first
+    interaction with the project."""
+    prFile = None
+    # First, look whether this is an issue or a PR.
+    # If it's a PR, make sure to insert that into the list,
+    # because when a PR is opened, an issue is opened
+    # with the same timestamp, and it's racy
+    # which order listdir will return the file names in.
+    for jsonFile, soup in files:
+        if jsonIsPullRequest(jsonFile):
+            insertUser(users, dirPath, jsonFile, soup)
+            prFile = jsonFile
+
+    for jsonFile, soup in files:
+        if not prFile or (prFile and prFile != jsonFile):
+            insertUser(users, dirPath, jsonFile, soup)
+
+# Track mentions and connectors
+# Github usernames are letters, numbers, and single hyphens, up to 39 characters.
+# Don't match email addresses, team mentions (@org/team), or code.
+mentionPattern = re.compile(r'(?<![\w`@/.-])@([A-Za-z0-9](?:-?[A-Za-z0-9]){0,38})(?![\w/-])')
+fencedCodePattern = re.compile(r'```.*?```', re.DOTALL)
+inlineCodePattern = re.compile(r'`[^`\n]*`')
+quotedLinePattern = re.compile(r'^ *>.*$', re.MULTILINE)
+
+def mentionedUsers(body):
+    """Returns the usernames @mentioned in a comment body, in order, without duplicates."""
+    if not body or '@' not in body:
+        return []
+    if '`' in body:
+        body = inlineCodePattern.sub('', fencedCodePattern.sub('', body))
+    if '>' in body:
+        body = quotedLinePattern.sub('', body)
+    users = []
+    for user in mentionPattern.findall(body):
+        if user not in users:
+            users.append(user)
     return users
 
-def main():
-    parser = argparse.ArgumentParser(description='Categorize interactions with scraped github data.')
-    parser.add_argument('repository', help='github repository name')
-    parser.add_argument('owner', help='github username of repository owner')
-    args = parser.parse_args()
+def appendMentions(dirPath, files, mentions):
+    # A pull request's description is in both its issue json and its pr json.
+    # Only index it once, from the pr json.
+    isPullRequest = any(jsonIsPullRequest(jsonFile) for jsonFile, soup in files)
+    for jsonFile, soup in files:
+        if isPullRequest and fileKind(jsonFile) == ISSUE:
+            continue
+        mentioned = mentionedUsers(soup.get('body'))
+        if not mentioned:
+            continue
+        user, date = getUserDate(soup)
+        for other in mentioned:
+            # Usernames aren't case sensitive
+            if other.lower() == user.lower():
+                continue
+            mentions.append(('mention', date, user, os.path.join(dirPath, jsonFile), other))
 
-    repoPath = os.path.join(args.owner, args.repository)
+def appendConnectors(files, mentions, connectors):
+    """Given the mentions in one issue directory, append a connector line for each
+    json file with a mention of someone who commented afterwards."""
+    if not mentions:
+        return
+    # Sweep through the mentions and comments in date order.
+    # Comments sort before mentions at the same time.
+    events = [(date, 1, i) for (i, (role, date, user, path, other)) in enumerate(mentions)]
+    for jsonFile, soup in files:
+        if jsonFile.startswith('comment-') or jsonIsPullRequestComment(jsonFile):
+            user, date = getUserDate(soup)
+            events.append((date, 0, user.lower()))
+    events.sort(key=lambda e: (e[0], e[1]))
+    waiting = {}
+    connected = set()
+    for date, isMention, item in events:
+        if isMention:
+            waiting.setdefault(mentions[item][4].lower(), []).append(item)
+            continue
+        for i in waiting.pop(item, []):
+            connected.add(mentions[i][3])
+    for role, date, user, path, other in mentions:
+        if path in connected:
+            connected.remove(path)
+            connectors.append(('connector', date, user, path))
+
+class Categorizer:
+    """Collects first interactions and contributor roles from issue directories."""
+
+    def __init__(self, commands=None, bots=()):
+        # A BotCommands table, needed to visit issue directories
+        self.commands = commands
+        # Bot usernames (see ghbots.py)
+        self.bots = bots
+        self.users = {}
+        self.issueReporters = []
+        self.issueResponders = []
+        self.submitters = []
+        self.contributors = []
+        self.reviewers = []
+        self.mergers = []
+        self.connectors = []
+        self.mentions = []
+
+    def visit(self, dirPath, files):
+        """Categorize one issue directory, given a list of (file name, json)."""
+        # Bots aren't newcomers
+        findUsers(self.users, dirPath, [(name, soup) for (name, soup) in files
+                                        if getUserDate(soup)[0] not in self.bots])
+        start = [len(stats) for stats, statsFile in self.statsList()]
+        issueCreator = appendIssueReporters(dirPath, files, self.issueReporters)
+        if issueCreator:
+            appendIssueResponders(dirPath, files, self.issueResponders, issueCreator)
+        else:
+            prCreator = appendContributor(dirPath, files, self.contributors, self.mergers, self.submitters)
+            if prCreator:
+                appendReviewers(dirPath, files, self.reviewers, self.mergers, self.commands)
+        mentions = []
+        appendMentions(dirPath, files, mentions)
+        mentions = [m for m in mentions if m[2] not in self.bots and m[4] not in self.bots]
+        appendConnectors(files, mentions, self.connectors)
+        self.mentions.extend(mentions)
+        # Drop the roles bots had in this issue, except for merging:
+        # bots merging on command are graphed separately.
+        for (stats, statsFile), n in zip(self.statsList(), start):
+            if statsFile != 'mergers.txt':
+                stats[n:] = [line for line in stats[n:] if line[2] not in self.bots]
+
+    def merge(self, other):
+        """Add the results of a Categorizer that visited the issue directories after ours."""
+        for key, value in other.users.items():
+            # Keep the earliest interaction, as insertUser does.
+            if not key in self.users or value[2] < self.users[key][2]:
+                self.users[key] = value
+        self.issueReporters.extend(other.issueReporters)
+        self.issueResponders.extend(other.issueResponders)
+        self.submitters.extend(other.submitters)
+        self.contributors.extend(other.contributors)
+        self.reviewers.extend(other.reviewers)
+        self.mergers.extend(other.mergers)
+        self.connectors.extend(other.connectors)
+        self.mentions.extend(other.mentions)
+
+    def statsList(self):
+        return [(self.issueReporters, 'reporters.txt'),
+                (self.issueResponders, 'responders.txt'),
+                (self.submitters, 'submitters.txt'),
+                (self.contributors, 'contributors.txt'),
+                (self.reviewers, 'reviewers.txt'),
+                (self.mergers, 'mergers.txt'),
+                (self.connectors, 'connectors.txt')]
+
+def categorizeChunk(chunk):
+    """Returns a Categorizer that has visited a list of issue directories.
+    This runs in the worker processes, so it opens its own store."""
+    repoPath, issueDirs = chunk
+    store = getStore(repoPath)
+    categorizer = Categorizer(getBotCommands(repoPath), getRepoBots(repoPath))
+    # Read the chunk in one pass, in the store's order (for a segment store,
+    # the order it was packed in), then visit it in the order we were given.
+    contents = dict(store.iterRaw(0, issueDirs))
+    for directory in issueDirs:
+        files = [(name, json.loads(data.decode('utf-8'))) for name, data in contents.pop(directory, [])]
+        categorizer.visit(store.path(directory), files)
+    return categorizer
+
+def categorize(store, jobs=1):
+    """Returns a Categorizer that has visited every issue directory in the store."""
+    return categorizeDirs(store, sorted(store.issueDirs(), key=issueSortKey), jobs)
+
+def categorizeDirs(store, issueDirs, jobs=1):
+    """Returns a Categorizer that has visited a sorted list of issue directories."""
+    chunks = [(store.repoPath, issueDirs[i:i + CHUNK_SIZE]) for i in range(0, len(issueDirs), CHUNK_SIZE)]
+    categorizer = Categorizer()
+    pool = None
+    if jobs > 1:
+        pool = Pool(jobs)
+        results = pool.imap(categorizeChunk, chunks)
+    else:
+        results = map(categorizeChunk, chunks)
+    processed = 0
+    # imap returns the chunks in order, so merging is deterministic.
+    for chunk, partial in zip(chunks, results):
+        categorizer.merge(partial)
+        processed += len(chunk[1])
+        print('Processed', processed, 'issues')
+    if pool:
+        pool.close()
+        pool.join()
+    return categorizer
 
-    users = findUsers(repoPath)
+def openCategorizeState(repoPath):
+    db = sqlite3.connect(os.path.join(repoPath, STATE_NAME))
+    db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    version = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    # The bot command table and the list of bots change the results, too.
+    config = db.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+    digest = hashlib.sha1((getBotCommands(repoPath).digest + '\n' +
+                           '\n'.join(sorted(getRepoBots(repoPath)))).encode('utf-8')).hexdigest()
+    if not version or int(version[0]) != CATEGORIZE_VERSION or not config or config[0] != digest:
+        # Drop the tables rather than empty them, in case their columns changed.
+        for table in ['dirs', 'roles', 'users', 'mentions']:
+            db.execute('DROP TABLE IF EXISTS ' + table)
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(CATEGORIZE_VERSION),))
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('config', ?)", (digest,))
+    db.execute('CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)')
+    # One row per line of the stats files; seq keeps the lines from a directory in order.
+    db.execute('''CREATE TABLE IF NOT EXISTS roles (
+                    dir TEXT NOT NULL,
+                    stats TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT,
+                    date TEXT,
+                    user TEXT,
+                    path TEXT)''')
+    db.execute('CREATE INDEX IF NOT EXISTS roles_dir ON roles (dir)')
+    db.execute('CREATE INDEX IF NOT EXISTS roles_stats ON roles (stats)')
+    db.execute('''CREATE TABLE IF NOT EXISTS mentions (
+                    dir TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT,
+                    date TEXT,
+                    user TEXT,
+                    path TEXT,
+                    mentioned TEXT)''')
+    db.execute('CREATE INDEX IF NOT EXISTS mentions_dir ON mentions (dir)')
+    db.execute('''CREATE TABLE IF NOT EXISTS users (
+                    user TEXT PRIMARY KEY,
+                    dirPath TEXT,
+                    jsonFile TEXT,
+                    date TEXT)''')
+    db.commit()
+    return db
+
+def updateCategorizeState(store, db, jobs=1):
+    """Categorize the issue directories that changed since the last run,
+    and replace their results in the stored results."""
+    issueDirs, fingerprints, changed, removed = changedDirs(store, db)
+    print(len(changed), 'of', len(issueDirs), 'issues changed since the last run,', len(removed), 'removed')
+    partial = categorizeDirs(store, changed, jobs)
+
+    for d in changed + removed:
+        db.execute('DELETE FROM roles WHERE dir = ?', (d,))
+        db.execute('DELETE FROM mentions WHERE dir = ?', (d,))
+    for stats, statsFile in partial.statsList():
+        db.executemany('INSERT INTO roles VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       ((os.path.basename(os.path.dirname(line[3])), statsFile, seq) + tuple(line)
+                        for seq, line in enumerate(stats)))
+    db.executemany('INSERT INTO mentions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   ((os.path.basename(os.path.dirname(line[3])), seq) + tuple(line)
+                    for seq, line in enumerate(partial.mentions)))
+
+    for key, (dirPath, jsonFile, date) in partial.users.items():
+        row = db.execute('SELECT date FROM users WHERE user = ?', (key,)).fetchone()
+        if not row:
+            db.execute('INSERT INTO users VALUES (?, ?, ?, ?)', (key, dirPath, jsonFile, date))
+        elif date < row[0]:
+            db.execute('UPDATE users SET dirPath = ?, jsonFile = ?, date = ? WHERE user = ?',
+                       (dirPath, jsonFile, date, key))
+
+    db.executemany('DELETE FROM dirs WHERE dir = ?', ((d,) for d in removed))
+    db.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?)', ((d, fingerprints[d]) for d in changed))
+    db.commit()
+
+def loadCategorizeState(db):
+    """Returns a Categorizer with the stored results, in the order a full run would produce them."""
+    categorizer = Categorizer()
+    for key, dirPath, jsonFile, date in db.execute('SELECT user, dirPath, jsonFile, date FROM users'):
+        categorizer.users[key] = (dirPath, jsonFile, date)
+    for stats, statsFile in categorizer.statsList():
+        rows = db.execute('SELECT dir, seq, role, date, user, path FROM roles WHERE stats = ?', (statsFile,))
+        rows = sorted(rows, key=lambda row: (issueSortKey(row[0]), row[1]))
+        stats.extend(row[2:] for row in rows)
+    rows = db.execute('SELECT dir, seq, role, date, user, path, mentioned FROM mentions')
+    rows = sorted(rows, key=lambda row: (issueSortKey(row[0]), row[1]))
+    categorizer.mentions.extend(row[2:] for row in rows)
+    return categorizer
+
+def writeInteractions(repoPath, users):
     with open(os.path.join(repoPath, 'first-interactions.txt'), 'w') as interactionsFile:
-        for key, value in users.items():
+        for key, value in firstInteractions(users):
             interactionsFile.write(key + '\t' + value[0] + '\t' + value[1] + '\t' +  value[2] + '\n')
 
-    statsList = createStats(repoPath)
+def writeStats(repoPath, statsList):
     for stats in statsList:
         with open(os.path.join(repoPath, stats[1]), 'w') as statsFile:
             print('Writing', stats[1])
@@ -308,5 +561,28 @@ def main():
                     statsFile.write(item + '\t')
                 statsFile.write('\n')
 
+def main():
+    parser = argparse.ArgumentParser(description='Categorize interactions with scraped github data.')
+    parser.add_argument('repository', help='github repository name')
+    parser.add_argument('owner', help='github username of repository owner')
+    parser.add_argument('--jobs', help='number of processes to categorize issues with', type=int, default=1)
+    parser.add_argument('--incremental', help='only categorize issues that changed since the last --incremental run',
+                        action='store_true', default=False)
+    args = parser.parse_args()
+
+    repoPath = os.path.join(args.owner, args.repository)
+    store = openStore(repoPath)
+
+    if args.incremental:
+        db = openCategorizeState(repoPath)
+        updateCategorizeState(store, db, args.jobs)
+        categorizer = loadCategorizeState(db)
+    else:
+        categorizer = categorize(store, args.jobs)
+    writeInteractions(repoPath, categorizer.users)
+    writeStats(repoPath, categorizer.statsList() + [(categorizer.mentions, 'mentions.txt')])
+    print('Writing events.npz')
+    writeEvents(repoPath, buildEvents(categorizedRows(categorizer.users, categorizer.statsList())))
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program labels the sentiment of the scrubbed comments ghsentiment.py
+# writes (all-comments.txt), with a Stanford CoreNLP server and the empathy
+# model, and writes them out the way SentimentPipeline does, for
+# ghsentimentstats.py to read (all-comments-sentiment.txt).
+#
+# Running SentimentPipeline by hand starts java and loads the models every
+# time. Instead, this talks to a CoreNLP server that stays running: if there
+# isn't one at --server, and you pass --corenlp path/to/CoreNLP, it starts one
+# there (and leaves it running for next time, unless you pass --stop).
+#
+# Comments are sent BATCH_SIZE at a time, separated by a blank line, which
+# always ends a sentence. Each sentence the server finds is matched back to
+# its comment by its character offset, so a sentence never spans two
+# comments (SentimentPipeline -stdin joins lines into one sentence). --jobs
+# requests are in flight at once, and the results are written in the order of
+# the input file. To run it:
+#
+# python ghcorenlp.py owner/repo/all-comments.txt owner/repo/all-comments-sentiment.txt --corenlp path/to/CoreNLP
+
+import os
+import re
+import json
+import time
+import bisect
+import argparse
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+
+CORENLP_URL = 'http://localhost:9000'
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'empathy-model', 'empathy-model.ser.gz')
+
+# Comments per request, and the most characters in one (by default, the
+# server refuses requests over 100,000 characters)
+BATCH_SIZE = 50
+BATCH_CHARS = 50000
+# Requests queued per job, so the server always has the next one
+READ_AHEAD = 2
+# Seconds the server spends on a request before it gives up with an error.
+# Loading the models makes the first request slow.
+SERVER_TIMEOUT = 600
+# We wait a little longer, so that the server's error arrives first
+REQUEST_TIMEOUT = SERVER_TIMEOUT + 60
+START_TIMEOUT = 300
+
+# SentimentPipeline's names for the classes, from 0 to 4
+SENTIMENT_LABELS = ['Very negative', 'Negative', 'Neutral', 'Positive', 'Very positive']
+
+COMMENT_SEPARATOR = '\n\n'
+
+# The line ghsentiment.py writes before each comment
+headerPattern = re.compile(r'^#(.+\.json) \. $')
+
+def readComments(path):
+    """Yield (json path, scrubbed text) for each comment in a file written by ghsentiment.py."""
+    jsonPath = None
+    lines = []
+    # Only '\n' ends a line; the text may have other line breaks in it
+    with open(path, newline='\n') as f:
+        for line in f:
+            line = line[:-1] if line.endswith('\n') else line
+            match = headerPattern.match(line)
+            if not match:
+                if jsonPath is not None:
+                    lines.append(line)
+                continue
+            if jsonPath is not None:
+                yield jsonPath, commentText(lines)
+            jsonPath = match.group(1)
+            lines = []
+    if jsonPath is not None:
+        yield jsonPath, commentText(lines)
+
+def commentText(lines):
+    # Each comment ends with a line with just a '.'
+    if lines and lines[-1] == '.':
+        lines = lines[:-1]
+    return '\n'.join(lines)
+
+def batches(comments, size=BATCH_SIZE, chars=BATCH_CHARS):
+    """Group (path, text) into lists of at most size comments, and (unless
+    a comment is longer on its own) at most chars characters."""
+    batch = []
+    length = 0
+    for comment in comments:
+        if batch and (len(batch) >= size or length + len(comment[1]) > chars):
+            yield batch
+            batch = []
+            length = 0
+        batch.append(comment)
+        length += len(comment[1]) + len(COMMENT_SEPARATOR)
+    if batch:
+        yield batch
+
+def utf16Length(text):
+    """Java counts characters outside the Basic Multilingual Plane twice."""
+    return len(text.encode('utf-16-le')) // 2
+
+def sentenceText(tokens):
+    """Returns a sentence's original text, on one line."""
+    text = tokens[0]['originalText'] + ''.join(t['before'] + t['originalText'] for t in tokens[1:])
+    return ' '.join(text.splitlines())
+
+class CoreNLPError(Exception):
+    pass
+
+class CoreNLPClient:
+    """Splits text into sentences and labels their sentiment, with a CoreNLP server.
+    Safe to share between threads."""
+
+    def __init__(self, url=CORENLP_URL, model=MODEL_PATH):
+        self.url = url.rstrip('/')
+        self.properties = json.dumps({
+            'annotators': 'tokenize,ssplit,parse,sentiment',
+            'parse.binaryTrees': 'true',
+            'ssplit.newlineIsSentenceBreak': 'two',
+            'sentiment.model': os.path.abspath(model),
+            'outputFormat': 'json',
+        })
+        # One session per labelling thread, so each keeps its own connection to the
+        # server open between batches instead of sharing one across threads.
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def isRunning(self):
+        try:
+            self.session().get(self.url + '/', timeout=5)
+        except (requests.ConnectionError, requests.Timeout):
+            return False
+        return True
+
+    def annotate(self, text):
+        """Returns the server's list of sentences in the text."""
+        response = self.session().post(self.url + '/', params={'properties': self.properties},
+                                       data=text.encode('utf-8'),
+                                       headers={'Content-Type': 'text/plain; charset=utf-8'},
+                                       timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise CoreNLPError('CoreNLP server error ' + str(response.status_code) + ': ' + response.text[:200])
+        return response.json()['sentences']
+
+    def sentiment(self, batch):
+        """Returns [(path, [(sentence, label), ...]), ...] for a batch of (path, text)."""
+        starts = []
+        offset = 0
+        for path, text in batch:
+            starts.append(offset)
+            offset += utf16Length(text) + len(COMMENT_SEPARATOR)
+        results = [(path, []) for path, text in batch]
+        for sentence in self.annotate(COMMENT_SEPARATOR.join(text for path, text in batch)):
+            tokens = sentence['tokens']
+            if not tokens:
+                continue
+            comment = bisect.bisect_right(starts, tokens[0]['characterOffsetBegin']) - 1
+            results[comment][1].append((sentenceText(tokens), SENTIMENT_LABELS[int(sentence['sentimentValue'])]))
+        return results
+
+def batchSentiment(client, batch):
+    """Like CoreNLPClient.sentiment(), but if the server can't label a batch
+    (e.g. it times out, or drops the connection), label its comments one at
+    a time instead, and skip any comment it can't label."""
+    try:
+        return client.sentiment(batch)
+    except (CoreNLPError, requests.RequestException) as e:
+        if len(batch) == 1:
+            # Don't skip every comment if the server is gone
+            if not client.isRunning():
+                raise
+            print('WARN: skipping', batch[0][0] + ':', e)
+            return [(batch[0][0], [])]
+    results = []
+    for comment in batch:
+        results.extend(batchSentiment(client, [comment]))
+    return results
+
+def streamSentiment(client, comments, jobs=4):
+    """Yield (path, [(sentence, label), ...]) for each (path, text), in order,
+    with jobs requests in flight."""
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for batch in batches(comments):
+            pending.append(pool.submit(batchSentiment, client, batch))
+            if len(pending) >= jobs * READ_AHEAD:
+                for result in pending.popleft().result():
+                    yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+
+def writeSentiment(f, path, sentences):
+    # SentimentPipeline splits the '#owner/repo/.../comment-1.json . ' line
+    # ghsentiment.py writes into two sentences, which ghsentimentstats.py
+    # uses to find the path, and otherwise skips.
+    f.write('#' + path[:-len('json')] + '\n  Neutral\njson .\n  Neutral\n')
+    for sentence, label in sentences:
+        f.write(sentence + '\n  ' + label + '\n')
+
+def startServer(corenlpDir, port, threads):
+    """Start a CoreNLP server in a CoreNLP directory (set up as in the README).
+    It keeps running after this program exits; its output is in corenlp-server.log."""
+    log = open(os.path.join(corenlpDir, 'corenlp-server.log'), 'a')
+    command = ['java', '-cp', 'stanford-corenlp.jar', '-Djava.ext.dirs=lib:liblocal', '-mx5g',
+               'edu.stanford.nlp.pipeline.StanfordCoreNLPServer',
+               '-port', str(port), '-threads', str(threads), '-timeout', str(SERVER_TIMEOUT * 1000)]
+    print('Starting CoreNLP server:', ' '.join(command))
+    return subprocess.Popen(command, cwd=corenlpDir, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+def waitForServer(client, process):
+    start = time.time()
+    while not client.isRunning():
+        if process.poll() is not None:
+            raise CoreNLPError('CoreNLP server exited with status ' + str(process.returncode))
+        if time.time() - start > START_TIMEOUT:
+            raise CoreNLPError('CoreNLP server did not start in ' + str(START_TIMEOUT) + ' seconds')
+        time.sleep(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Label the sentiment of scrubbed comments with a CoreNLP server')
+    parser.add_argument('inFile', help='scrubbed comments, from ghsentiment.py (e.g. owner/repo/all-comments.txt)')
+    parser.add_argument('outFile', help='output file (e.g. owner/repo/all-comments-sentiment.txt)')
+    parser.add_argument('--server', help='URL of the CoreNLP server', default=CORENLP_URL)
+    parser.add_argument('--corenlp', help="path to CoreNLP, to start a server if there isn't one running",
+                        default=None)
+    parser.add_argument('--model', help='sentiment model', default=MODEL_PATH)
+    parser.add_argument('--jobs', help='number of requests to the server at once', type=int, default=4)
+    parser.add_argument('--stop', help='stop the server when done, if this started it',
+                        action='store_true', default=False)
+    args = parser.parse_args()
+
+    client = CoreNLPClient(args.server, args.model)
+    process = None
+    if not client.isRunning():
+        if not args.corenlp:
+            print('No CoreNLP server at', args.server + '; pass --corenlp to start one')
+            return
+        process = startServer(args.corenlp, urlsplit(args.server).port or 80, args.jobs)
+        waitForServer(client, process)
+
+    count = 0
+    try:
+        with open(args.outFile, 'w') as f:
+            for path, sentences in streamSentiment(client, readComments(args.inFile), args.jobs):
+                writeSentiment(f, path, sentences)
+                count = count + 1
+                if count % 5000 == 0:
+                    print('Labeled', count, 'comments')
+    finally:
+        if process is not None and args.stop:
+            process.terminate()
+    print('Labeled', count, 'comments')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program loads the scraped json into a SQLite database, so that the
+# analysis scripts can look up who opened what, when a pull request was
+# merged, and who commented where, without reading every json file.
+#
+# The database is owner/repo/analytics.sqlite, with the tables:
+#
+#  - issues: one row per issue-<id>.json (pull requests have one too)
+#  - prs: one row per pr-<id>.json
+#  - comments: one row per comment-<id>.json
+#  - review_comments: one row per pr-comment-<id>.json
+#  - users: the login and type of every user seen
+#
+# Each row has the issue directory (issue-<id>) and the path scripts use to
+# refer to the json file (owner/repo/issue-<id>/comment-<id>.json). Users are
+# stored by login, with 'ghost' for deleted users, as getUserDate() does.
+#
+# The database is updated incrementally: only issue directories whose
+# fingerprint changed (see ghstore.py) are reloaded. To build or update it:
+#
+# python ghdb.py GITHUB_REPO_NAME GITHUB_OWNER_NAME
+#
+# Scripts that use the database call openDb(), which doesn't look at every
+# json file. It only updates the database if there isn't one yet, or if the
+# scrape manifest (see ghmanifest.py) or the segment store index (see
+# ghstore.py) changed since the last update, i.e. if more data was scraped,
+# imported, or packed.
+#
+# Every table is indexed by created_at, so scripts that take --since and
+# --until (see dateWindow()) only look at the rows in that date range.
+
+import os
+import sqlite3
+import argparse
+from ghcategorize import getUserDate
+from ghstore import openStore, changedDirs, STORE_DIR, INDEX_NAME
+from ghmanifest import MANIFEST_NAME
+from ghwalk import fileKind, ISSUE, PR, COMMENT, REVIEW_COMMENT
+
+DB_NAME = 'analytics.sqlite'
+
+# Bump this when the tables change, so that the database is rebuilt.
+DB_VERSION = 1
+
+TABLES = ['issues', 'prs', 'comments', 'review_comments']
+
+def createTables(db):
+    db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    version = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if version and int(version[0]) != DB_VERSION:
+        for table in TABLES + ['users', 'dirs']:
+            db.execute('DROP TABLE IF EXISTS ' + table)
+    db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(DB_VERSION),))
+    db.execute('CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)')
+    db.execute('''CREATE TABLE IF NOT EXISTS issues (
+                    dir TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    id INTEGER,
+                    number INTEGER,
+                    user TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    state TEXT,
+                    html_url TEXT,
+                    is_pr INTEGER)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS prs (
+                    dir TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    id INTEGER,
+                    number INTEGER,
+                    user TEXT,
+                    created_at TEXT,
+                    state TEXT,
+                    merged INTEGER,
+                    merged_at TEXT,
+                    merged_by TEXT)''')
+    for table in ['comments', 'review_comments']:
+        db.execute('''CREATE TABLE IF NOT EXISTS %s (
+                        path TEXT PRIMARY KEY,
+                        dir TEXT NOT NULL,
+                        id INTEGER,
+                        user TEXT,
+                        created_at TEXT)''' % table)
+        db.execute('CREATE INDEX IF NOT EXISTS %s_dir ON %s (dir)' % (table, table))
+        db.execute('CREATE INDEX IF NOT EXISTS %s_user ON %s (user, dir)' % (table, table))
+    db.execute('CREATE INDEX IF NOT EXISTS issues_user ON issues (user)')
+    db.execute('CREATE INDEX IF NOT EXISTS prs_user ON prs (user)')
+    for table in TABLES:
+        db.execute('CREATE INDEX IF NOT EXISTS %s_created ON %s (created_at)' % (table, table))
+    db.execute('''CREATE TABLE IF NOT EXISTS users (
+                    login TEXT PRIMARY KEY,
+                    type TEXT)''')
+    db.commit()
+
+def dateWindow(since=None, until=None, column='created_at', inclusive=False):
+    """Returns an SQL condition and its parameters, for rows with the column
+    from since up to (but not including) until, or up to and including until
+    if inclusive is set."""
+    conditions = []
+    params = []
+    # github dates sort as strings
+    if since is not None:
+        conditions.append(column + ' >= ?')
+        params.append(since.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    if until is not None:
+        conditions.append(column + (' <= ?' if inclusive else ' < ?'))
+        params.append(until.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    if not conditions:
+        return '1', params
+    return ' AND '.join(conditions), params
+
+def pathsInWindow(db, since=None, until=None):
+    """Returns the set of json file paths created from since up to (but not including) until."""
+    condition, params = dateWindow(since, until)
+    paths = set()
+    for table in TABLES:
+        paths.update(row[0] for row in db.execute('SELECT path FROM ' + table + ' WHERE ' + condition, params))
+    return paths
+
+def login(user):
+    if not user:
+        return None
+    return user['login']
+
+def insertIssueDir(db, store, issueDir):
+    for name in store.files(issueDir):
+        soup = store.load(issueDir, name)
+        path = store.path(issueDir, name)
+        user, date = getUserDate(soup)
+        if soup['user']:
+            db.execute('INSERT OR REPLACE INTO users VALUES (?, ?)', (user, soup['user'].get('type')))
+        kind = fileKind(name)
+        if kind == ISSUE:
+            db.execute('INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (issueDir, path, soup.get('id'), soup.get('number'), user, date,
+                        soup.get('updated_at'), soup.get('state'), soup.get('html_url'),
+                        int('pull_request' in soup)))
+        elif kind == PR:
+            db.execute('INSERT OR REPLACE INTO prs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (issueDir, path, soup.get('id'), soup.get('number'), user, date,
+                        soup.get('state'), int(bool(soup.get('merged'))), soup.get('merged_at'),
+                        login(soup.get('merged_by'))))
+        elif kind == REVIEW_COMMENT:
+            db.execute('INSERT OR REPLACE INTO review_comments VALUES (?, ?, ?, ?, ?)',
+                       (path, issueDir, soup.get('id'), user, date))
+        elif kind == COMMENT:
+            db.execute('INSERT OR REPLACE INTO comments VALUES (?, ?, ?, ?, ?)',
+                       (path, issueDir, soup.get('id'), user, date))
+
+def sourceTime(repoPath):
+    """Returns the last time the scraper, importer, or ghstore.py changed
+    what's stored, or None if we can't tell."""
+    times = []
+    for name in [MANIFEST_NAME, os.path.join(STORE_DIR, INDEX_NAME)]:
+        try:
+            times.append(os.path.getmtime(os.path.join(repoPath, name)))
+        except OSError:
+            pass
+    return max(times) if times else None
+
+def isStale(repoPath, db):
+    """Whether the json may have changed since the database was last updated."""
+    updated = db.execute("SELECT value FROM meta WHERE key = 'source_time'").fetchone()
+    changed = sourceTime(repoPath)
+    if changed is None:
+        return False
+    return not updated or changed > float(updated[0])
+
+def updateDb(store, db):
+    """Reload the issue directories that changed since the database was last updated."""
+    # Note the time first, so that anything scraped while we update is seen next time.
+    sourceChanged = sourceTime(store.repoPath)
+    if sourceChanged is not None:
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('source_time', ?)", (repr(sourceChanged),))
+    issueDirs, fingerprints, changed, removed = changedDirs(store, db)
+    if not changed and not removed:
+        db.commit()
+        return
+    print('Loading', len(changed), 'of', len(issueDirs), 'issues into', DB_NAME + ',', len(removed), 'removed')
+    for d in removed:
+        for table in TABLES:
+            db.execute('DELETE FROM ' + table + ' WHERE dir = ?', (d,))
+        db.execute('DELETE FROM dirs WHERE dir = ?', (d,))
+    processed = 0
+    for d in changed:
+        for table in TABLES:
+            db.execute('DELETE FROM ' + table + ' WHERE dir = ?', (d,))
+        insertIssueDir(db, store, d)
+        db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?)', (d, fingerprints[d]))
+        processed += 1
+        if (processed % 1000) == 0:
+            db.commit()
+            print('Loaded', processed, 'issues')
+    db.commit()
+
+def openDb(repoPath, update=False):
+    """Returns a connection to the repository's database. With update, or if
+    the database is missing or stale (see isStale()), it's first updated to
+    match the scraped json."""
+    db = sqlite3.connect(os.path.join(repoPath, DB_NAME))
+    createTables(db)
+    if update or isStale(repoPath, db) or not db.execute('SELECT 1 FROM dirs LIMIT 1').fetchone():
+        updateDb(openStore(repoPath), db)
+    return db
+
+def main():
+    parser = argparse.ArgumentParser(description='Load scraped github data into a SQLite database for analysis.')
+    parser.add_argument('repository', help='github repository name')
+    parser.add_argument('owner', help='github username of repository owner')
+    args = parser.parse_args()
+
+    repoPath = os.path.join(args.owner, args.repository)
+    db = openDb(repoPath, update=True)
+    for table in TABLES + ['users']:
+        print('{:,} {}'.format(db.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0], table))
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library converts unicode emoji in comments to their short codes
+# (e.g. :thumbsup:), so the sentiment model sees each emoji as a word.
+#
+# The empathy model was trained on the short codes in language/emojis.txt,
+# which are github's names for the emoji. emoji.demojize() uses the unicode
+# names instead (e.g. :thumbs_up_sign:), which the model has never seen. So
+# the emoji are looked up in the emoji package's tables, and each one is
+# converted to:
+#
+#  - a github name for it that's in language/emojis.txt, or
+#  - its github name, or
+#  - its unicode name, if github doesn't have one
+#
+# emoji.demojize() also tries every emoji at every character of the text.
+# Instead, the emoji are put into one regular expression that follows a trie
+# of their characters (see ghtrie.py), compiled once. It's only used on the
+# runs of non-ASCII characters, and text with no non-ASCII characters (most
+# comments) isn't searched at all.
+
+import os
+import re
+import hashlib
+from emoji import unicode_codes
+from ghtrie import trieRegex
+
+EMOJIS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'language', 'emojis.txt')
+
+nonAsciiPattern = re.compile('[^\x00-\x7f]')
+
+# Emoji are non-ASCII characters, except for keycaps (e.g. '1 \u20e3'), and the
+# spaces between the letters of flags in the emoji package's tables.
+# Every emoji in the text is inside one of these runs.
+emojiRunPattern = re.compile('[#*0-9]? ?[^\x00-\x7f]+(?: [^\x00-\x7f]+)*')
+
+# Lines of emojis.txt are sentiment trees, e.g. (4 (2 :) (4 (4 smile) (2 :)))
+treePattern = re.compile(r'^\(\d \(2 :\) \(\d \(\d (\S+)\) \(2 :\)\)\)\s*$')
+
+def trainedShortcodes(path=EMOJIS_PATH):
+    """Returns the set of short codes (with colons) the sentiment model was trained on."""
+    shortcodes = set()
+    with open(path) as f:
+        for line in f:
+            match = treePattern.match(line)
+            if match:
+                shortcodes.add(':' + match.group(1) + ':')
+    return shortcodes
+
+def shortcodeTable(trained):
+    """Returns a dictionary of unicode emoji to the short code to convert them to."""
+    aliases = {}
+    for alias, code in unicode_codes.EMOJI_ALIAS_UNICODE.items():
+        aliases.setdefault(code, []).append(alias)
+    table = {}
+    for code in set(unicode_codes.UNICODE_EMOJI) | set(aliases):
+        default = unicode_codes.UNICODE_EMOJI_ALIAS.get(code)
+        names = sorted(aliases.get(code, []))
+        # Prefer github's usual name for the emoji, if the model knows it
+        if default in names:
+            names.remove(default)
+            names.insert(0, default)
+        if code in unicode_codes.UNICODE_EMOJI:
+            names.append(unicode_codes.UNICODE_EMOJI[code])
+        known = [name for name in names if name in trained]
+        table[code] = (known or names)[0]
+    return table
+
+class EmojiConverter:
+    """Converts the emoji in a table (unicode to short code) to their short codes.
+    Where emoji overlap, the longest one is converted, like emoji.demojize()."""
+
+    def __init__(self, table):
+        self.table = table
+        self.pattern = re.compile(trieRegex(table))
+        # Changes to the table change the scrubbed text (see ghscrub.scrubVersion())
+        self.digest = hashlib.sha1('\n'.join(sorted(code + ' ' + name for code, name in table.items()))
+                                   .encode('utf-8')).hexdigest()
+
+    def replace(self, match):
+        return self.table[match.group(0)]
+
+    def convert(self, text):
+        if not nonAsciiPattern.search(text):
+            return text
+        # Only search the runs of text that could have emoji in them
+        pieces = []
+        pos = 0
+        for run in emojiRunPattern.finditer(text):
+            pieces.append(text[pos:run.start()])
+            pieces.append(self.pattern.sub(self.replace, run.group(0)))
+            pos = run.end()
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
+converter = None
+
+def getConverter():
+    global converter
+    if converter is None:
+        converter = EmojiConverter(shortcodeTable(trainedShortcodes()))
+    return converter
+
+def demojize(text):
+    """Returns the text with emoji converted to the short codes the sentiment model knows."""
+    return getConverter().convert(text)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library stores the output of ghcategorize.py as one table of events,
+# in columns, so the analysis scripts don't have to re-parse the tab
+# separated files (and every date in them) each time they run.
+#
+# ghcategorize.py writes owner/repo/events.npz next to the text files. Each
+# line of first-interactions.txt and the role files is one event, with:
+#
+#  - role: index into ROLES ('first' for first-interactions.txt)
+#  - time: seconds since the epoch (UTC)
+#  - user: index into the list of usernames
+#  - path: index into the list of json file paths
+#  - issue: index into the list of issue directories (owner/repo/issue-<id>)
+#
+# Events are in the same order as the lines of the text files, role by role.
+# If events.npz is missing or older than the text files, loadEvents() reads
+# the text files instead.
+#
+# events.npz also stores a date index: the positions of the events, sorted by
+# time. Events.window() finds the events in a date range with a binary search
+# on the index, so a report on one quarter only looks at that quarter's events.
+# Scripts that take --since and --until (see addWindowArguments()) use it.
+
+import os
+import numpy
+from datetime import datetime, timedelta
+
+EVENTS_NAME = 'events.npz'
+
+ROLES = ['first', 'reporter', 'responder', 'submitter', 'contributor', 'reviewer', 'merger', 'connector']
+ROLE_FILES = ['first-interactions.txt', 'reporters.txt', 'responders.txt', 'submitters.txt',
+              'contributors.txt', 'reviewers.txt', 'mergers.txt', 'connectors.txt']
+
+EPOCH = datetime(1970, 1, 1)
+
+def parseDay(day):
+    """Parse a --since or --until date (YYYY-MM-DD)."""
+    return datetime.strptime(day, '%Y-%m-%d')
+
+def addWindowArguments(parser):
+    parser.add_argument('--since', help='only look at activity on or after this date (YYYY-MM-DD)',
+                        type=parseDay, default=None)
+    parser.add_argument('--until', help='only look at activity before this date (YYYY-MM-DD)',
+                        type=parseDay, default=None)
+
+def roleForFile(name):
+    """The role of the events in a text file, e.g. 'reviewer' for reviewers.txt."""
+    return ROLES[ROLE_FILES.index(name)]
+
+def toDatetime(seconds):
+    """Convert an event time to a datetime, like datetime.strptime on the github date would."""
+    return EPOCH + timedelta(seconds=int(seconds))
+
+def toSeconds(date):
+    """Convert a datetime to an event time."""
+    return int((date - EPOCH).total_seconds())
+
+def parseDates(dates):
+    """Convert github dates (%Y-%m-%dT%H:%M:%SZ) to seconds since the epoch."""
+    return numpy.array([d.rstrip('Z') for d in dates], dtype='datetime64[s]').astype(numpy.int64)
+
+# Lists of strings are stored as one newline separated utf-8 array,
+# which loads much faster than a numpy array of python strings.
+def packStrings(strings):
+    return numpy.frombuffer('\n'.join(strings).encode('utf-8'), dtype=numpy.uint8)
+
+def unpackStrings(array):
+    if not len(array):
+        return []
+    return array.tobytes().decode('utf-8').split('\n')
+
+class Events:
+    """The categorized events for a repository, as columns."""
+
+    def __init__(self, role, time, user, path, issue, users, paths, issues, order=None):
+        self.role = role
+        self.time = time
+        self.user = user
+        self.path = path
+        self.issue = issue
+        self.users = users
+        self.paths = paths
+        self.issues = issues
+        # The date index: event positions, sorted by time (mergesort is stable)
+        if order is None:
+            order = numpy.argsort(time, kind='mergesort')
+        self.order = order
+
+    def where(self, *roles):
+        """Returns the indices of the events in each role, in the order the roles are given."""
+        if not roles:
+            return numpy.arange(len(self.role))
+        return numpy.concatenate([numpy.nonzero(self.role == ROLES.index(r))[0] for r in roles])
+
+    def window(self, since=None, until=None):
+        """Returns the Events from since up to (but not including) until, in the same order.
+        The strings are shared, so indices into users, paths, and issues don't change."""
+        if since is None and until is None:
+            return self
+        times = self.time[self.order]
+        start = 0
+        end = len(times)
+        if since is not None:
+            start = numpy.searchsorted(times, toSeconds(since), side='left')
+        if until is not None:
+            end = numpy.searchsorted(times, toSeconds(until), side='left')
+        rows = numpy.sort(self.order[start:end])
+        return Events(self.role[rows], self.time[rows], self.user[rows], self.path[rows],
+                      self.issue[rows], self.users, self.paths, self.issues)
+
+def buildEvents(rows):
+    """Returns Events for a list of (role, date, username, json file path)."""
+    roles = []
+    dates = []
+    columns = {'user': [], 'path': [], 'issue': []}
+    # The list of each column's strings, and the index of each string in it.
+    # Dictionaries don't keep insertion order before Python 3.7, so the list
+    # is kept separately.
+    strings = {'user': [], 'path': [], 'issue': []}
+    indexes = {'user': {}, 'path': {}, 'issue': {}}
+    for role, date, user, path in rows:
+        roles.append(ROLES.index(role))
+        dates.append(date)
+        for column, value in [('user', user), ('path', path), ('issue', os.path.dirname(path))]:
+            # Intern the string
+            index = indexes[column].get(value)
+            if index is None:
+                index = len(strings[column])
+                indexes[column][value] = index
+                strings[column].append(value)
+            columns[column].append(index)
+    return Events(numpy.array(roles, dtype=numpy.uint8),
+                  parseDates(dates),
+                  numpy.array(columns['user'], dtype=numpy.int32),
+                  numpy.array(columns['path'], dtype=numpy.int32),
+                  numpy.array(columns['issue'], dtype=numpy.int32),
+                  strings['user'], strings['path'], strings['issue'])
+
+def firstInteractions(users):
+    """Returns a list of (username, (dirPath, jsonFile, date)) for ghcategorize.py's
+    users dictionary, sorted by date and then username. Dictionaries don't keep
+    their insertion order before Python 3.7, so the order has to be explicit."""
+    return sorted(users.items(), key=lambda item: (item[1][2], item[0]))
+
+def categorizedRows(users, statsList):
+    """Yield (role, date, username, json file path) for ghcategorize.py's results."""
+    for user, (dirPath, jsonFile, date) in firstInteractions(users):
+        yield 'first', date, user, os.path.join(dirPath, jsonFile)
+    for stats, statsFile in sorted(statsList, key=lambda s: ROLE_FILES.index(s[1])):
+        for role, date, user, path in stats:
+            yield role, date, user, path
+
+def textRows(repoPath):
+    """Yield (role, date, username, json file path) for the lines in the text files."""
+    for statsFile in ROLE_FILES:
+        # Categorized before connectors.txt was added
+        if not os.path.exists(os.path.join(repoPath, statsFile)):
+            continue
+        with open(os.path.join(repoPath, statsFile)) as f:
+            for line in f:
+                line = line.split('\t')
+                if len(line) < 4:
+                    continue
+                if statsFile == 'first-interactions.txt':
+                    yield 'first', line[3].rstrip('\n'), line[0], os.path.join(line[1], line[2])
+                else:
+                    yield line[0], line[1], line[2], line[3]
+
+def writeEvents(repoPath, events):
+    path = os.path.join(repoPath, EVENTS_NAME)
+    # numpy adds .npz to the name if it's not there
+    tmpPath = os.path.join(repoPath, 'events.tmp.npz')
+    numpy.savez(tmpPath, role=events.role, time=events.time, user=events.user,
+                path=events.path, issue=events.issue, users=packStrings(events.users),
+                paths=packStrings(events.paths), issues=packStrings(events.issues),
+                order=events.order)
+    os.replace(tmpPath, path)
+
+def loadEvents(repoPath):
+    """Returns the Events for a categorized repository."""
+    path = os.path.join(repoPath, EVENTS_NAME)
+    textFiles = [os.path.join(repoPath, f) for f in ROLE_FILES]
+    if os.path.exists(path) and all(os.path.getmtime(path) >= os.path.getmtime(f)
+                                    for f in textFiles if os.path.exists(f)):
+        with numpy.load(path) as data:
+            # Written before the date index was added
+            order = data['order'] if 'order' in data.files else None
+            return Events(data['role'], data['time'], data['user'], data['path'], data['issue'],
+                          unpackStrings(data['users']), unpackStrings(data['paths']),
+                          unpackStrings(data['issues']), order)
+    return buildEvents(textRows(repoPath))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program imports github public event archives into the same tree
+# structure ghscraper.py writes:
+#
+# .
+# |-- github owner
+#     |-- repository name
+#         |-- issue-<id>
+#         |   |-- issue-<id>.json
+#         |   |-- comment-<id>.json
+#         |   |-- pr-<id>.json
+#         |   |-- pr-comment-<id>.json
+#
+# The archives are the hourly, gzipped files from http://www.gharchive.org/
+# (e.g. 2015-01-01-15.json.gz), downloaded ahead of time. Each line is one
+# json event. We look at four types of events:
+#
+#  - IssuesEvent: payload.issue is written to issue-<id>.json
+#  - IssueCommentEvent: payload.issue is written to issue-<id>.json,
+#    and payload.comment to comment-<id>.json
+#  - PullRequestEvent: payload.pull_request is written to pr-<id>.json
+#  - PullRequestReviewCommentEvent: payload.comment is written to pr-comment-<id>.json
+#
+# Archive files are filtered in parallel, one file per process, and the
+# events for our repository are written in the order they happened. If an
+# object shows up in more than one event (e.g. an issue is edited, then
+# closed), the last event wins. Files that were already in the tree before
+# the import are never overwritten, since the scraper's json has more fields
+# (e.g. body_text) than the event payloads. That includes files packed with
+# ghstore.py, whose issue directories may be gone; the import recreates them.
+#
+# Pull requests and review comments are filed under the issue with the same
+# number. If we never see that issue (e.g. a pull request that nobody
+# commented on, opened before our archives start), we can't know the
+# issue id, so the pull request is skipped and counted. Running ghscraper.py
+# afterwards fills in anything the archives are missing.
+#
+# Note that events from before 2015 use a different payload format, and
+# aren't imported.
+
+import os
+import re
+import gzip
+import json
+import argparse
+from multiprocessing import Pool
+from ghmanifest import openManifest, recordIssue, markDone, issueDirsByNumber
+from ghstore import SegmentStore, hasSegmentStore
+from ghprofile import prune, repoProfile
+
+EVENT_TYPES = ['IssuesEvent', 'IssueCommentEvent', 'PullRequestEvent', 'PullRequestReviewCommentEvent']
+
+def archiveSortKey(path):
+    """Sort archives by date and hour (so that 2015-01-01-2 comes before 2015-01-01-10)."""
+    m = re.match(r'(\d+)-(\d+)-(\d+)-(\d+)', os.path.basename(path))
+    if not m:
+        return ((), os.path.basename(path))
+    return (tuple(int(x) for x in m.groups()), os.path.basename(path))
+
+def filterArchive(args):
+    """Return a list of (event type, payload) for a repository's events in one archive file."""
+    path, fullName = args
+    # Most lines are for other repositories, so check for the
+    # repository name before paying to decode the json.
+    needle = '"' + fullName + '"'
+    events = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if needle not in line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get('type') not in EVENT_TYPES:
+                continue
+            if event.get('repo', {}).get('name') != fullName:
+                continue
+            events.append((event['type'], event['payload']))
+    return events
+
+class ArchiveImporter:
+    """Writes events to the tree, in the order they are given."""
+
+    def __init__(self, repoPath, db):
+        self.repoPath = repoPath
+        self.db = db
+        self.dirs = issueDirsByNumber(db)
+        # Files we've written during this import, which later events may overwrite
+        self.written = set()
+        # Pull requests and review comments waiting for their issue, by issue number
+        self.pending = {}
+        self.counts = {'issue-': 0, 'comment-': 0, 'pr-': 0, 'pr-comment-': 0}
+        # Files packed by ghstore.py are in the tree, too
+        self.packed = SegmentStore(repoPath) if hasSegmentStore(repoPath) else None
+
+    def inTree(self, dirName, name):
+        """Whether a file is in its issue directory, or packed."""
+        if os.path.exists(os.path.join(self.repoPath, dirName, name)):
+            return True
+        return self.packed is not None and name in self.packed.packedTimes(dirName)
+
+    def write(self, dirName, prefix, soup):
+        name = prefix + str(soup['id']) + '.json'
+        fp = os.path.join(self.repoPath, dirName, name)
+        if fp not in self.written and self.inTree(dirName, name):
+            return
+        # The issue directory is gone if it was packed with ghstore.py pack --remove
+        if not os.path.exists(os.path.dirname(fp)):
+            os.makedirs(os.path.dirname(fp))
+        with open(fp, 'w') as f:
+            f.write(json.dumps(prune(soup, repoProfile(self.repoPath))))
+        if fp not in self.written:
+            self.counts[prefix] += 1
+        self.written.add(fp)
+
+    def writeIssue(self, issue):
+        dirName = 'issue-' + str(issue['id'])
+        self.write(dirName, 'issue-', issue)
+        recordIssue(self.db, dirName, issue)
+        self.dirs[issue['number']] = dirName
+        for prefix, soup in self.pending.pop(issue['number'], []):
+            self.writePullRequest(issue['number'], prefix, soup)
+        return dirName
+
+    def writePullRequest(self, number, prefix, soup):
+        if number not in self.dirs:
+            self.pending.setdefault(number, []).append((prefix, soup))
+            return
+        self.write(self.dirs[number], prefix, soup)
+        if prefix == 'pr-':
+            markDone(self.db, self.dirs[number], 'pr_done')
+
+    def importEvent(self, eventType, payload):
+        if eventType == 'IssuesEvent':
+            self.writeIssue(payload['issue'])
+        elif eventType == 'IssueCommentEvent':
+            dirName = self.writeIssue(payload['issue'])
+            self.write(dirName, 'comment-', payload['comment'])
+        elif eventType == 'PullRequestEvent':
+            self.writePullRequest(payload['pull_request']['number'], 'pr-', payload['pull_request'])
+        elif eventType == 'PullRequestReviewCommentEvent':
+            self.writePullRequest(payload['pull_request']['number'], 'pr-comment-', payload['comment'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Import issues, comments and pull requests from github event archives.')
+    parser.add_argument('repository', help='github repository name')
+    parser.add_argument('owner', help='github username of repository owner')
+    parser.add_argument('archives', help='gzipped hourly event archive files', nargs='+')
+    parser.add_argument('--jobs', help='number of archive files to read at once', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    repoPath = os.path.join(args.owner, args.repository)
+    if not os.path.exists(repoPath):
+        os.makedirs(repoPath)
+    db = openManifest(repoPath)
+    importer = ArchiveImporter(repoPath, db)
+
+    fullName = args.owner + '/' + args.repository
+    archives = sorted(args.archives, key=archiveSortKey)
+    with Pool(args.jobs) as pool:
+        # imap hands back each file's events in archive order
+        # while the other processes keep filtering.
+        for processed, events in enumerate(pool.imap(filterArchive, [(a, fullName) for a in archives])):
+            for eventType, payload in events:
+                importer.importEvent(eventType, payload)
+            if ((processed + 1) % 100) == 0:
+                print('Processed', processed + 1, 'of', len(archives), 'archives')
+                db.commit()
+    db.commit()
+
+    for prefix, what in [('issue-', 'issues'), ('comment-', 'comments'),
+                         ('pr-', 'pull requests'), ('pr-comment-', 'review comments')]:
+        print('Imported', importer.counts[prefix], what)
+    unrouted = sum(len(p) for p in importer.pending.values())
+    if unrouted:
+        print('Skipped', unrouted, 'pull requests and review comments for',
+              len(importer.pending), 'issues that were not in the archives')
+
+if __name__ == "__main__":
+    main()
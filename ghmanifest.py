@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library keeps a manifest of what ghscraper.py has scraped, so that
+# the scraper doesn't have to walk the whole tree to find out what's left.
+#
+# Without the manifest, every scraper pass lists every issue directory and
+# re-reads every issue-<id>.json, which takes minutes for repositories with
+# hundreds of thousands of issues (and much longer on network filesystems).
+#
+# The manifest is a SQLite database, owner/repo/scrape-manifest.sqlite,
+# with one row per issue directory:
+#
+#  - dir: the issue directory name, issue-<id>
+#  - number: the issue number, used in API URLs
+#  - is_pr: whether the issue is a pull request
+#  - comments: the number of comments github reported on the issue
+#  - comments_done: whether we have fetched the issue comments
+#  - pr_done: whether we have fetched pr-<id>.json
+#  - reviews_done: whether we have fetched the review comments
+#
+# If the manifest is missing, it is rebuilt from the scraped json (in the
+# issue directories, or packed by ghstore.py) the first time it's opened. To rebuild it by hand (e.g. after copying in scraped files), run:
+#
+# python ghmanifest.py GITHUB_REPO_NAME GITHUB_OWNER_NAME --rebuild
+
+import os
+import sqlite3
+import argparse
+from ghwalk import fileKind, PR, COMMENT, REVIEW_COMMENT
+from ghstore import openStore
+
+MANIFEST_NAME = 'scrape-manifest.sqlite'
+
+def createManifest(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS issues (
+                    dir TEXT PRIMARY KEY,
+                    number INTEGER,
+                    is_pr INTEGER NOT NULL DEFAULT 0,
+                    comments INTEGER NOT NULL DEFAULT 0,
+                    comments_done INTEGER NOT NULL DEFAULT 0,
+                    pr_done INTEGER NOT NULL DEFAULT 0,
+                    reviews_done INTEGER NOT NULL DEFAULT 0)''')
+    db.execute('CREATE INDEX IF NOT EXISTS issues_number ON issues (number)')
+    db.execute('CREATE INDEX IF NOT EXISTS issues_comments ON issues (comments_done, comments)')
+    db.execute('CREATE INDEX IF NOT EXISTS issues_pr ON issues (is_pr, pr_done, reviews_done)')
+    db.commit()
+
+def openManifest(repoPath):
+    """Open the manifest for a scraped repository, rebuilding it from the tree if it doesn't exist."""
+    path = os.path.join(repoPath, MANIFEST_NAME)
+    exists = os.path.exists(path)
+    db = sqlite3.connect(path)
+    createManifest(db)
+    if not exists:
+        rebuildManifest(db, repoPath)
+    return db
+
+def recordIssue(db, dirName, soup):
+    """Add or update an issue from its json. Doesn't change what's been fetched."""
+    db.execute('INSERT OR IGNORE INTO issues (dir) VALUES (?)', (dirName,))
+    db.execute('UPDATE issues SET number = ?, is_pr = ?, comments = ? WHERE dir = ?',
+               (soup['number'], 'pull_request' in soup, int(soup['comments']), dirName))
+
+def hasIssue(db, dirName):
+    """Whether an issue has been scraped. Its directory may be gone, if it was packed
+    with ghstore.py pack --remove."""
+    return db.execute('SELECT 1 FROM issues WHERE dir = ?', (dirName,)).fetchone() is not None
+
+def markDone(db, dirName, column):
+    """Note that a pass has fetched everything for an issue.
+    column is one of comments_done, pr_done, or reviews_done."""
+    assert column in ('comments_done', 'pr_done', 'reviews_done')
+    db.execute('UPDATE issues SET ' + column + ' = 1 WHERE dir = ?', (dirName,))
+
+def markAllDone(db, column, prsOnly=False):
+    """Note that a pass has fetched everything for every issue (or every pull request)."""
+    assert column in ('comments_done', 'pr_done', 'reviews_done')
+    if prsOnly:
+        db.execute('UPDATE issues SET ' + column + ' = 1 WHERE is_pr = 1')
+    else:
+        db.execute('UPDATE issues SET ' + column + ' = 1')
+
+def pendingComments(db):
+    """Returns a list of (issue directory, issue number) for issues with comments we haven't fetched."""
+    return db.execute('''SELECT dir, number FROM issues
+                         WHERE comments_done = 0 AND comments > 0
+                         ORDER BY dir''').fetchall()
+
+def pendingPullRequests(db, reviewComments=True):
+    """Returns a list of (issue directory, issue number) for pull requests without fetched
+    review comments, or if reviewComments is False, pull requests that haven't been fetched."""
+    if reviewComments:
+        column = 'reviews_done'
+    else:
+        column = 'pr_done'
+    return db.execute('SELECT dir, number FROM issues WHERE is_pr = 1 AND ' + column +
+                      ' = 0 ORDER BY dir').fetchall()
+
+def issueDirsByNumber(db):
+    """Returns a dictionary mapping issue numbers to issue directory names."""
+    return dict(db.execute('SELECT number, dir FROM issues'))
+
+def manifestStatus(db):
+    """Returns a list of (description, count) describing what's been scraped and what's left."""
+    queries = [
+        ('issues', 'SELECT COUNT(*) FROM issues'),
+        ('pull requests', 'SELECT COUNT(*) FROM issues WHERE is_pr = 1'),
+        ('issues with comments left to fetch',
+         'SELECT COUNT(*) FROM issues WHERE comments_done = 0 AND comments > 0'),
+        ('pull requests left to fetch',
+         'SELECT COUNT(*) FROM issues WHERE is_pr = 1 AND pr_done = 0'),
+        ('pull requests with review comments left to fetch',
+         'SELECT COUNT(*) FROM issues WHERE is_pr = 1 AND reviews_done = 0'),
+    ]
+    return [(what, db.execute(q).fetchone()[0]) for (what, q) in queries]
+
+def rebuildManifest(db, repoPath):
+    """Throw away the manifest and recreate it from the scraped json."""
+    db.execute('DELETE FROM issues')
+    processed = 0
+    store = openStore(repoPath)
+    for directory in store.issueDirs():
+        files = store.files(directory)
+        if not directory + '.json' in files:
+            continue
+        recordIssue(db, directory, store.load(directory, directory + '.json'))
+
+        # Use the same tests the scraper used before it had a manifest.
+        kinds = [fileKind(f) for f in files]
+        prFiles = [f for f in files if fileKind(f) == PR]
+        if COMMENT in kinds:
+            markDone(db, directory, 'comments_done')
+        if prFiles:
+            markDone(db, directory, 'pr_done')
+        if REVIEW_COMMENT in kinds:
+            markDone(db, directory, 'reviews_done')
+        elif prFiles:
+            # A pull request with no review comments is done, too.
+            if int(store.load(directory, prFiles[0]).get('review_comments', 0)) == 0:
+                markDone(db, directory, 'reviews_done')
+        processed += 1
+        if (processed % 1000) == 0:
+            print('Added', processed, 'issues to the manifest')
+    db.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description='Show what is left to scrape, or rebuild the scrape manifest from the scraped files.')
+    parser.add_argument('repository', help='github repository name')
+    parser.add_argument('owner', help='github username of repository owner')
+    parser.add_argument('--rebuild', help='rebuild the manifest from the scraped files',
+                        action='store_true', default=False)
+    args = parser.parse_args()
+
+    repoPath = os.path.join(args.owner, args.repository)
+    exists = os.path.exists(os.path.join(repoPath, MANIFEST_NAME))
+    db = openManifest(repoPath)
+    if args.rebuild and exists:
+        rebuildManifest(db, repoPath)
+    for what, count in manifestStatus(db):
+        print('{:,}'.format(count), what)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program checks ghscraper.py against a local mock of the github API,
+# so the scraper can be tested without a network or a token.
+#
+# The mock serves a made up repository (MockRepository): issues, pull
+# requests, issue comments and review comments, paginated with Link headers
+# like github's. Each token gets its own rate limit of --limit requests every
+# --window seconds, with github's X-RateLimit headers, and the mock answers
+# 403 once a token is over its limit. Every answer is slowed down a little,
+# so that requests from several threads overlap.
+#
+# It scrapes the repository into a temporary directory with --jobs threads
+# and --tokens tokens (once fetching comments issue by issue, and once with
+# --repo-comments), and checks that:
+#
+#  - every issue, comment, pull request and review comment was written
+#  - no request was refused because a token was over its limit, i.e. the
+#    threads shared the budget, and waited for it to reset
+#  - requests were spread across all the tokens
+#  - with more than one job, requests were in flight at the same time
+#
+# Then it refreshes a scraped repository with --refresh: twice with nothing
+# changed, and once after a new comment. It checks that the second refresh is
+# answered with a 304, that the new comment is written, and that
+# scrape-state.json only keeps one ETag.
+#
+# Last, it scrapes with --repo-comments while a few issues are missing from
+# the list of issues (as if they were opened after it was fetched), and
+# again once they're listed, and checks that their comments were written.
+#
+# It scrapes while fetching one issue's comments fails, and checks that the
+# refresh cursor isn't started. Then it starts the cursor anyway (as older
+# versions did), refreshes, and checks that the comments are fetched. With
+# --repo-comments, the list of comments fails instead, and the refresh has
+# to resume the scrape.
+#
+# It also packs a scraped repository with ghstore.py pack --remove and
+# deletes its manifest, then resumes the scrape and refreshes it, and checks
+# that only the new issues were written, and that the segment store reads
+# everything, old and new.
+#
+# It prints what went wrong and exits with an error if any check fails.
+# To run it:
+#
+# python ghmockapi.py [--issues N] [--jobs N] [--tokens N] [--limit N] [--window SECONDS]
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import datetime
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from ghapi import GitHubClient
+from ghscraper import scrapeRepo, loadScrapeState, saveScrapeState, ISSUES_ETAG
+import ghapi
+from ghstore import openStore, pack
+from ghmanifest import MANIFEST_NAME
+
+OWNER = 'mock'
+REPO = 'repo'
+
+# Seconds each answer takes
+LATENCY = 0.01
+
+def mockDate(hours):
+    start = datetime.datetime(2016, 1, 1)
+    return (start + datetime.timedelta(hours=hours)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+class MockRepository:
+    """A made up repository. Every third issue is a pull request, and issues
+    and pull requests have a few comments each."""
+
+    def __init__(self, issues):
+        self.issues = []
+        self.comments = {}
+        self.pulls = {}
+        self.reviewComments = {}
+        # Numbers of issues left out of the list of issues
+        self.unlisted = set()
+        for n in range(1, issues + 1):
+            created = mockDate(n)
+            comments = [self.comment(n, 100000 + n*10 + k, mockDate(n + k + 1)) for k in range(n % 4)]
+            issue = {'id': 1000 + n, 'number': n, 'title': 'Issue %d' % n, 'user': {'login': 'user%d' % (n % 7)},
+                     'body': 'Issue %d is broken.' % n, 'created_at': created,
+                     'updated_at': comments[-1]['updated_at'] if comments else created,
+                     'comments': len(comments)}
+            self.issues.append(issue)
+            self.comments[n] = comments
+            if n % 3:
+                continue
+            issue['pull_request'] = {'url': 'pulls/%d' % n}
+            reviews = [self.comment(n, 300000 + n*10 + k, mockDate(n + k + 1), review=True)
+                       for k in range((n // 3) % 3)]
+            merged = n % 2 == 0
+            self.pulls[n] = {'id': 200000 + n, 'number': n, 'user': issue['user'], 'body': issue['body'],
+                             'created_at': created, 'updated_at': issue['updated_at'],
+                             'merged': merged, 'merged_at': mockDate(n + 5) if merged else None,
+                             'merged_by': {'login': 'maintainer'} if merged else None,
+                             'review_comments': len(reviews)}
+            self.reviewComments[n] = reviews
+
+    def addComment(self, number, hours):
+        """Comment on an issue, which bumps its update time."""
+        comment = self.comment(number, 400000 + number*10 + len(self.comments[number]), mockDate(hours))
+        self.comments[number].append(comment)
+        issue = [i for i in self.issues if i['number'] == number][0]
+        issue['comments'] = len(self.comments[number])
+        issue['updated_at'] = comment['updated_at']
+        return comment
+
+    def comment(self, number, commentId, date, review=False):
+        comment = {'id': commentId, 'user': {'login': 'user%d' % (commentId % 5)},
+                   'body': 'Comment %d.' % commentId, 'created_at': date, 'updated_at': date}
+        if review:
+            comment['pull_request_url'] = 'pulls/%d' % number
+        else:
+            comment['issue_url'] = 'issues/%d' % number
+        return comment
+
+    def expectedFiles(self):
+        """Returns the set of (issue directory, json file name) the scraper should write."""
+        files = set()
+        for issue in self.issues:
+            issueDir = 'issue-%d' % issue['id']
+            files.add((issueDir, 'issue-%d.json' % issue['id']))
+            files.update((issueDir, 'comment-%d.json' % c['id']) for c in self.comments[issue['number']])
+            if issue['number'] in self.pulls:
+                files.add((issueDir, 'pr-%d.json' % self.pulls[issue['number']]['id']))
+                files.update((issueDir, 'pr-comment-%d.json' % c['id'])
+                             for c in self.reviewComments[issue['number']])
+        return files
+
+def listing(items, params, defaultSort='created'):
+    """Filter and sort a list the way github does, given the query parameters."""
+    since = params.get('since')
+    if since:
+        items = [i for i in items if i['updated_at'] >= since]
+    key = 'updated_at' if params.get('sort', defaultSort) == 'updated' else 'created_at'
+    return sorted(items, key=lambda i: (i[key], i['id']), reverse=params.get('direction') == 'desc')
+
+class MockGitHub:
+    """The mock's repository, the rate limit budget of each token, and counts of what happened."""
+
+    def __init__(self, repository, limit, window):
+        self.repository = repository
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        # token: [requests left, reset time]
+        self.budgets = {}
+        self.requests = {}
+        self.limited = 0
+        self.notModified = 0
+        self.inFlight = 0
+        self.maxInFlight = 0
+        # API paths that answer with a 502
+        self.failing = set()
+
+    def route(self, path, params):
+        """Returns the json for an API path, or None if there's no such thing."""
+        repo = self.repository
+        parts = path.strip('/').split('/')
+        if parts[:3] != ['repos', OWNER, REPO]:
+            return None
+        parts = parts[3:]
+        if not parts:
+            return {'full_name': OWNER + '/' + REPO}
+        if parts == ['issues']:
+            return listing([i for i in repo.issues if i['number'] not in repo.unlisted], params)
+        if parts == ['issues', 'comments']:
+            return listing([c for cs in repo.comments.values() for c in cs], params)
+        if parts == ['pulls', 'comments']:
+            return listing([c for cs in repo.reviewComments.values() for c in cs], params)
+        if len(parts) >= 2 and parts[1].isdigit():
+            number = int(parts[1])
+            if parts[0] == 'issues' and parts[2:] == ['comments'] and number in repo.comments:
+                return listing(repo.comments[number], params)
+            if parts[0] == 'pulls' and number in repo.pulls:
+                if len(parts) == 2:
+                    return repo.pulls[number]
+                if parts[2:] == ['comments']:
+                    return listing(repo.reviewComments[number], params)
+        return None
+
+    def acquire(self, token):
+        """Count a request against a token. Returns (requests left, reset time),
+        or None if the token is over its limit."""
+        with self.lock:
+            now = time.time()
+            budget = self.budgets.setdefault(token, [self.limit, now + self.window])
+            if now >= budget[1]:
+                budget[0] = self.limit
+                budget[1] = now + self.window
+            self.requests[token] = self.requests.get(token, 0) + 1
+            if budget[0] <= 0:
+                self.limited += 1
+                return None
+            budget[0] -= 1
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            return budget[0], budget[1]
+
+    def release(self, token, notModified):
+        with self.lock:
+            self.inFlight -= 1
+            if notModified:
+                # Conditional requests that github answers with 304 are free
+                self.notModified += 1
+                self.budgets[token][0] += 1
+
+class MockHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        mock = self.server.mock
+        token = self.headers.get('Authorization', '')
+        budget = mock.acquire(token)
+        if budget is None:
+            reset = mock.budgets[token][1]
+            self.reply(403, {'message': 'API rate limit exceeded'},
+                       {'X-RateLimit-Limit': mock.limit, 'X-RateLimit-Remaining': 0,
+                        'X-RateLimit-Reset': int(reset) + 1})
+            return
+        notModified = False
+        try:
+            time.sleep(LATENCY)
+            url = urlsplit(self.path)
+            params = dict(parse_qsl(url.query))
+            soup = mock.route(url.path, params)
+            headers = {'X-RateLimit-Limit': mock.limit, 'X-RateLimit-Remaining': budget[0],
+                       'X-RateLimit-Reset': int(budget[1]) + 1}
+            if url.path.strip('/') in mock.failing:
+                self.reply(502, {'message': 'Server Error'}, headers)
+                return
+            if soup is None:
+                self.reply(404, {'message': 'Not Found'}, headers)
+                return
+            if isinstance(soup, list):
+                perPage = int(params.get('per_page', 30))
+                page = int(params.get('page', 1))
+                if page * perPage < len(soup):
+                    params['page'] = page + 1
+                    nextUrl = 'http://%s:%d%s?%s' % (self.server.server_address + (url.path, urlencode(params)))
+                    headers['Link'] = '<' + nextUrl + '>; rel="next"'
+                soup = soup[(page - 1) * perPage:page * perPage]
+            body = json.dumps(soup).encode('utf-8')
+            headers['ETag'] = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                notModified = True
+                self.reply(304, None, headers)
+                return
+            self.reply(200, body, headers)
+        finally:
+            mock.release(token, notModified)
+
+    def reply(self, status, body, headers):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, str(value))
+        if body is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def startServer(mock):
+    """Serve the mock on a free local port, in a thread. Returns the server and its base URL."""
+    server = MockServer(('localhost', 0), MockHandler)
+    server.mock = mock
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://localhost:%d' % server.server_address[1]
+
+def scrapedFiles(repoPath):
+    files = set()
+    for issueDir in os.listdir(repoPath):
+        if issueDir.startswith('issue-'):
+            files.update((issueDir, name) for name in os.listdir(os.path.join(repoPath, issueDir)))
+    return files
+
+def runScraper(args, scrape):
+    """Call scrape(client, mock) in a temporary directory, with a client for a
+    fresh mock repository. Returns the mock, and what scrape returns."""
+    mock = MockGitHub(MockRepository(args.issues), args.limit, args.window)
+    server, url = startServer(mock)
+    client = GitHubClient(mockTokens(args), url)
+    workDir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workDir)
+    try:
+        return mock, scrape(client, mock)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workDir)
+        server.shutdown()
+        server.server_close()
+
+def mockTokens(args):
+    return ['mock-token-%d' % i for i in range(args.tokens)]
+
+def checkScrape(args, repoComments):
+    """Scrape a fresh mock repository, and return a list of the checks that failed."""
+    def scrape(client, mock):
+        scrapeRepo(client, OWNER, REPO, args.jobs, repoComments=repoComments)
+        return scrapedFiles(os.path.join(OWNER, REPO))
+    start = time.time()
+    mock, files = runScraper(args, scrape)
+    elapsed = time.time() - start
+    tokens = mockTokens(args)
+
+    expected = mock.repository.expectedFiles()
+    print('Scraped', len(files), 'of', len(expected), 'json files in %.1f seconds;' % elapsed,
+          sum(mock.requests.values()), 'requests,', mock.maxInFlight, 'at once at most')
+    for token in tokens:
+        print(' ', token + ':', mock.requests.get('token ' + token, 0), 'requests')
+    failures = []
+    if files != expected:
+        failures.append('%d json files missing, %d unexpected: %s' %
+                        (len(expected - files), len(files - expected),
+                         sorted(expected - files)[:5] + sorted(files - expected)[:5]))
+    if mock.limited:
+        failures.append('%d requests were sent over the rate limit' % mock.limited)
+    unused = [t for t in tokens if not mock.requests.get('token ' + t)]
+    if unused:
+        failures.append('tokens were never used: ' + ', '.join(unused))
+    if args.jobs > 1 and mock.maxInFlight < 2:
+        failures.append('requests were never in flight at the same time')
+    return failures
+
+def checkRefresh(args):
+    """Scrape a fresh mock repository and refresh it, and return a list of the checks that failed."""
+    def scrape(client, mock):
+        repoPath = os.path.join(OWNER, REPO)
+        scrapeRepo(client, OWNER, REPO, args.jobs)
+        scrapeRepo(client, OWNER, REPO, args.jobs, refresh=True)
+        before = mock.notModified
+        scrapeRepo(client, OWNER, REPO, args.jobs, refresh=True)
+        unchanged = mock.notModified - before
+        mock.repository.addComment(5, args.issues + 100)
+        scrapeRepo(client, OWNER, REPO, args.jobs, refresh=True)
+        return unchanged, scrapedFiles(repoPath), loadScrapeState(repoPath)
+    mock, (unchanged, files, state) = runScraper(args, scrape)
+
+    failures = []
+    if not unchanged:
+        failures.append('refreshing an unchanged repository wasn\'t answered with a 304')
+    expected = mock.repository.expectedFiles()
+    if files != expected:
+        failures.append('after refreshing, %d json files missing, %d unexpected' %
+                        (len(expected - files), len(files - expected)))
+    if sorted(state['etags']) != [ISSUES_ETAG]:
+        failures.append('scrape-state.json has ETags for ' + ', '.join(sorted(state['etags'])))
+    return failures
+
+def checkUnlisted(args):
+    """Scrape with --repo-comments while some issues aren't listed, then again once they are,
+    and return a list of the checks that failed."""
+    def scrape(client, mock):
+        # The newest issues were opened after the list was fetched,
+        # and an older issue was commented on after them.
+        mock.repository.unlisted = set(range(args.issues - 2, args.issues + 1))
+        mock.repository.addComment(5, args.issues + 100)
+        scrapeRepo(client, OWNER, REPO, args.jobs, repoComments=True)
+        mock.repository.unlisted = set()
+        scrapeRepo(client, OWNER, REPO, args.jobs, repoComments=True)
+        return scrapedFiles(os.path.join(OWNER, REPO))
+    mock, files = runScraper(args, scrape)
+
+    expected = mock.repository.expectedFiles()
+    if files != expected:
+        return ['after listing the missing issues, %d json files missing: %s' %
+                (len(expected - files), sorted(expected - files)[:5])]
+    return []
+
+def mockPath(*parts):
+    return '/'.join(['repos', OWNER, REPO] + [str(p) for p in parts])
+
+def checkFailed(args, repoComments):
+    """Scrape while fetching one issue's comments (or with repoComments, the list of
+    comments) fails, then refresh, and return a list of the checks that failed."""
+    def scrape(client, mock):
+        repoPath = os.path.join(OWNER, REPO)
+        if repoComments:
+            mock.failing = set([mockPath('issues', 'comments')])
+        else:
+            mock.failing = set([mockPath('issues', 5, 'comments')])
+        scrapeRepo(client, OWNER, REPO, args.jobs, repoComments=repoComments)
+        cursor = loadScrapeState(repoPath)['updated_since']
+        if not repoComments:
+            # Older versions started the refresh cursor anyway.
+            state = loadScrapeState(repoPath)
+            state['updated_since'] = max(i['updated_at'] for i in mock.repository.issues)
+            saveScrapeState(repoPath, state)
+        mock.failing = set()
+        scrapeRepo(client, OWNER, REPO, args.jobs, refresh=True, repoComments=repoComments)
+        return cursor, scrapedFiles(repoPath)
+    # Don't wait long between retries
+    backoff = ghapi.BACKOFF_BASE, ghapi.BACKOFF_MAX
+    ghapi.BACKOFF_BASE, ghapi.BACKOFF_MAX = 0.01, 0.05
+    try:
+        mock, (cursor, files) = runScraper(args, scrape)
+    finally:
+        ghapi.BACKOFF_BASE, ghapi.BACKOFF_MAX = backoff
+
+    failures = []
+    if cursor:
+        failures.append('the refresh cursor was started although fetching comments failed')
+    expected = mock.repository.expectedFiles()
+    if files != expected:
+        failures.append('refreshing didn\'t fetch what failed before, %d json files missing: %s' %
+                        (len(expected - files), sorted(expected - files)[:5]))
+    return failures
+
+def checkPacked(args):
+    """Scrape, pack --remove, and scrape again, and return a list of the checks that failed."""
+    newIssues = set(range(args.issues - 2, args.issues + 1))
+    def scrape(client, mock):
+        repoPath = os.path.join(OWNER, REPO)
+        mock.repository.unlisted = newIssues
+        scrapeRepo(client, OWNER, REPO, args.jobs)
+        pack(repoPath, remove=True)
+        os.remove(os.path.join(repoPath, MANIFEST_NAME))
+        mock.repository.unlisted = set()
+        scrapeRepo(client, OWNER, REPO, args.jobs)
+        written = set(d for d, name in scrapedFiles(repoPath))
+        mock.repository.addComment(5, args.issues + 100)
+        scrapeRepo(client, OWNER, REPO, args.jobs, refresh=True)
+        store = openStore(repoPath)
+        files = set((d, name) for d in store.issueDirs() for name in store.files(d))
+        # Every file can be read, whether it's packed or not
+        read = set((d, name) for d, contents in store.iterRaw() for name, data in contents
+                   if store.load(d, name)['id'] == json.loads(data.decode('utf-8'))['id'])
+        return written, files, read
+    mock, (written, files, read) = runScraper(args, scrape)
+
+    failures = []
+    newDirs = set('issue-%d' % i['id'] for i in mock.repository.issues if i['number'] in newIssues)
+    if written != newDirs:
+        failures.append('resuming a packed scrape wrote %d issue directories, not %d' %
+                        (len(written), len(newDirs)))
+    expected = mock.repository.expectedFiles()
+    if files != expected:
+        failures.append('the segment store lists %d json files, %d missing, %d unexpected' %
+                        (len(files), len(expected - files), len(files - expected)))
+    if read != files:
+        failures.append('%d json files could not be read from the segment store' % len(files - read))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Check ghscraper.py against a local mock of the github API.')
+    parser.add_argument('--issues', help='number of issues in the mock repository', type=int, default=90)
+    parser.add_argument('--jobs', help='number of issues or pull requests to fetch at once', type=int, default=4)
+    parser.add_argument('--tokens', help='number of tokens to scrape with', type=int, default=2)
+    parser.add_argument('--limit', help='requests each token may make per window', type=int, default=30)
+    parser.add_argument('--window', help='seconds until a token\'s rate limit resets', type=float, default=2)
+    args = parser.parse_args()
+
+    failures = []
+    for repoComments in [False, True]:
+        print('Scraping', 'with --repo-comments' if repoComments else 'issue by issue')
+        failures.extend(checkScrape(args, repoComments))
+    print('Refreshing')
+    failures.extend(checkRefresh(args))
+    print('Scraping issues that were missing from the list')
+    failures.extend(checkUnlisted(args))
+    for repoComments in [False, True]:
+        print('Scraping while github fails', 'with --repo-comments' if repoComments else 'issue by issue')
+        failures.extend(checkFailed(args, repoComments))
+    print('Scraping after ghstore.py pack --remove')
+    failures.extend(checkPacked(args))
+    for failure in failures:
+        print('FAILED:', failure)
+    if failures:
+        sys.exit(1)
+    print('All checks passed')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program checks ghcorenlp.py against a stand-in for the CoreNLP server,
+# so it can be tested without java, CoreNLP, or the models.
+#
+# The stand-in answers CoreNLP's annotate requests with json in the same
+# shape. It splits sentences after a word ending in . ! or ?, and at blank
+# lines, and gives each word CoreNLP's character offsets (which count UTF-16
+# code units, like java). A sentence's label only depends on how many words
+# it has, so the labels of a comment are the same whether it was sent alone
+# or in a batch. Requests with FAIL_MARKER in them fail, the way requests the
+# server times out on do, and requests with DROP_MARKER in them are dropped
+# without an answer.
+#
+# It makes up --comments comments (with emoji, blank lines, empty comments,
+# a comment too long to batch, and two that always fail), and checks that:
+#
+#  - readComments() reads back the comments file ghsentiment.py would write
+#  - batches are no bigger than BATCH_SIZE comments and BATCH_CHARS characters
+#  - every sentence is matched back to the comment it came from
+#  - only the comments that fail are skipped, not the rest of their batches
+#  - the results come out in the order of the input
+#  - with --jobs more than one, requests were in flight at the same time
+#
+# Then it runs ghcorenlp.py with --corenlp, with a stand-in java that
+# starts the stand-in server, and checks that the server is started when
+# there isn't one, stopped with --stop, left running without it, and reused
+# by the next run.
+#
+# It prints what went wrong and exits with an error if any check fails.
+# To run it:
+#
+# python ghmockcorenlp.py [--comments N] [--jobs N]
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+from ghcorenlp import CoreNLPClient, readComments, batches, streamSentiment, writeSentiment
+from ghcorenlp import utf16Length, sentenceText, SENTIMENT_LABELS, BATCH_SIZE, BATCH_CHARS
+
+REPO_PATH = os.path.join('mock', 'repo')
+
+# Text that makes the stand-in answer with an error, or hang up
+FAIL_MARKER = 'MOCK-TIMEOUT'
+DROP_MARKER = 'MOCK-DISCONNECT'
+
+# Seconds each answer takes
+LATENCY = 0.01
+
+blankLine = re.compile(r'\n[^\S\n]*\n')
+
+def splitSentences(text):
+    """Returns the sentences in text, as lists of tokens like CoreNLP's."""
+    sentences = []
+    tokens = []
+    end = 0
+    offset = 0
+    for match in re.finditer(r'\S+', text):
+        before = text[end:match.start()]
+        if tokens and blankLine.search(before):
+            sentences.append(tokens)
+            tokens = []
+        offset += utf16Length(before)
+        word = match.group(0)
+        tokens.append({'originalText': word, 'before': before,
+                       'characterOffsetBegin': offset,
+                       'characterOffsetEnd': offset + utf16Length(word)})
+        offset += utf16Length(word)
+        end = match.end()
+        if word[-1] in '.!?':
+            sentences.append(tokens)
+            tokens = []
+    if tokens:
+        sentences.append(tokens)
+    return sentences
+
+def sentimentValue(tokens):
+    return len(tokens) % len(SENTIMENT_LABELS)
+
+def expectedSentiment(text):
+    """Returns the [(sentence, label), ...] ghcorenlp.py should find in a comment."""
+    if FAIL_MARKER in text or DROP_MARKER in text:
+        return []
+    return [(sentenceText(tokens), SENTIMENT_LABELS[sentimentValue(tokens)])
+            for tokens in splitSentences(text)]
+
+class MockCoreNLP:
+    """Counts of what the stand-in server was asked."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failed = 0
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.badProperties = 0
+
+class MockHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # ghcorenlp.py asks for / to see whether the server is up
+        self.reply(200, b'ok')
+
+    def do_DELETE(self):
+        # Only the stand-in can be stopped this way
+        self.reply(200, b'stopping')
+        threading.Thread(target=self.server.shutdown).start()
+
+    def do_POST(self):
+        mock = self.server.mock
+        with mock.lock:
+            mock.requests += 1
+            mock.inFlight += 1
+            mock.maxInFlight = max(mock.maxInFlight, mock.inFlight)
+        try:
+            properties = json.loads(parse_qs(urlsplit(self.path).query)['properties'][0])
+            text = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+            time.sleep(LATENCY)
+            if (not properties['annotators'].endswith('sentiment') or
+                    properties['outputFormat'] != 'json'):
+                with mock.lock:
+                    mock.badProperties += 1
+                self.reply(400, b'unexpected properties')
+                return
+            if FAIL_MARKER in text:
+                with mock.lock:
+                    mock.failed += 1
+                self.reply(500, b'java.util.concurrent.TimeoutException')
+                return
+            if DROP_MARKER in text:
+                with mock.lock:
+                    mock.failed += 1
+                self.close_connection = True
+                return
+            sentences = [{'index': i, 'tokens': tokens, 'sentimentValue': str(sentimentValue(tokens)),
+                          'sentiment': SENTIMENT_LABELS[sentimentValue(tokens)].replace(' ', '')}
+                         for i, tokens in enumerate(splitSentences(text))]
+            self.reply(200, json.dumps({'sentences': sentences}).encode('utf-8'))
+        finally:
+            with mock.lock:
+                mock.inFlight -= 1
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def startServer(mock, port=0):
+    """Serve the stand-in on a local port, in a thread. Returns the server and its URL."""
+    server = MockServer(('localhost', port), MockHandler)
+    server.mock = mock
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://localhost:%d' % server.server_address[1]
+
+def madeUpComments(count):
+    """Returns a list of (json path, scrubbed text)."""
+    rng = random.Random(1)
+    words = ['this', 'looks', 'good', 'to', 'me', 'thanks', 'the', 'build', 'is', 'broken',
+             'inline-code', 'URL', ':thumbs_up:', 'caf\u00e9', '\u2764\ufe0f', '\U0001f600', '\u4f60\u597d']
+    def sentence():
+        return ' '.join(rng.choice(words) for i in range(rng.randint(1, 12))) + rng.choice(['.', '!', '?', ''])
+    comments = []
+    for n in range(count):
+        lines = [' '.join(sentence() for i in range(rng.randint(1, 4))) for j in range(rng.randint(1, 3))]
+        if n % 7 == 3:
+            # A blank line ends a sentence
+            lines.insert(1, '')
+        if n % 50 == 10:
+            lines = []
+        comments.append((os.path.join(REPO_PATH, 'issue-%d' % (n // 5), 'comment-%d.json' % n), '\n'.join(lines)))
+    # One comment is too long to share a batch, and one always fails
+    comments.insert(count // 3, (os.path.join(REPO_PATH, 'issue-long', 'comment-long.json'),
+                                 ' '.join(sentence() for i in range(BATCH_CHARS // 20))))
+    comments.insert(count // 2, (os.path.join(REPO_PATH, 'issue-fail', 'comment-fail.json'),
+                                 'This never finishes ' + FAIL_MARKER + '.'))
+    comments.insert(2 * count // 3, (os.path.join(REPO_PATH, 'issue-fail', 'comment-drop.json'),
+                                     'This hangs up ' + DROP_MARKER + '.'))
+    return comments
+
+def writeComments(path, comments):
+    """Write comments the way ghsentiment.py does."""
+    with open(path, 'w', newline='\n') as f:
+        for jsonPath, text in comments:
+            f.write('#' + jsonPath + ' . \n')
+            if text:
+                f.write(text + '\n.\n')
+
+def readSentimentPaths(path):
+    """Returns the json paths in a file written by ghcorenlp.py, split the way
+    ghsentimentstats.py's createSentimentDict() splits them."""
+    with open(path) as f:
+        c = f.read().split('\n#' + REPO_PATH + os.sep)
+    c[0] = c[0].split('#' + REPO_PATH + os.sep)[1]
+    return [os.path.join(REPO_PATH, line.split('\n')[0] + 'json') for line in c]
+
+def checkSentiment(args, workDir):
+    """Label made up comments with the stand-in server, and return a list of
+    the checks that failed, and the output ghcorenlp.py should write."""
+    comments = madeUpComments(args.comments)
+    commentsPath = os.path.join(workDir, 'all-comments.txt')
+    writeComments(commentsPath, comments)
+
+    failures = []
+    read = list(readComments(commentsPath))
+    if read != comments:
+        failures.append('readComments() read back %d comments, %d differ' %
+                        (len(read), sum(1 for a, b in zip(read, comments) if a != b)))
+
+    batchList = list(batches(read))
+    for batch in batchList:
+        chars = sum(len(text) + 2 for path, text in batch)
+        if len(batch) > BATCH_SIZE or (len(batch) > 1 and chars > BATCH_CHARS + 2):
+            failures.append('a batch has %d comments and %d characters' % (len(batch), chars))
+            break
+    failing = [b for b in batchList if any(FAIL_MARKER in text or DROP_MARKER in text for path, text in b)]
+    # Failing batches are sent again one comment at a time
+    expectedRequests = len(batchList) + sum(len(b) for b in failing)
+
+    mock = MockCoreNLP()
+    server, url = startServer(mock)
+    start = time.time()
+    try:
+        results = list(streamSentiment(CoreNLPClient(url), read, args.jobs))
+    finally:
+        server.shutdown()
+        server.server_close()
+    elapsed = time.time() - start
+    print('Labeled', len(results), 'comments in %.1f seconds;' % elapsed, mock.requests, 'requests,',
+          mock.maxInFlight, 'at once at most')
+
+    if [path for path, sentences in results] != [path for path, text in read]:
+        failures.append('the results are not in the order of the input')
+    wrong = [path for (path, sentences), (_, text) in zip(results, read) if sentences != expectedSentiment(text)]
+    if wrong:
+        failures.append('%d comments have the wrong sentences or labels, e.g. %s' % (len(wrong), wrong[0]))
+    if mock.requests != expectedRequests:
+        failures.append('expected %d requests, but there were %d' % (expectedRequests, mock.requests))
+    if mock.badProperties:
+        failures.append('%d requests had unexpected properties' % mock.badProperties)
+    if mock.maxInFlight > args.jobs:
+        failures.append('%d requests were in flight, with --jobs %d' % (mock.maxInFlight, args.jobs))
+    if args.jobs > 1 and mock.maxInFlight < 2:
+        failures.append('requests were never in flight at the same time')
+
+    outPath = os.path.join(workDir, 'expected-sentiment.txt')
+    with open(outPath, 'w') as f:
+        for path, sentences in results:
+            writeSentiment(f, path, sentences)
+    if readSentimentPaths(outPath) != [path for path, text in read]:
+        failures.append('ghsentimentstats.py would not read the json paths back from the output')
+    return failures, commentsPath, outPath
+
+def freePort():
+    s = socket.socket()
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def writeFakeJava(binDir):
+    """Write a java command that starts the stand-in server on the -port it's given."""
+    path = os.path.join(binDir, 'java')
+    with open(path, 'w') as f:
+        f.write('#!' + sys.executable + '\n'
+                'import os, sys\n'
+                'port = sys.argv[sys.argv.index("-port") + 1]\n'
+                'os.execv(sys.executable, [sys.executable, %r, "--serve", port])\n' %
+                os.path.abspath(__file__))
+    os.chmod(path, 0o755)
+
+def waitUntil(condition, seconds=10):
+    start = time.time()
+    while not condition():
+        if time.time() - start > seconds:
+            return False
+        time.sleep(0.1)
+    return True
+
+def checkServerStart(args, workDir, commentsPath, expectedPath):
+    """Run ghcorenlp.py with --corenlp and a stand-in java, and return a list of the checks that failed."""
+    corenlpDir = os.path.join(workDir, 'CoreNLP')
+    binDir = os.path.join(workDir, 'bin')
+    os.makedirs(corenlpDir)
+    os.makedirs(binDir)
+    writeFakeJava(binDir)
+    env = dict(os.environ)
+    env['PATH'] = binDir + os.pathsep + env.get('PATH', '')
+    url = 'http://localhost:%d' % freePort()
+    client = CoreNLPClient(url)
+    outPath = os.path.join(workDir, 'all-comments-sentiment.txt')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ghcorenlp.py')
+
+    def run(*extra):
+        command = [sys.executable, script, commentsPath, outPath, '--server', url,
+                   '--corenlp', corenlpDir, '--jobs', str(args.jobs)] + list(extra)
+        output = subprocess.check_output(command, env=env, stderr=subprocess.STDOUT,
+                                         universal_newlines=True)
+        with open(outPath) as f, open(expectedPath) as g:
+            same = f.read() == g.read()
+        return 'Starting CoreNLP server' in output, same
+
+    failures = []
+    try:
+        started, same = run('--stop')
+        if not started:
+            failures.append('ghcorenlp.py did not start a server when there was none')
+        if not same:
+            failures.append('ghcorenlp.py wrote different output from a server it started')
+        if not waitUntil(lambda: not client.isRunning()):
+            failures.append('the server was still running after --stop')
+
+        started, same = run()
+        if not waitUntil(client.isRunning, 1):
+            failures.append('the server was stopped without --stop')
+        started, same = run()
+        if started:
+            failures.append('ghcorenlp.py started a server when one was running')
+        if not same:
+            failures.append('ghcorenlp.py wrote different output from a running server')
+        if not os.path.exists(os.path.join(corenlpDir, 'corenlp-server.log')):
+            failures.append('the server has no corenlp-server.log')
+    except subprocess.CalledProcessError as e:
+        failures.append('ghcorenlp.py exited with status %d:\n%s' % (e.returncode, e.output))
+    finally:
+        # Stop a server left running
+        if client.isRunning():
+            client.session().delete(url + '/')
+            waitUntil(lambda: not client.isRunning())
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Check ghcorenlp.py against a stand-in for the CoreNLP server.')
+    parser.add_argument('--comments', help='number of comments to make up', type=int, default=300)
+    parser.add_argument('--jobs', help='number of requests to the server at once', type=int, default=4)
+    parser.add_argument('--serve', help='just serve the stand-in on a port, until asked to stop',
+                        type=int, default=None)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        server = MockServer(('localhost', args.serve), MockHandler)
+        server.mock = MockCoreNLP()
+        server.serve_forever()
+        return
+
+    workDir = tempfile.mkdtemp()
+    try:
+        failures, commentsPath, expectedPath = checkSentiment(args, workDir)
+        print('Starting and stopping a server with --corenlp')
+        failures.extend(checkServerStart(args, workDir, commentsPath, expectedPath))
+    finally:
+        shutil.rmtree(workDir)
+    for failure in failures:
+        print('FAILED:', failure)
+    if failures:
+        sys.exit(1)
+    print('All checks passed')
+
+if __name__ == "__main__":
+    main()
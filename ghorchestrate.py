@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program scrapes (or refreshes) many github repositories at once,
+# with one shared rate limit budget.
+#
+# Running ghscraper.py once per repository means each run sleeps on its own
+# when the rate limit runs out, even if another token has requests left, and
+# the repositories are scraped one after the other. Here, every repository
+# is scraped by ghscraper.py's code, but they all share one github client
+# (and so one TokenPool). Several repositories are scraped at once, and their
+# requests are interleaved: while one repository waits on a slow response,
+# the others use the budget, and everyone sleeps together when it runs out.
+#
+# Repositories are started stalest first: ones that have never been scraped,
+# then the ones whose last scrape saw the oldest issue update. Repositories
+# that have been scraped before are refreshed (see ghscraper.py --refresh).
+#
+# Repositories can be given as owner/repo on the command line, listed one per
+# line in a file, or taken from the reports in the docs directory:
+#
+# python ghorchestrate.py TOKEN rust-lang/rust rails/rails
+# python ghorchestrate.py TOKEN --repos repos.txt
+# python ghorchestrate.py TOKEN --docs docs
+
+import os
+import time
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import sqlite3
+from ghapi import GitHubClient, ResponseCache, GitHubError, GITHUB_API_URL, CACHE_MODES
+from ghmanifest import MANIFEST_NAME, manifestStatus
+from ghprofile import PROFILES
+from ghscraper import scrapeRepo, loadScrapeState, readAuth
+
+def docsRepos(docsDir):
+    """Returns (owner, repo) for each report in the docs directory."""
+    repos = []
+    for owner in sorted(os.listdir(docsDir)):
+        if owner == 'template' or not os.path.isdir(os.path.join(docsDir, owner)):
+            continue
+        for repo in sorted(os.listdir(os.path.join(docsDir, owner))):
+            if os.path.exists(os.path.join(docsDir, owner, repo, 'foss-heartbeat.html')):
+                repos.append((owner, repo))
+    return repos
+
+def parseRepo(name):
+    owner, repo = name.strip().strip('/').split('/')
+    return owner, repo
+
+def lastUpdate(owner, repo):
+    """The latest issue update seen by the last scrape, or '' if it's never been scraped."""
+    repoPath = os.path.join(owner, repo)
+    if not os.path.exists(repoPath):
+        return ''
+    return loadScrapeState(repoPath)['updated_since'] or ''
+
+def manifestSummary(owner, repo):
+    """Returns a short description of what's been scraped, from the repository's manifest."""
+    path = os.path.join(owner, repo, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return ''
+    db = sqlite3.connect(path)
+    try:
+        return ', '.join('{:,} {}'.format(count, what) for what, count in manifestStatus(db))
+    except sqlite3.Error:
+        # The scraper may be creating it right now
+        return ''
+    finally:
+        db.close()
+
+class Orchestrator:
+    """Scrapes a list of repositories, several at a time, with one github client."""
+
+    def __init__(self, client, repos, jobs, repoComments=False, profile=None):
+        self.client = client
+        # Stalest first; sorted() keeps the given order for ties.
+        self.repos = sorted(repos, key=lambda r: lastUpdate(*r))
+        self.jobs = jobs
+        self.repoComments = repoComments
+        self.profile = profile
+        self.status = OrderedDict((r, 'waiting') for r in self.repos)
+        self.started = {}
+
+    def scrape(self, owner, repo):
+        self.started[(owner, repo)] = time.time()
+        self.status[(owner, repo)] = 'scraping'
+        print('Starting', owner + '/' + repo)
+        try:
+            if scrapeRepo(self.client, owner, repo, self.jobs, True, self.repoComments, self.profile):
+                result = 'done'
+            else:
+                result = 'no such repo'
+        except GitHubError as e:
+            result = 'failed (' + str(e) + ')'
+        except Exception as e:
+            # Show it in the status report now; run() re-raises it
+            # once the other repositories are done.
+            self.finish(owner, repo, 'crashed (' + repr(e) + ')')
+            raise
+        self.finish(owner, repo, result)
+
+    def finish(self, owner, repo, result):
+        elapsed = time.time() - self.started[(owner, repo)]
+        self.status[(owner, repo)] = result + ' in %.0f minutes' % (elapsed / 60)
+        print('Finished', owner + '/' + repo + ':', self.status[(owner, repo)])
+
+    def printStatus(self):
+        print('Github rate limit at', str(self.client.pool.remaining()))
+        for (owner, repo), status in self.status.items():
+            line = '  ' + owner + '/' + repo + ': ' + status
+            if status == 'scraping':
+                line += ' (%.0f minutes)' % ((time.time() - self.started[(owner, repo)]) / 60)
+                summary = manifestSummary(owner, repo)
+                if summary:
+                    line += ' - ' + summary
+            print(line)
+
+    def run(self, parallel, interval):
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            # The pool starts repositories in the order they're submitted.
+            futures = [pool.submit(self.scrape, owner, repo) for (owner, repo) in self.repos]
+            pending = futures
+            while pending:
+                done, pending = wait(pending, timeout=interval)
+                self.printStatus()
+            # Re-raise anything unexpected
+            for future in futures:
+                future.result()
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape or refresh many github repositories with one shared rate limit budget.')
+    parser.add_argument('credentials_file_or_token', help='OAuth token or path to file storing github username and password to use for authentication (two lines)')
+    parser.add_argument('repos', help='repositories to scrape, as owner/repo', nargs='*')
+    parser.add_argument('--repos', dest='reposFile', help='file listing repositories to scrape, one owner/repo per line')
+    parser.add_argument('--docs', help='scrape every repository with a report in this directory (e.g. docs)')
+    parser.add_argument('--token', help='additional OAuth token or credentials file; requests are spread across all tokens (may be repeated)',
+                        action='append', default=[])
+    parser.add_argument('--parallel', help='number of repositories to scrape at once', type=int, default=4)
+    parser.add_argument('--jobs', help='number of issues or pull requests to fetch at once, per repository', type=int, default=4)
+    parser.add_argument('--status-interval', help='seconds between progress reports', type=int, default=60)
+    parser.add_argument('--api-url', help='base URL of the github API (e.g. a local mock server)', default=GITHUB_API_URL)
+    parser.add_argument('--repo-comments', help='fetch comments with the repository-wide comment lists, rather than one issue at a time',
+                        action='store_true', default=False)
+    parser.add_argument('--cache', help='directory to cache github responses in (see ghapi.py)')
+    parser.add_argument('--cache-mode', help='how to use the response cache (see ghscraper.py)',
+                        choices=CACHE_MODES, default='revalidate')
+    parser.add_argument('--profile', help='json fields to store from now on: built in profile (' +
+                        ', '.join(sorted(PROFILES)) + ') or file with one field per line (see ghprofile.py)')
+    args = parser.parse_args()
+
+    repos = [parseRepo(r) for r in args.repos]
+    if args.reposFile:
+        with open(args.reposFile) as f:
+            repos += [parseRepo(line) for line in f if line.strip() and not line.startswith('#')]
+    if args.docs:
+        repos += docsRepos(args.docs)
+    # Drop duplicates, keeping the first
+    repos = list(OrderedDict.fromkeys(repos))
+    if not repos:
+        print('No repositories to scrape.')
+        return
+
+    auths = [readAuth(c) for c in [args.credentials_file_or_token] + args.token]
+    cache = None
+    if args.cache:
+        cache = ResponseCache(args.cache, args.cache_mode)
+    client = GitHubClient(auths, args.api_url, cache)
+
+    orchestrator = Orchestrator(client, repos, args.jobs, args.repo_comments, args.profile)
+    print('Scraping', len(repos), 'repositories, stalest first:')
+    orchestrator.printStatus()
+    orchestrator.run(args.parallel, args.status_interval)
+
+if __name__ == "__main__":
+    main()
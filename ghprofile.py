@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library decides which json fields are kept when scraped objects
+# are written to disk.
+#
+# Github's json is mostly URLs: every issue has a dozen *_url fields and a
+# full user object, and every pull request has full copies of both the head
+# and base repositories. The analysis scripts only read a handful of fields,
+# so most of what we store (and parse, over and over) is never used.
+#
+# A storage profile is a list of fields to keep, one per line. Nested fields
+# are written with dots, e.g. user.login keeps only the login of the user
+# object. A field without dots keeps the whole value. Fields that are lists
+# of objects (e.g. labels.name) are pruned item by item. Missing fields and
+# nulls (e.g. a deleted user) are left as they are.
+#
+# A repository's profile is stored in owner/repo/storage-profile.txt, and
+# applies to everything ghscraper.py and ghimport.py write into it. If there's
+# no profile, everything is kept. There are two built in profiles:
+#
+#  - full: keep everything
+#  - analysis: keep the fields the scripts in this repository use
+#
+# To set a repository's profile and prune the json that's already been
+# scraped in place, run:
+#
+# python ghprofile.py GITHUB_REPO_NAME GITHUB_OWNER_NAME [--profile analysis|full|FILE]
+#
+# Note that pruned fields are gone for good. Setting the full profile only
+# keeps everything from then on.
+
+import os
+import json
+import argparse
+from ghstore import DirectoryStore, hasSegmentStore
+
+PROFILE_NAME = 'storage-profile.txt'
+
+PROFILES = {
+    'full': None,
+    'analysis': [
+        'id',
+        'number',
+        'user.login',
+        'user.type',
+        'created_at',
+        'updated_at',
+        'state',
+        'html_url',
+        'body',
+        'body_text',
+        'comments',
+        'review_comments',
+        'pull_request',
+        'merged',
+        'merged_at',
+        'merged_by.login',
+        'merged_by.type',
+        # Used to file comments from the repository-wide comment lists
+        'issue_url',
+        'pull_request_url',
+    ],
+}
+
+def compileProfile(fields):
+    """Turn a list of dotted field names into a nested dictionary of fields to keep.
+    None means keep the whole value."""
+    if fields is None:
+        return None
+    spec = {}
+    for field in fields:
+        node = spec
+        parts = field.split('.')
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                # We're already keeping the whole value
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return spec
+
+def prune(soup, spec):
+    """Returns a copy of the json with only the fields in spec."""
+    if spec is None:
+        return soup
+    if isinstance(soup, list):
+        return [prune(item, spec) for item in soup]
+    if not isinstance(soup, dict):
+        return soup
+    return {key: prune(value, spec[key]) for key, value in soup.items() if key in spec}
+
+def readProfile(nameOrFile):
+    """Returns the list of fields in a built in profile, or in a profile file."""
+    if nameOrFile in PROFILES:
+        return PROFILES[nameOrFile]
+    with open(nameOrFile) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+# Compiled profiles, by repository path
+repoProfiles = {}
+
+def repoProfile(repoPath):
+    """Returns the compiled storage profile for a repository, or None to keep everything."""
+    if repoPath not in repoProfiles:
+        path = os.path.join(repoPath, PROFILE_NAME)
+        fields = None
+        if os.path.exists(path):
+            fields = readProfile(path)
+        repoProfiles[repoPath] = compileProfile(fields)
+    return repoProfiles[repoPath]
+
+def setRepoProfile(repoPath, fields):
+    """Store a repository's profile. A fields list of None keeps everything."""
+    path = os.path.join(repoPath, PROFILE_NAME)
+    if fields is None:
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        with open(path, 'w') as f:
+            for field in fields:
+                f.write(field + '\n')
+    repoProfiles[repoPath] = compileProfile(fields)
+
+def pruneTree(repoPath):
+    """Prune every json file in the issue directories to the repository's profile."""
+    spec = repoProfile(repoPath)
+    if spec is None:
+        return 0, 0
+    store = DirectoryStore(repoPath)
+    before = 0
+    after = 0
+    processed = 0
+    for issueDir in store.issueDirs():
+        for name in store.files(issueDir):
+            path = store.path(issueDir, name)
+            before += os.path.getsize(path)
+            pruned = json.dumps(prune(store.load(issueDir, name), spec))
+            with open(path + '.tmp', 'w') as f:
+                f.write(pruned)
+            os.replace(path + '.tmp', path)
+            after += os.path.getsize(path)
+        processed += 1
+        if (processed % 1000) == 0:
+            print('Pruned', processed, 'issues')
+    return before, after
+
+def main():
+    parser = argparse.ArgumentParser(description='Set the storage profile for scraped github data, and prune the json already scraped.')
+    parser.add_argument('repository', help='github repository name')
+    parser.add_argument('owner', help='github username of repository owner')
+    parser.add_argument('--profile', help='built in profile (' + ', '.join(sorted(PROFILES)) +
+                        ') or file with one field per line (default: analysis)', default='analysis')
+    args = parser.parse_args()
+
+    repoPath = os.path.join(args.owner, args.repository)
+    if hasSegmentStore(repoPath):
+        print('Unpack the segment store with ghstore.py before pruning.')
+        return
+    setRepoProfile(repoPath, readProfile(args.profile))
+    before, after = pruneTree(repoPath)
+    if before:
+        print('Pruned json from {:,} bytes to {:,} bytes'.format(before, after))
+
+if __name__ == "__main__":
+    main()
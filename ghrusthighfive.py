@@ -19,8 +19,8 @@ import argparse
 from datetime import datetime, timedelta
 import os
 from math import sqrt
-import json
-from ghcategorize import jsonIsPullRequest, jsonIsPullRequestComment, getUserDate
+from ghdb import openDb, dateWindow
+from ghevents import addWindowArguments
 from scipy import stats
 import numpy
 
@@ -77,95 +77,53 @@ import numpy
 # In order to test these two hypothesis, we divide the pull requests into two
 # populations: those PRs where rust-highfive commented, and those PRs where it
 # did not.
-def separatePRs(repoPath, username, startDate, endDate):
+def mergeTime(prPath, createdAt, prMerged, mergedAt):
+    """Returns whether a pull request was merged, and how many hours it was open if it was."""
+    if not prMerged:
+        return 0, None
+    ctime = datetime.strptime(createdAt, "%Y-%m-%dT%H:%M:%SZ")
+    mtime = datetime.strptime(mergedAt, "%Y-%m-%dT%H:%M:%SZ")
+    seconds = (mtime - ctime).total_seconds()
+    if (seconds < 0):
+        print("WARN: PR", prPath, "merged before it was created?")
+        print("Created", ctime)
+        print("Merged", mtime)
+        return 1, 0
+    # Convert to hours, to make graphs easier to read
+    return 1, seconds / (60.*60)
+
+# Only the pull requests created from startDate up to and including endDate are looked at.
+# They're found with the created_at index in the database (see ghdb.py),
+# so the pull requests outside of the dates are never read.
+def separatePRs(db, repoPath, username, startDate, endDate):
     interaction = []
     noInteraction = []
-    # Save the pr-*.txt filenames where username commented
+    # Find the pull requests where username commented
     # in the comment or pr-comment
-    for directory in os.listdir(repoPath):
-        if not os.path.isdir(os.path.join(repoPath, directory)):
-            continue
-
-        match = False
-        files = os.listdir(os.path.join(repoPath, directory))
-        prFile = [x for x in files if jsonIsPullRequest(x)]
-        if not prFile:
-            continue
-
+    condition, params = dateWindow(startDate, endDate, inclusive=True)
+    rows = db.execute('''SELECT dir, path, created_at, merged, merged_at,
+                            EXISTS (SELECT 1 FROM comments c WHERE c.dir = prs.dir AND c.user = ?) OR
+                            EXISTS (SELECT 1 FROM review_comments r WHERE r.dir = prs.dir AND r.user = ?)
+                          FROM prs WHERE ''' + condition, [username, username] + params).fetchall()
+    for directory, prPath, createdAt, prMerged, mergedAt, match in rows:
         # Figure out whether this pull request was merged or not
-        with open(os.path.join(repoPath, directory, prFile[0])) as f:
-            prSoup = json.load(f)
-        if startDate and datetime.strptime(prSoup['created_at'], "%Y-%m-%dT%H:%M:%SZ") < startDate:
-            continue
-        if endDate and datetime.strptime(prSoup['created_at'], "%Y-%m-%dT%H:%M:%SZ") > endDate:
-            continue
-
-        if not prSoup['merged']:
-            merged = 0
-            seconds = None
-        else:
-            merged = 1
-            ctime = datetime.strptime(prSoup['created_at'], "%Y-%m-%dT%H:%M:%SZ")
-            mtime = datetime.strptime(prSoup['merged_at'], "%Y-%m-%dT%H:%M:%SZ")
-            seconds = (mtime - ctime).total_seconds()
-            if (seconds < 0):
-                print("WARN: PR", os.path.join(repoPath, directory, prFile[0]), "merged before it was created?")
-                print("Created", ctime)
-                print("Merged", mtime)
-                seconds = 0
-            else:
-                # Convert to hours, to make graphs easier to read
-                seconds = seconds / (60.*60)
-
-        # Figure out if username made an issue or pr comment
-        comments = [x for x in files if jsonIsPullRequestComment(x) or x.startswith('comment-')]
-        for cfile in comments:
-            with open(os.path.join(repoPath, directory, cfile)) as commentFile:
-                soup = json.load(commentFile)
-                user, date = getUserDate(soup)
-                if user == username:
-                    match = True
+        merged, seconds = mergeTime(prPath, createdAt, prMerged, mergedAt)
         if match:
             interaction.append((os.path.join(repoPath, directory), merged, seconds))
         else:
             noInteraction.append((os.path.join(repoPath, directory), merged, seconds))
     return interaction, noInteraction
 
-def separateByDate(repoPath, cutoff, startDate, endDate):
+def separateByDate(db, repoPath, cutoff, startDate, endDate):
     older = []
     newer = []
-    for directory in os.listdir(repoPath):
-        if not os.path.isdir(os.path.join(repoPath, directory)):
-            continue
-
-        match = False
-        files = os.listdir(os.path.join(repoPath, directory))
-        prFile = [x for x in files if jsonIsPullRequest(x)]
-        if not prFile:
-            continue
-
+    condition, params = dateWindow(startDate, endDate, inclusive=True)
+    rows = db.execute('SELECT dir, path, created_at, merged, merged_at FROM prs WHERE ' + condition,
+                      params).fetchall()
+    for directory, prPath, createdAt, prMerged, mergedAt in rows:
         # Figure out whether this pull request was merged or not
-        with open(os.path.join(repoPath, directory, prFile[0])) as f:
-            prSoup = json.load(f)
-
-        if not prSoup['merged']:
-            merged = 0
-            seconds = None
-        else:
-            merged = 1
-            ctime = datetime.strptime(prSoup['created_at'], "%Y-%m-%dT%H:%M:%SZ")
-            mtime = datetime.strptime(prSoup['merged_at'], "%Y-%m-%dT%H:%M:%SZ")
-            seconds = (mtime - ctime).total_seconds()
-            if (seconds < 0):
-                print("WARN: PR", os.path.join(repoPath, directory, prFile[0]), "merged before it was created?")
-                print("Created", ctime)
-                print("Merged", mtime)
-                seconds = 0
-            else:
-                # Convert to hours, to make graphs easier to read
-                seconds = seconds / (60.*60)
-        if (startDate and ctime < startDate) or (endDate and ctime > endDate):
-            continue
+        merged, seconds = mergeTime(prPath, createdAt, prMerged, mergedAt)
+        ctime = datetime.strptime(createdAt, "%Y-%m-%dT%H:%M:%SZ")
         if ctime < cutoff:
             older.append((os.path.join(repoPath, directory), merged, seconds))
         else:
@@ -302,22 +260,30 @@ def testPROpenLength(pop1, pop2, username, inaction, action, debug):
         print("Merged pull requests where", username, inaction, "were open",
               printTime(x1-x2), "more on average.")
 
+def printTitle(title, startDate, endDate):
+    title = title + ' ' + startDate.strftime('%Y-%m-%d') + ' to ' + endDate.strftime('%Y-%m-%d') + ':'
+    print(title)
+    print('=' * len(title))
+
 def main():
     parser = argparse.ArgumentParser(description='Gather statistics from scraped github information.')
     parser.add_argument('repository', help='github repository name')
     parser.add_argument('owner', help='github username of repository owner')
     parser.add_argument("--debug", help="Print detailed statistics (sample count, std dev, t-value, and p-values)",
                         action="store_true", default=False)
+    addWindowArguments(parser)
     args = parser.parse_args()
+    repoPath = os.path.join(args.owner, args.repository)
+    db = openDb(repoPath)
 
     print()
     # rust-highfive joined on 2014-09-18T23:32:23Z
     # Let's check only the year of pull requests before rust-highfive
-    print("Comparing rust-highfive against pull requests from 2013-09-18 to 2015-09-18:")
-    print("============================================================================")
-    startDate = datetime.strptime("2013-09-18T23:32:23Z", "%Y-%m-%dT%H:%M:%SZ")
-    endDate = datetime.strptime("2015-09-18T23:32:23Z", "%Y-%m-%dT%H:%M:%SZ")
-    rhf, norhf = separatePRs(os.path.join(args.owner, args.repository), 'rust-highfive', startDate, endDate)
+    # (or the pull requests from --since to --until)
+    startDate = args.since or datetime.strptime("2013-09-18T23:32:23Z", "%Y-%m-%dT%H:%M:%SZ")
+    endDate = args.until or datetime.strptime("2015-09-18T23:32:23Z", "%Y-%m-%dT%H:%M:%SZ")
+    printTitle("Comparing rust-highfive against pull requests from", startDate, endDate)
+    rhf, norhf = separatePRs(db, repoPath, 'rust-highfive', startDate, endDate)
     testSuccessfulMerges(norhf, rhf, "rust-highfive", "more", "recommended a reviewer", "did not comment", args.debug)
     testPROpenLength(norhf, rhf, "rust-highfive", "did not comment", "recommended a reviewer", args.debug)
     testPROpenLength(rhf, norhf, "rust-highfive", "recommended a reviewer", "did not comment", args.debug)
@@ -329,12 +295,13 @@ def main():
     # x1 = mean for pop1 (when bors interacted)
     # x2 = mean for pop2 (when bors didn't interact)
     print()
-    print("Comparing bors against pull requests from 2012-02-02 to 2014-02-02:")
-    print("===================================================================")
-    nobors, bors = separateByDate(os.path.join(args.owner, args.repository),
+    startDate = args.since or datetime.strptime("2012-02-02T00:46:02Z", "%Y-%m-%dT%H:%M:%SZ")
+    endDate = args.until or datetime.strptime("2014-02-02T00:46:02Z", "%Y-%m-%dT%H:%M:%SZ")
+    printTitle("Comparing bors against pull requests from", startDate, endDate)
+    nobors, bors = separateByDate(db, repoPath,
                                 datetime.strptime("2013-02-02T00:46:02Z", "%Y-%m-%dT%H:%M:%SZ"),
-                                datetime.strptime("2012-02-02T00:46:02Z", "%Y-%m-%dT%H:%M:%SZ"),
-                                datetime.strptime("2014-02-02T00:46:02Z", "%Y-%m-%dT%H:%M:%SZ"))
+                                startDate, endDate)
+    db.close()
     testSuccessfulMerges(nobors, bors, "bors", "more", "was not used", "initiated a CI test", args.debug)
     #testSuccessfulMerges(bors, nobors, "bors", "less", "initiated a CI test", "was not used", args.debug)
     testPROpenLength(nobors, bors, "bors", "was not used", "initiated a CI test", args.debug)
@@ -36,9 +36,12 @@
 # There are projects that archive the public Github events stream:
 # http://githubarchive.org/ and http://ghtorrent.org/
 #
-# However, they only go back to 2011 or 2012, and I'm unsure whether they
-# include the body text as markdown or html (which is important for removing
-# code snippets from the text passed to the sentiment analysis library.
+# However, they only go back to 2011 or 2012, and they only include the body
+# text as markdown, not html (which is important for removing code snippets
+# from the text passed to the sentiment analysis library).
+#
+# ghimport.py imports downloaded githubarchive.org files into the same tree
+# this script writes. Running this script afterwards fills in the gaps.
 #
 # How we fetch the data
 # =====================
@@ -61,6 +64,9 @@
 #    fetch up to 100 review comments at a time,
 #    write pr-comment-<id>.json
 #
+# What's been fetched is kept in a manifest (see ghmanifest.py), so that
+# steps 2-4 don't have to re-read every issue json file to find out what's left.
+#
 # How long will this take?
 # ========================
 #
@@ -73,116 +79,223 @@
 # Assuming one comment on each issue and pull request
 # the minimum number of API calls that the library will make is:
 #
-# (num issues + PRs)/100 + (num issues + PRs)*2 + (num PRs) + (num PRs)*2
+# (num issues + PRs)/100 + (num issues + PRs) + (num PRs) + (num PRs)
 #
 # Divide the best or worst cases total number of API requests by 5,000
 # to see how many hours this will take you.
+#
+# Listing comments for the whole repository
+# =========================================
+#
+# Steps 2 and 4 cost at least one request per issue or pull request.
+# Github can also list all issue comments and all review comments in the
+# repository, 100 at a time, sorted by creation date. With --repo-comments,
+# steps 2 and 4 instead page through those lists and put each comment in the
+# issue directory for the issue number at the end of its issue_url or
+# pull_request_url. The pull request objects are still fetched one at a time,
+# since only the single pull request API tells us who merged it.
+#
+# That brings the minimum number of API calls down to:
+#
+# (num issues + PRs)/100 + (num comments)/100 + (num PRs) + (num review comments)/100
+#
+# Refreshing a scraped repository
+# ===============================
+#
+# Once a repository has been scraped, --refresh only asks github for what
+# changed since the last run. We store two things in scrape-state.json:
+#
+#  - updated_since: the latest issue update time github has shown us.
+#    Any new comment, review comment, or edit bumps the issue's update time,
+#    so asking for issues updated since then finds all issues with activity.
+#    We then ask for the comments on those issues updated since then, and
+#    re-fetch their pull requests.
+#
+#  - etags: the ETag github sent for the list of updated issues. If nothing
+#    has changed, github answers our conditional request with a 304, which
+#    doesn't count against the rate limit. The ETag is stored under
+#    ISSUES_ETAG, not the request URL: the URL has the updated_since cursor in
+#    it, so it changes whenever the cursor moves.
+#
+# Fetching in parallel
+# ====================
+#
+# Most of the time spent in steps 2-4 is waiting on round trips to github,
+# not using up our rate limit. With --jobs N, N issues or pull requests are
+# fetched at once. All threads share one client, which tracks the rate limit
+# headers github sends back, so the threads all stop when the limit is hit
+# and start again when it resets.
 
-from github3 import GitHub, login, issues
+from ghapi import GitHubClient, ResponseCache, PermanentError, TransientError
+from ghapi import GITHUB_API_URL, CACHE_MODES
+from ghmanifest import openManifest, hasIssue, recordIssue, markDone, markAllDone
+from ghmanifest import pendingComments, pendingPullRequests, issueDirsByNumber
+from ghprofile import prune, repoProfile, setRepoProfile, readProfile, PROFILES
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import argparse
-import time
-import datetime
 import json
-import glob
 
-def writeJson(path, prefix, obj):
-    fp = os.path.join(path, prefix + str(obj.id) + '.json')
-    if not os.path.exists(fp):
+def writeJson(path, prefix, soup, overwrite=False):
+    # The issue directory is new, or was packed with ghstore.py pack --remove.
+    # The segment store reads new json from it until it's packed again.
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except FileExistsError:
+            # Another thread made it first
+            pass
+    fp = os.path.join(path, prefix + str(soup['id']) + '.json')
+    if overwrite or not os.path.exists(fp):
         with open(fp, 'w') as f:
-            f.write(obj.as_json())
+            f.write(json.dumps(prune(soup, repoProfile(os.path.dirname(path)))))
+
+def readCursor(path):
+    """Return the date stored in a cursor file, or None if there isn't one."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
 
-# rate limiting resets after 1 hour (60 minutes)
-GITHUB_RATELIMIT_INTERVAL = 60
+def writeCursor(path, date):
+    if date:
+        with open(path, 'w') as f:
+            f.write(date + '\n')
+
+# The key of the ETag for the list of updated issues in scrape-state.json
+ISSUES_ETAG = 'issues'
+
+def loadScrapeState(repoPath):
+    statePath = os.path.join(repoPath, 'scrape-state.json')
+    if not os.path.exists(statePath):
+        return {'updated_since': None, 'etags': {}}
+    with open(statePath) as f:
+        return json.load(f)
+
+def saveScrapeState(repoPath, state):
+    # Write to a temporary file first, so we never leave a half-written state
+    statePath = os.path.join(repoPath, 'scrape-state.json')
+    with open(statePath + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+        f.write('\n')
+    os.replace(statePath + '.tmp', statePath)
 
 # Note that the etag is absolutely useless for our initial fetching.
 # An etag to fetch a particular issue doesn't change unless a new issue is
 # added or an issue is updated.
 
-def scrapeIssues(repo, repoPath, processedIssueDate):
-    """Given a github repo object, create a directory structure for issues created after processedIssueDate"""
-    while True:
-        try:
-            # We have to ask for issues in created order, because the update
-            # time could change in between waiting for our rate limit to renew.
-            issues = repo.issues(sort='created', direction='asc', state='all',
-                                 since=processedIssueDate)
-            numIssues = 0
-            for i in issues:
-                issuePath = os.path.join(repoPath, 'issue-' + str(i.id))
-                if not os.path.exists(issuePath):
-                    os.makedirs(issuePath)
-                    writeJson(issuePath, 'issue-', i)
-                    processedIssueDate = i.as_dict()['created_at']
-                    numIssues += 1
-            # FIXME: write issues etag to file to update the repo later
-            break
-        except:
-            print('Processed', str(numIssues), 'issues')
-            print('Github rate limit at',
-                  str(repo.ratelimit_remaining) + ', sleeping until',
-                  datetime.datetime.now() + datetime.timedelta(minutes = GITHUB_RATELIMIT_INTERVAL))
-            time.sleep(60*GITHUB_RATELIMIT_INTERVAL)
-
-def scrapeIssueComments(repo, repoPath):
-    """Given a github repo object, scrape comments, ignoring issues with fetched comments."""
-    # Get the list of all directories in the repoPath, looking for issue directories.
-    skippedIssues = 0
-    noCommentIssues = 0
-    issueList = []
+def scrapeIssues(client, db, owner, repoName, repoPath, lastIssue):
+    """Create a directory structure for issues created after the date in the lastIssue file.
+    Returns the latest issue update time seen, or None if github failed before the end of the list."""
+    processedIssueDate = readCursor(lastIssue)
+    latestUpdate = None
+    numIssues = 0
+    # We have to ask for issues in created order, because the update
+    # time could change in between waiting for our rate limit to renew.
+    params = {'sort': 'created', 'direction': 'asc', 'state': 'all'}
+    if processedIssueDate:
+        params['since'] = processedIssueDate
+    try:
+        for i in client.iterate(client.repoUrl(owner, repoName, 'issues'), params):
+            latestUpdate = max(latestUpdate or '', i['updated_at'])
+            # The manifest, not the issue directory, says whether we have
+            # the issue: pack --remove deletes the directories.
+            dirName = 'issue-' + str(i['id'])
+            if not hasIssue(db, dirName):
+                writeJson(os.path.join(repoPath, dirName), 'issue-', i)
+                recordIssue(db, dirName, i)
+                processedIssueDate = i['created_at']
+                numIssues += 1
+    except TransientError as e:
+        print('Giving up on the issue list for now, re-run the scraper to resume -', e)
+        # Issues we haven't listed may have been updated before the latest
+        # update we saw, so a refresh can't start from it yet.
+        latestUpdate = None
+    finally:
+        # If github keeps failing, the next run picks up where we stopped.
+        print('Processed', str(numIssues), 'issues')
+        db.commit()
+        writeCursor(lastIssue, processedIssueDate)
+    return latestUpdate
+
+def fetchOrSkip(client, fetch, *args):
+    """Call fetch(client, *args), logging and skipping any github errors.
+    Returns the number of objects written, and whether it failed with an error
+    that may go away if we try again later."""
+    try:
+        return fetch(client, *args), False
+    except PermanentError as e:
+        print('Skipping', args[2], '-', e)
+        return 0, False
+    except TransientError as e:
+        print('Giving up on', args[2], 'for now -', e)
+        return 0, True
+
+def fetchConcurrently(client, jobs, fetch, workList, onDone=None):
+    """Call fetch(client, owner, repoName, issuePath, number) for each item in workList,
+    with up to jobs requests in flight at once. Returns the total number of
+    objects the fetches wrote, and the number of items that should be retried.
+
+    onDone(issuePath) is called from this thread for each item that
+    doesn't need to be retried."""
+    total = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(fetchOrSkip, client, fetch, *work): work for work in workList}
+        for future in as_completed(futures):
+            written, retry = future.result()
+            total += written
+            failed += retry
+            if onDone and not retry:
+                onDone(futures[future][2])
+    if failed:
+        print(str(failed), 'items failed, re-run the scraper to fetch them')
+    return total, failed
 
+def fetchIssueComments(client, owner, repoName, issuePath, number, since=None, overwrite=None):
+    """Fetch the comments on an issue. If since is given, only fetch
+    comments updated since then. Comments we already have are overwritten
+    if overwrite is True, or by default, if since is given."""
+    print(issuePath)
+    # FIXME: We could lose comments if there are more than 100 comments
+    # (the pagination unit) and we hit the rate limit in the middle of
+    # the for loop. This should be rare, and we can catch it by
+    # re-running the pass again.
+    if overwrite is None:
+        overwrite = bool(since)
+    params = None
+    if since:
+        params = {'since': since}
+    numComments = 0
+    for c in client.iterate(client.repoUrl(owner, repoName, 'issues', number, 'comments'), params):
+        writeJson(issuePath, 'comment-', c, overwrite=overwrite)
+        numComments += 1
+    return numComments
+
+def markIssueDone(db, column):
+    """Returns an onDone callback for fetchConcurrently that updates the manifest."""
+    def onDone(issuePath):
+        markDone(db, os.path.basename(issuePath), column)
+    return onDone
+
+def scrapeIssueComments(client, db, owner, repoName, repoPath, jobs):
+    """Scrape comments, ignoring issues with fetched comments.
+    Returns the number of issues that failed."""
     # FIXME This will work if we're only using the API calls, however,
     # if this script is used in conjunction with something that uses
     # archives of github public events, we might only have some of
     # the comments on an issue.
-
-    for f in os.listdir(repoPath):
-        if not f.startswith('issue-'):
-            continue
-        issuePath = os.path.join(repoPath, f)
-        if any(issueFile.startswith('comment-') for issueFile in os.listdir(issuePath)):
-            skippedIssues += 1
-        else:
-            # Check the json to see if this issue has any comments.
-            with open(os.path.join(issuePath, f + '.json'), 'r') as issueFile:
-                numComments = int(json.load(issueFile)['comments'])
-                if numComments > 0:
-                    print(issuePath)
-                    issueList.append(f)
-                else:
-                    noCommentIssues += 1
-
-    print('Skipping', str(skippedIssues), 'issues with already fetched comments')
-    print('Skipping', str(noCommentIssues), 'issues with no comments')
+    issueList = pendingComments(db)
     print('Fetching comments for', str(len(issueList)), 'issues')
 
-    numComments = 0
-    for f in issueList:
-        issueId = f.split('-')[1]
-        while True:
-            try:
-                issuePath = os.path.join(repoPath, f)
-                with open(os.path.join(issuePath, f + '.json'), 'r') as issueFile:
-                    realId = json.load(issueFile)['number']
-                i = repo.issue(realId)
-                print(issuePath)
-                # FIXME: we could hit our rate limit in between the call to grab
-                # the issue and the request to get a comment.
-                # We could also lose comments if there are more than 100 comments
-                # (the pagination unit github3.py uses) and we hit the rate limit
-                # in the middle of the for loop. The second case should be rare,
-                # and the first we can catch by re-running the pass again.
-                for c in i.comments():
-                    print(c.id)
-                    writeJson(issuePath, 'comment-', c)
-                    numComments += 1
-                break
-            except:
-                print('Processed', str(numComments), 'comments')
-                print('Github rate limit at',
-                      str(repo.ratelimit_remaining) + ', sleeping until',
-                      datetime.datetime.now() + datetime.timedelta(minutes = GITHUB_RATELIMIT_INTERVAL))
-                time.sleep(60*GITHUB_RATELIMIT_INTERVAL)
+    workList = [(owner, repoName, os.path.join(repoPath, f), number) for (f, number) in issueList]
+    try:
+        numComments, failed = fetchConcurrently(client, jobs, fetchIssueComments, workList,
+                                                markIssueDone(db, 'comments_done'))
+    finally:
+        db.commit()
+    print('Fetched', str(numComments), 'comments')
+    return failed
 
 # Oddities of the github API
 #
@@ -191,8 +304,8 @@ def scrapeIssueComments(repo, repoPath):
 # At some point, there was no API difference between issues and pull requests.
 # Now, an issue can be a normal issue, or it can reference a pull request object.
 #
-# Any comments made on the issue are issue comments, and require two API calls
-# (one to fetch the issue and the second to fetch a page of issue comments).
+# Any comments made on the issue are issue comments, and are fetched with
+# the issue number from the issue comments API.
 #
 # Any comments made on the pull request commit or code are known as "review comments".
 # The only way to get review comments referenced from an issue is to
@@ -200,93 +313,273 @@ def scrapeIssueComments(repo, repoPath):
 #
 # So, even through both issue comments and review comments appear on the same webpage,
 # they are completely different beasts.
-def scrapePullRequestComments(repo, repoPath):
-    """Given a github repo object, scrape pull requests and review comments"""
-    # Get the list of all directories in the repoPath, looking for issue directories.
-    issueList = []
-    skippedIssues = 0
-
-    # Find all issues that are a pull request
-    for f in os.listdir(repoPath):
-        if not f.startswith('issue-'):
-            continue
-        issuePath = os.path.join(repoPath, f)
-        if any(issueFile.startswith('pr-comment-') for issueFile in os.listdir(issuePath)):
-            skippedIssues += 1
-        else:
-            # Check the json to see if this issue is a pull request
-            with open(os.path.join(issuePath, f + '.json'), 'r') as issueFile:
-                soup = json.load(issueFile)
-                realId = soup['number']
-                try:
-                    pullRequest = soup['pull_request']
-                except:
-                    continue
-                issueList.append((f, realId))
-
-    print('Skipping', str(skippedIssues), 'pull requests with fetched review comments')
+def fetchPullRequest(client, owner, repoName, issuePath, number, since=None, reviewComments=True,
+                     overwrite=None):
+    """Fetch a pull request and its review comments. If since is given, only fetch
+    review comments updated since then. The pull request and review comments
+    we already have are overwritten if overwrite is True, or by default, if since is given."""
+    print(issuePath)
+    if overwrite is None:
+        overwrite = bool(since)
+    pr = client.get(client.repoUrl(owner, repoName, 'pulls', number)).json()
+    writeJson(issuePath, 'pr-', pr, overwrite=overwrite)
+
+    # Find out if this PR has any review comments
+    # (issue comments on a PR are counted separately, in 'comments')
+    if not reviewComments or int(pr['review_comments']) == 0:
+        return 0
+    params = None
+    if since:
+        params = {'since': since}
+    numComments = 0
+    for c in client.iterate(client.repoUrl(owner, repoName, 'pulls', number, 'comments'), params):
+        writeJson(issuePath, 'pr-comment-', c, overwrite=overwrite)
+        numComments += 1
+    return numComments
+
+def markPullRequestDone(db, reviewComments):
+    """Returns an onDone callback for fetchConcurrently that updates the manifest."""
+    def onDone(issuePath):
+        markDone(db, os.path.basename(issuePath), 'pr_done')
+        if reviewComments:
+            markDone(db, os.path.basename(issuePath), 'reviews_done')
+    return onDone
+
+def scrapePullRequestComments(client, db, owner, repoName, repoPath, jobs, reviewComments=True):
+    """Scrape pull requests and review comments.
+    Returns the number of pull requests that failed."""
+    issueList = pendingPullRequests(db, reviewComments)
     print('Processing', str(len(issueList)), 'pull requests')
 
+    workList = [(owner, repoName, os.path.join(repoPath, f), number, None, reviewComments)
+                for (f, number) in issueList]
+    try:
+        numComments, failed = fetchConcurrently(client, jobs, fetchPullRequest, workList,
+                                                markPullRequestDone(db, reviewComments))
+    finally:
+        db.commit()
+    if reviewComments:
+        print('Fetched', str(numComments), 'review comments')
+    return failed
+
+def numberFromUrl(url):
+    """Returns the issue or pull request number at the end of an API url."""
+    return int(url.rstrip('/').rsplit('/', 1)[1])
+
+def repoCommentList(client, owner, repoName, kind, since):
+    """Yield (issue number, comment) for all issue comments (kind 'comment-')
+    or all review comments (kind 'pr-comment-') in a repository, oldest first,
+    that were updated since a date."""
+    if kind == 'comment-':
+        url = client.repoUrl(owner, repoName, 'issues', 'comments')
+        urlKey = 'issue_url'
+    else:
+        url = client.repoUrl(owner, repoName, 'pulls', 'comments')
+        urlKey = 'pull_request_url'
+    params = {'sort': 'created', 'direction': 'asc'}
+    if since:
+        params['since'] = since
+    for c in client.iterate(url, params):
+        yield numberFromUrl(c[urlKey]), c
+
+def writeRepoComments(repoPath, dirs, kind, comments, overwrite=False, state=None, key=None):
+    """Write (issue number, comment) pairs to the comment's issue directory.
+    If state is given, state[key] tracks the creation date of the last comment written,
+    up to the first comment that was skipped.
+    Returns the number of comments written."""
     numComments = 0
-    for f in issueList:
-        realId = f[1]
-        while True:
+    unknownIssues = 0
+    for number, c in comments:
+        if number not in dirs:
+            # The issue was opened after we listed the issues. The next run
+            # has to ask for the comments from this one on, so stop the cursor.
+            if state is not None and not unknownIssues:
+                state[key] = c['created_at']
+            unknownIssues += 1
+            continue
+        writeJson(os.path.join(repoPath, dirs[number]), kind, c, overwrite)
+        if state is not None and not unknownIssues:
+            state[key] = c['created_at']
+        numComments += 1
+        if (numComments % 1000) == 0:
+            print('Processed', numComments, 'comments')
+    if unknownIssues:
+        print('Skipped', str(unknownIssues), 'comments on issues we have not fetched')
+    return numComments
+
+def scrapeRepoComments(client, db, owner, repoName, repoPath, state):
+    """Scrape all issue comments and review comments, using the repository-wide lists.
+    Returns the number of lists that failed."""
+    dirs = issueDirsByNumber(db)
+    failed = 0
+    for kind, key, what, column in [('comment-', 'comments_created', 'comments', 'comments_done'),
+                                    ('pr-comment-', 'review_comments_created', 'review comments', 'reviews_done')]:
+        print('Fetching', what, 'for the whole repository')
+        comments = repoCommentList(client, owner, repoName, kind, state.get(key))
+        try:
+            numComments = writeRepoComments(repoPath, dirs, kind, comments, state=state, key=key)
+            print('Fetched', str(numComments), what)
+        except TransientError as e:
+            print('Giving up on the', what, 'for now, re-run the scraper to resume -', e)
+            failed += 1
+            continue
+        finally:
+            # Like last-processed-issue.txt, this lets us resume an interrupted scrape.
+            saveScrapeState(repoPath, state)
+        markAllDone(db, column, prsOnly=(kind == 'pr-comment-'))
+        db.commit()
+    return failed
+
+def refreshRepo(client, db, owner, repoName, repoPath, state, jobs, repoComments=False):
+    """Fetch issues, comments, pull requests and review comments updated since the last scrape.
+    If repoComments is True, comments are fetched with the repository-wide lists."""
+    since = state['updated_since']
+    print('Refreshing issues updated since', since)
+
+    params = {'sort': 'updated', 'direction': 'asc', 'state': 'all', 'since': since}
+    latestUpdate = since
+    commentList = []
+    prList = []
+    # Older versions stored ETags by request URL, one more every refresh
+    etags = {key: etag for key, etag in state['etags'].items() if key == ISSUES_ETAG}
+    for i in client.iterate(client.repoUrl(owner, repoName, 'issues'), params, etags, ISSUES_ETAG):
+        latestUpdate = max(latestUpdate, i['updated_at'])
+        issuePath = os.path.join(repoPath, 'issue-' + str(i['id']))
+        writeJson(issuePath, 'issue-', i, overwrite=True)
+        recordIssue(db, 'issue-' + str(i['id']), i)
+        if int(i['comments']) > 0:
+            commentList.append((owner, repoName, issuePath, i['number'], since))
+        if 'pull_request' in i:
+            prList.append((owner, repoName, issuePath, i['number'], since, not repoComments))
+
+    db.commit()
+
+    # Issues that a previous run failed to fetch everything for are fetched
+    # in full, since their comments may be older than the cursor.
+    # (The repository-wide lists have their own cursors.)
+    if not repoComments:
+        pending = [(os.path.join(repoPath, d), number) for (d, number) in pendingComments(db)]
+        pendingPaths = set(path for (path, number) in pending)
+        commentList = [work for work in commentList if work[2] not in pendingPaths]
+        commentList.extend((owner, repoName, path, number, None, True) for (path, number) in pending)
+    pending = [(os.path.join(repoPath, d), number) for (d, number) in pendingPullRequests(db, not repoComments)]
+    pendingPaths = set(path for (path, number) in pending)
+    prList = [work for work in prList if work[2] not in pendingPaths]
+    prList.extend((owner, repoName, path, number, None, not repoComments, True) for (path, number) in pending)
+
+    if repoComments:
+        dirs = issueDirsByNumber(db)
+        commentsFailed = 0
+        for kind, what in [('comment-', 'comments'), ('pr-comment-', 'review comments')]:
+            print('Refreshing', what, 'for the whole repository')
+            comments = repoCommentList(client, owner, repoName, kind, since)
             try:
-                issuePath = os.path.join(repoPath, f[0])
-                print(issuePath)
-                pr = repo.pull_request(realId)
-                writeJson(issuePath, 'pr-', pr)
-
-                # Find out if this PR has any comments
-                prj = json.loads(pr.as_json())
-                if int(prj['comments']) == 0:
-                    break
-                for c in pr.review_comments():
-                    print(c.id)
-                    writeJson(issuePath, 'pr-comment-', c)
-                    numComments += 1
-                break
-            except:
-                print('Processed', str(numComments), 'review comments')
-                print('Github rate limit at',
-                      str(repo.ratelimit_remaining) + ', sleeping until',
-                      datetime.datetime.now() + datetime.timedelta(minutes = GITHUB_RATELIMIT_INTERVAL))
-                time.sleep(60*GITHUB_RATELIMIT_INTERVAL)
-
-def __login(args):
+                numComments = writeRepoComments(repoPath, dirs, kind, comments, overwrite=True)
+                print('Fetched', str(numComments), what)
+            except TransientError as e:
+                print('Giving up on the', what, 'for now, re-run the scraper to fetch them -', e)
+                commentsFailed += 1
+    else:
+        print('Refreshing comments for', str(len(commentList)), 'issues')
+        numComments, commentsFailed = fetchConcurrently(client, jobs, fetchIssueComments, commentList,
+                                                        markIssueDone(db, 'comments_done'))
+        print('Fetched', str(numComments), 'comments')
+    print('Refreshing', str(len(prList)), 'pull requests')
+    numComments, prsFailed = fetchConcurrently(client, jobs, fetchPullRequest, prList,
+                                               markPullRequestDone(db, not repoComments))
+    print('Fetched', str(numComments), 'review comments')
+    db.commit()
+
+    # Only move the cursor once everything it covers has been fetched.
+    if commentsFailed or prsFailed:
+        print('Not moving the refresh cursor, since some items failed')
+        return
+    state['updated_since'] = latestUpdate
+    state['etags'] = etags
+    saveScrapeState(repoPath, state)
+
+def scrapeRepo(client, owner, repoName, jobs, refresh=False, repoComments=False, profile=None):
+    """Scrape (or with refresh, update) one repository into owner/repoName.
+    Returns False if the repository doesn't exist."""
+    repoPath = os.path.join(owner, repoName)
+    lastIssue = os.path.join(repoPath, 'last-processed-issue'+ '.txt')
+
     try:
-        with open(args.credentials_file_or_token, 'r') as f:
+        client.get(client.repoUrl(owner, repoName))
+    except PermanentError:
+        print('No such repo.')
+        return False
+
+    # Too bad makedirs exist_ok was removed in 3.4.1
+    if not os.path.exists(repoPath):
+        os.makedirs(repoPath)
+    print('Github rate limit at', str(client.pool.remaining()))
+    if profile:
+        setRepoProfile(repoPath, readProfile(profile))
+
+    db = openManifest(repoPath)
+    state = loadScrapeState(repoPath)
+    if refresh and state['updated_since']:
+        refreshRepo(client, db, owner, repoName, repoPath, state, jobs, repoComments)
+        return True
+    if refresh:
+        print('No record of a previous scrape, scraping the whole repository.')
+
+    latestUpdate = scrapeIssues(client, db, owner, repoName, repoPath, lastIssue)
+    if repoComments:
+        failed = scrapeRepoComments(client, db, owner, repoName, repoPath, state)
+        failed += scrapePullRequestComments(client, db, owner, repoName, repoPath, jobs,
+                                            reviewComments=False)
+    else:
+        failed = scrapeIssueComments(client, db, owner, repoName, repoPath, jobs)
+        failed += scrapePullRequestComments(client, db, owner, repoName, repoPath, jobs)
+    # Later refreshes can start from the newest issue we've seen,
+    # once everything before it has been fetched.
+    if failed:
+        print('Not starting the refresh cursor, since some items failed')
+    elif not state['updated_since'] and latestUpdate:
+        state['updated_since'] = latestUpdate
+        saveScrapeState(repoPath, state)
+    return True
+
+def readAuth(credentials):
+    """Returns (username, password) from a credentials file, or the string itself if it's a token."""
+    try:
+        with open(credentials, 'r') as f:
             username = f.readline().rstrip()
             password = f.readline().rstrip()
-            return login(username=username, password=password)
+            return (username, password)
     except IOError:
-        return login(token=args.credentials_file_or_token)
+        return credentials
 
 def main():
     parser = argparse.ArgumentParser(description='Scrape issues and comments from a github repository, by authenticating as a github user.')
     parser.add_argument('repository', help='github repository name')
     parser.add_argument('owner', help='github username of repository owner')
     parser.add_argument('credentials_file_or_token', help='OAuth token or path to file storing github username and password to use for authentication (two lines)')
+    parser.add_argument('--token', help='additional OAuth token or credentials file; requests are spread across all tokens (may be repeated)',
+                        action='append', default=[])
+    parser.add_argument('--jobs', help='number of issues or pull requests to fetch at once', type=int, default=1)
+    parser.add_argument('--api-url', help='base URL of the github API (e.g. a local mock server)', default=GITHUB_API_URL)
+    parser.add_argument('--repo-comments', help='fetch comments with the repository-wide comment lists, rather than one issue at a time',
+                        action='store_true', default=False)
+    parser.add_argument('--refresh', help='only fetch issues and comments updated since the last scrape',
+                        action='store_true', default=False)
+    parser.add_argument('--cache', help='directory to cache github responses in (see ghapi.py)')
+    parser.add_argument('--cache-mode', help='record: always fetch and cache responses; replay: only use cached responses (no network); ' +
+                        'revalidate: use cached responses github says are unchanged (default)',
+                        choices=CACHE_MODES, default='revalidate')
+    parser.add_argument('--profile', help='json fields to store from now on: built in profile (' +
+                        ', '.join(sorted(PROFILES)) + ') or file with one field per line (see ghprofile.py)')
     args = parser.parse_args()
 
-    repoPath = os.path.join(args.owner, args.repository)
-    lastIssue = os.path.join(repoPath, 'last-processed-issue'+ '.txt')
-
-    g = __login(args)
-    repo = g.repository(args.owner, args.repository)
-    if not repo:
-        print('No such repo.')
-        quit()
-
-    # Too bad makedirs exist_ok was removed in 3.4.1
-    if not os.path.exists(repoPath):
-        os.makedirs(repoPath)
-    if repo.ratelimit_remaining != 0:
-        print('Github rate limit at', str(repo.ratelimit_remaining))
-
-    scrapeIssues(repo, repoPath, None)
-    scrapeIssueComments(repo, repoPath)
-    scrapePullRequestComments(repo, repoPath)
+    auths = [readAuth(c) for c in [args.credentials_file_or_token] + args.token]
+    cache = None
+    if args.cache:
+        cache = ResponseCache(args.cache, args.cache_mode)
+    client = GitHubClient(auths, args.api_url, cache)
+    scrapeRepo(client, args.owner, args.repository, args.jobs,
+               args.refresh, args.repo_comments, args.profile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library turns the markdown of a github comment into plain sentences
+# for the sentiment model (see ghsentiment.py). In order, it:
+#
+#  - replaces fenced code (```...```) with 'block-code.'
+#  - replaces inline code (`...`) with 'inline-code'
+#  - replaces lines indented by four spaces with 'block-code.'
+#  - removes quoted lines (> ...)
+#  - replaces links ([text](url)) with their text
+#  - replaces URLs with 'URL'
+#  - converts emoji to their short codes (see ghemoji.py)
+#  - adds a '.' after a ':' at the end of a line, and at the end of the text
+#
+# The text used to be rewritten with a re.sub() for each step, each one
+# copying the whole text, and the link pattern backtracked to the end of the
+# line from every '[' (a pasted log with a '[' on every line took seconds).
+# Instead, the code spans are found in one scan over the text, and each line
+# is then rewritten once, with str.find() and no backtracking. The output is
+# the same as the re.sub() steps; ghscrubbench.py checks this on scraped
+# comments.
+
+import string
+from ghemoji import demojize, getConverter, nonAsciiPattern
+
+BLOCK_CODE = 'block-code.'
+INLINE_CODE = 'inline-code'
+
+# Bump this whenever a change here changes the scrubbed text, so that text
+# cached by an older version isn't used (see ghscrubcache.py).
+SCRUB_VERSION = 1
+
+def scrubVersion():
+    """Returns a string that changes whenever the scrubbed text would."""
+    return '%d %s' % (SCRUB_VERSION, getConverter().digest)
+
+def fencedPieces(text):
+    """Yield the text in pieces, with each fenced code block replaced by BLOCK_CODE.
+    A fence is closed by the next ``` at least one character later."""
+    pos = 0
+    while True:
+        start = text.find('```', pos)
+        if start < 0:
+            break
+        end = text.find('```', start + 4)
+        # If this fence isn't closed, no later one is either
+        if end < 0:
+            break
+        yield text[pos:start]
+        yield BLOCK_CODE
+        pos = end + 3
+    yield text[pos:]
+
+def codeSpans(text):
+    """Replace fenced code with BLOCK_CODE, and then inline code with INLINE_CODE.
+
+    Inline code is matched in the text left after the fences are replaced, so
+    it can span lines, or a fence. A backtick followed by another backtick
+    doesn't start inline code."""
+    out = []
+    # The text after an unmatched backtick, or None
+    pending = None
+    for piece in fencedPieces(text):
+        pos = 0
+        while True:
+            tick = piece.find('`', pos)
+            if tick < 0:
+                if pending is None:
+                    out.append(piece[pos:])
+                else:
+                    pending.append(piece[pos:])
+                break
+            if pending is None:
+                out.append(piece[pos:tick])
+                pending = []
+            else:
+                pending.append(piece[pos:tick])
+                if any(pending):
+                    out.append(INLINE_CODE)
+                    pending = None
+                else:
+                    # `` is not inline code, but the second backtick may start some
+                    out.append('`')
+                    pending = []
+            pos = tick + 1
+    if pending is not None:
+        out.append('`')
+        out.extend(pending)
+    return ''.join(out)
+
+def stripLinks(line):
+    """Replace each [text](url) in a line with its text."""
+    if '](' not in line:
+        return line
+    out = []
+    pos = 0
+    while True:
+        start = line.find('[', pos)
+        if start < 0:
+            break
+        middle = line.find('](', start + 1)
+        if middle < 0:
+            break
+        end = line.find(')', middle + 2)
+        # Without a ')' after the first '](', no later link can match either
+        if end < 0:
+            break
+        out.append(line[pos:start])
+        out.append(line[start + 1:middle])
+        pos = end + 1
+    out.append(line[pos:])
+    return ''.join(out)
+
+def replaceUrls(line):
+    """Replace each URL followed by a space with 'URL ', and a URL that runs
+    to the end of the line with 'URL.'."""
+    if 'http' not in line:
+        return line
+    out = []
+    pos = 0
+    search = 0
+    while True:
+        start = line.find('http', search)
+        if start < 0:
+            break
+        colon = start + 4
+        if line.startswith('s:', colon):
+            colon += 1
+        elif not line.startswith(':', colon):
+            search = start + 1
+            continue
+        # A URL is at least one character
+        space = line.find(' ', colon + 2)
+        if space < 0:
+            if colon + 1 < len(line):
+                out.append(line[pos:start])
+                out.append('URL.')
+                return ''.join(out)
+            break
+        out.append(line[pos:start])
+        out.append('URL ')
+        pos = search = space + 1
+    out.append(line[pos:])
+    return ''.join(out)
+
+def scrubLine(line, emoji=True):
+    if line.startswith('    ') and len(line) > 4:
+        return BLOCK_CODE
+    # Remove any quoted text, since we want the sentiment of the person posting
+    if line.startswith('>') and len(line) > 1:
+        return ''
+    line = replaceUrls(stripLinks(line))
+    # convert emojis into their short hand code.
+    # This makes it easier for me to correct sentiment in the training text.
+    # It also allows the Standford CoreNLP to parse each emoji as a separate word,
+    # which will allow us to train it for sentiment of groups of emoji.
+    # E.g. :tea: is neutral, but :tea: :fire: references the "This is fine" meme
+    if emoji:
+        line = demojize(line)
+    # We often have blocks of code follow a colon, e.g.
+    #
+    # This is not correct syntax for python 3:
+    # ```print foo```
+    # This is the correct syntax:
+    # ```print(foo)```
+    #
+    # This code will translate that into
+    #
+    # This is not correct syntax for python 3:
+    # block-quote
+    # This is the correct syntax:
+    # block-quote
+    #
+    # The Standford CoreNLP assumes that the sentence continues
+    # after the colon, because it's assuming sentences like
+    # "Henry is the proper gentleman: charming, polite, and classy."
+    #
+    # We really want to consider lines that end with a : as a sentence.
+    # For lines that end with an emoji, we want to add a '.' at the end.
+    # Compromise and just add a '.' at the end of both.
+    if line.endswith(':'):
+        line = line + '.'
+    return line
+
+def scrubMarkdown(text):
+    """Returns the scrubbed sentences of a comment's markdown."""
+    # Standardize on unix line endings.  (Yes, for whatever reason some
+    # projects use Windows line endings, some unix).
+    text = text.replace('\r\n', '\n')
+    # Most comments have no emoji, or any other non-ASCII characters
+    emoji = bool(nonAsciiPattern.search(text))
+    lines = [scrubLine(line, emoji) for line in codeSpans(text).split('\n')]
+
+    # FIXME: Standford CoreNLP doesn't parse '...' as the end of a sentence.
+    # If '...' is at the end of a line, turn it into '.'
+    # Does the text end with punctuation? If not, add a '.'
+
+    # FIXME: ugh, no idea what to do with sentences that end in :)
+
+    # FIXME: some people don't put periods after @tag someone.
+
+    # FIXME: Ignore commands sent to bots
+
+    # We can find when they do this at the end of the line.
+    if lines[-1][-1:] not in string.punctuation:
+        lines[-1] = lines[-1] + '.'
+    return '\n'.join(lines)
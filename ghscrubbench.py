@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program checks that ghscrub.py scrubs comments the same way as the
+# chain of re.sub() calls ghsentiment.py used to use (regexScrub() below),
+# and compares how long they take.
+#
+# It also checks ghemoji.py against emoji.demojize(): with the emoji
+# package's own names, the output must be the same. Both scrubbers convert
+# emoji with ghemoji.py, so they can be compared to each other.
+#
+# It scrubs the comments in a scraped repository, and some made up comments
+# that were slow to scrub (e.g. pasted logs). Any comment that comes out
+# differently is printed, and the program exits with an error. To run it:
+#
+# python ghscrubbench.py GITHUB_REPO_NAME GITHUB_OWNER_NAME
+
+import os
+import re
+import sys
+import json
+import time
+import string
+import argparse
+import emoji
+from emoji import unicode_codes
+from ghstore import openStore
+from ghscrub import scrubMarkdown
+from ghemoji import EmojiConverter, demojize
+
+def regexScrub(text):
+    """The re.sub() chain ghsentiment.py used to scrub comments with
+    (which called emoji.demojize() instead of ghemoji.py)."""
+    text = text.replace('\r\n', '\n')
+    text = re.sub('```.+?```', 'block-code.', text, flags=re.DOTALL)
+    text = re.sub('`[^`]+`', 'inline-code', text, flags=re.MULTILINE)
+    text = re.sub('^    .+?$', 'block-code.', text, flags=re.MULTILINE)
+    text = re.sub('^>.+?$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\[(.*?)\]\(.*?\)', r'\g<1>', text)
+    text = re.sub('https?:.+? ', 'URL ', text)
+    text = re.sub('https?:.+?$', 'URL.', text, flags=re.MULTILINE)
+    text = demojize(text)
+    text = re.sub(':$', ':.', text, flags=re.MULTILINE)
+    if text.split('\n')[-1][-1:] not in string.punctuation:
+        text = text + '.'
+    return text
+
+def madeUpComments():
+    """Comments that are slow to scrub, or easy to scrub wrong."""
+    log = '\n'.join('[%05d] [INFO] worker [%d] see http://ci.example.com/job/%d' % (i, i % 8, i)
+                    for i in range(20000))
+    return [
+        'Build failed:\n```\n' + log + '\n```\nAny ideas?',
+        'Pasted without a fence:\n' + log,
+        '[' * 5000 + 'not a link' + '](' * 10 + ' no close',
+        'http:' + 'x' * 100000,
+        '`' * 1001 + 'text' + '```' * 333,
+        '``a` b `c```d```e` f`` `',
+        '    indented\n> quoted\n>\n    \n[a] b [c](d) [e](f)\nhttps://a b http://c\nhttps:\nhttp: x',
+        'htt[p](x):/y done:',
+        'emoji at the end \U0001f44d\nand ☕ tea:\r\nwindows line\r\n',
+        'flags \U0001f1eb \U0001f1f7 and keycaps 1 \u20e3 #\u20e3 \u2615\ufe0f:',
+    ]
+
+def loadComments(repoPath, limit):
+    """Returns the bodies of the comments in a scraped repository."""
+    bodies = []
+    for issueDir, files in openStore(repoPath).iterRaw():
+        for name, data in files:
+            try:
+                body = json.loads(data.decode('utf-8')).get('body')
+            except ValueError:
+                continue
+            if body:
+                bodies.append(body)
+        if limit and len(bodies) >= limit:
+            break
+    return bodies
+
+def timeScrub(scrub, bodies):
+    start = time.perf_counter()
+    results = [scrub(body) for body in bodies]
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ghscrub.py against the regular expressions it replaced.')
+    parser.add_argument('repository', help='github repository name')
+    parser.add_argument('owner', help='github username of repository owner')
+    parser.add_argument('--limit', help='number of comments to scrub (0 for all)', type=int, default=0)
+    args = parser.parse_args()
+
+    repoPath = os.path.join(args.owner, args.repository)
+    # ghemoji.py, converting to the names emoji.demojize() uses
+    unicodeNames = EmojiConverter(dict(unicode_codes.UNICODE_EMOJI)).convert
+    differences = 0
+    for title, bodies in [('scraped comments', loadComments(repoPath, args.limit)),
+                          ('made up comments', madeUpComments())]:
+        for referenceName, reference, name, scrub in [('re.sub', regexScrub, 'ghscrub', scrubMarkdown),
+                                                      ('emoji.demojize', emoji.demojize, 'ghemoji', unicodeNames)]:
+            expected, referenceTime = timeScrub(reference, bodies)
+            results, scrubTime = timeScrub(scrub, bodies)
+            for body, e, r in zip(bodies, expected, results):
+                if e != r:
+                    differences += 1
+                    print('DIFFERENT:', repr(body[:200]))
+                    print('  ' + referenceName + ':', repr(e[:200]))
+                    print('  ' + name + ':', repr(r[:200]))
+            print('{:,} {}: {} {:.3f}s, {} {:.3f}s'.format(len(bodies), title, referenceName, referenceTime,
+                                                         name, scrubTime))
+    if differences:
+        print(differences, 'comments were scrubbed differently')
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library keeps the scrubbed text of comments (see ghscrub.py) in
+# owner/repo/scrub-cache.sqlite, so ghsentiment.py only scrubs the comments
+# that are new or were edited since the last run. It has three tables:
+#
+#  - scrubbed: the scrubbed text, by a hash of the comment body and the
+#    scrubber version (see bodyKey()). An edited comment gets a new key, and
+#    a change to the scrubber misses every old entry.
+#
+#  - sources: the issue directory and name of the json file each body came
+#    from, who wrote it, and its key (NULL if it has no body).
+#
+#  - dirs: a fingerprint of the files in each issue directory (see ghstore.py).
+#    With --recurse, an issue directory whose fingerprint hasn't changed isn't
+#    read at all; its comments come from the cache.
+#
+# After a --recurse run over the whole repository (without --since or
+# --until), the sources of json files that are gone are removed, and then any
+# scrubbed text that no json file has any more.
+
+import os
+import hashlib
+import sqlite3
+from ghbots import getRepoBots
+from ghscrub import scrubVersion
+
+CACHE_NAME = 'scrub-cache.sqlite'
+
+def bodyKey(body):
+    """Returns the cache key for a comment body."""
+    return hashlib.sha1((scrubVersion() + '\n' + body).encode('utf-8')).hexdigest()
+
+class ScrubCache:
+    """The scrubbed comments of one repository. With readOnly (in the worker
+    processes), the cache must already exist, and only lookup() is used."""
+
+    def __init__(self, repoPath, readOnly=False):
+        path = os.path.join(repoPath, CACHE_NAME)
+        # Issue directories read this run, to store once their files are (see finish())
+        self.fingerprints = {}
+        # With a run over the whole repository, the issue directories in it
+        self.present = None
+        if readOnly:
+            self.db = sqlite3.connect('file:' + path + '?mode=ro', uri=True)
+            return
+        self.db = sqlite3.connect(path)
+        # The worker processes read the cache while this process writes to it
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS scrubbed (key TEXT PRIMARY KEY, text TEXT NOT NULL)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS sources (
+                             dir TEXT NOT NULL,
+                             name TEXT NOT NULL,
+                             user TEXT,
+                             key TEXT,
+                             PRIMARY KEY (dir, name))''')
+        self.db.execute('CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)')
+        version = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if not version or version[0] != scrubVersion():
+            for table in ['scrubbed', 'sources', 'dirs']:
+                self.db.execute('DELETE FROM ' + table)
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (scrubVersion(),))
+        # Bot comments aren't scrubbed, so if the bots change, every
+        # directory is read again (the other comments are still cached).
+        bots = self.db.execute("SELECT value FROM meta WHERE key = 'bots'").fetchone()
+        digest = hashlib.sha1('\n'.join(sorted(getRepoBots(repoPath))).encode('utf-8')).hexdigest()
+        if not bots or bots[0] != digest:
+            self.db.execute('DELETE FROM dirs')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('bots', ?)", (digest,))
+        self.db.commit()
+
+    def lookup(self, key):
+        """Returns the scrubbed text for a key, or None if it isn't cached."""
+        row = self.db.execute('SELECT text FROM scrubbed WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def unchangedDirs(self, fingerprints):
+        """Returns the set of issue directories whose files haven't changed since they were cached,
+        given a dictionary of issue directory to its current fingerprint."""
+        return set(d for d, fingerprint in self.db.execute('SELECT dir, fingerprint FROM dirs')
+                   if fingerprints.get(d) == fingerprint)
+
+    def dirSources(self, issueDir):
+        """Returns a list of (file name, user, key, scrubbed text) for the json files in an
+        issue directory, sorted by name. The text is None for files with no body, or bots."""
+        return self.db.execute('''SELECT s.name, s.user, s.key, c.text
+                                  FROM sources s LEFT JOIN scrubbed c ON s.key = c.key
+                                  WHERE s.dir = ? ORDER BY s.name''', (issueDir,)).fetchall()
+
+    def readDir(self, issueDir, fingerprint):
+        """Forget an issue directory's files before they're read again."""
+        self.db.execute('DELETE FROM sources WHERE dir = ?', (issueDir,))
+        self.db.execute('DELETE FROM dirs WHERE dir = ?', (issueDir,))
+        self.fingerprints[issueDir] = fingerprint
+
+    def add(self, issueDir, name, user, key, text, new):
+        """Record a json file, and its scrubbed text if it's new."""
+        self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)', (issueDir, name, user, key))
+        if new:
+            self.db.execute('INSERT OR IGNORE INTO scrubbed VALUES (?, ?)', (key, text))
+
+    def commit(self):
+        self.db.commit()
+
+    def finish(self):
+        """Store the fingerprints of the issue directories read this run, and
+        after a run over the whole repository, evict what's gone."""
+        self.db.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?)', self.fingerprints.items())
+        if self.present is not None:
+            gone = [d for (d,) in self.db.execute('SELECT dir FROM sources UNION SELECT dir FROM dirs')
+                    if d not in self.present]
+            for d in gone:
+                self.db.execute('DELETE FROM sources WHERE dir = ?', (d,))
+                self.db.execute('DELETE FROM dirs WHERE dir = ?', (d,))
+            evicted = self.db.execute('''DELETE FROM scrubbed WHERE key NOT IN
+                                         (SELECT key FROM sources WHERE key IS NOT NULL)''').rowcount
+            print('Evicted', len(gone), 'removed issues and', evicted, 'scrubbed comments from the cache')
+        self.db.commit()
+        self.fingerprints = {}
+        self.present = None
+
+    def close(self):
+        self.db.close()
@@ -32,116 +32,230 @@
 # - is table formatting going to be a problem?
 
 import os
-import re
-import argparse
 import json
-import emoji
-import string
-
-def scrubFile(f):
-    with open(f) as jsonFile:
-        try:
-            soup = json.load(jsonFile)
-        except:
-            return None
-    text = soup.get('body')
-    if not text:
-        return None
+import argparse
+from collections import deque
+from multiprocessing import Pool
+from ghstore import getStore, splitPath
+from ghwalk import issueSortKey
+from ghbots import getRepoBots
+from ghdb import openDb, pathsInWindow
+from ghevents import parseDay
+from ghscrub import scrubMarkdown
+from ghscrubcache import ScrubCache, bodyKey
 
-    # Standardize on unix line endings.  (Yes, for whatever reason some
-    # projects use Windows line endings, some unix).
-    text = text.replace('\r\n', '\n')
-      
-    # Strip out any blockquotes or inline code
-    text = re.sub('```.+?```', 'block-code.', text, flags=re.DOTALL)
-    text = re.sub('`[^`]+`', 'inline-code', text, flags=re.MULTILINE)
-    text = re.sub('^    .+?$', 'block-code.', text, flags=re.MULTILINE)
-    # Remove any quoted text, since we want the sentiment of the person posting
-    text = re.sub('^>.+?$', '', text, flags=re.MULTILINE)
-    # Replace any URLs with their text
-    text = re.sub('\[(.*?)\]\(.*?\)', '\g<1>', text)
-    text = re.sub('https?:.+? ', 'URL ', text)
-    text = re.sub('https?:.+?$', 'URL.', text, flags=re.MULTILINE)
-    # convert emojis into their short hand code.
-    # This makes it easier for me to correct sentiment in the training text.
-    # It also allows the Standford CoreNLP to parse each emoji as a separate word,
-    # which will allow us to train it for sentiment of groups of emoji.
-    # E.g. :tea: is neutral, but :tea: :fire: references the "This is fine" meme
-    text = emoji.demojize(text)
-    # We often have blocks of code follow a colon, e.g.
-    #
-    # This is not correct syntax for python 3:
-    # ```print foo```
-    # This is the correct syntax:
-    # ```print(foo)```
-    #
-    # This code will translate that into
-    #
-    # This is not correct syntax for python 3:
-    # block-quote
-    # This is the correct syntax:
-    # block-quote
-    #
-    # The Standford CoreNLP assumes that the sentence continues
-    # after the colon, because it's assuming sentences like
-    # "Henry is the proper gentleman: charming, polite, and classy."
-    #
-    # We really want to consider lines that end with a : as a sentence.
-    # For lines that end with an emoji, we want to add a '.' at the end.
-    # Compromise and just add a '.' at the end of both.
-    text = re.sub(':$', ':.', text, flags=re.MULTILINE)
-
-    # FIXME: Standford CoreNLP doesn't parse '...' as the end of a sentence.
-    # If '...' is at the end of a line, turn it into '.'
-    # Does the text end with punctuation? If not, add a '.'
-
-    # FIXME: ugh, no idea what to do with sentences that end in :)
-
-    # FIXME: some people don't put periods after @tag someone.
-
-    # FIXME: Ignore comments from any bots? They tend to not use punctuation.
-
-    # FIXME: Ignore commands sent to bots
-
-    # We can find when they do this at the end of the line.
-    if text.split('\n')[-1][-1:] not in string.punctuation:
-        text = text + '.'
-    return text
-
-# Create a raw text file for the issue in question
-# Lines with a # are used to denote which json file the words came from
-def scrubText(repoPath, issueDir):
-    scrubbed = ""
-    files = os.listdir(os.path.join(repoPath, issueDir))
-    for f in files:
-        scrubbed = scrubbed + '#' + os.path.join(issueDir, f) + '\n'
-        text = scrubFile(os.path.join(repoPath, issueDir, f))
-        if text:
-            scrubbed = scrubbed + text + '\n.\n'
-    return scrubbed
-
-def findJsonFiles(matchedFile, searchDirs):
+def matchedJsonFiles(matchedFile, searchDirs):
+    """Returns the store, issue directory, and json file names to output for a line of the input file,
+    or None if there aren't any."""
     matchedName, matchedExt = os.path.splitext(matchedFile)
     if not matchedExt == '.json':
         return None
+    repoPath, issueDir, name = splitPath(matchedFile)
+    store = getStore(repoPath)
     if not searchDirs:
-        jsonFiles = [matchedFile]
+        return store, issueDir, [name]
+    try:
+        return store, issueDir, store.files(issueDir)
+    except:
+        print("WARN: Error grabbing file", matchedFile, "basedir:", store.path(issueDir))
+        return None
+
+def findRawJsonFiles(matchedFile, searchDirs):
+    """Returns (path, bytes) for the json files to output for a line of the input file,
+    or None if there aren't any."""
+    matched = matchedJsonFiles(matchedFile, searchDirs)
+    if not matched:
+        return None
+    store, issueDir, names = matched
+    return [(store.path(issueDir, x), store.raw(issueDir, x)) for x in names]
+
+def windowPaths(db, since=None, until=None):
+    """Returns the set of paths of the json files created in a window,
+    or None if there isn't one."""
+    if since is None and until is None:
+        return None
+    return pathsInWindow(db, since, until)
+
+def findRepoRawFiles(repoPath, db=None, prefetch=0, since=None, until=None):
+    """Yield (path, bytes) for every json file in a repository, in order.
+    With prefetch, that many threads read ahead (see ghwalk.py).
+    With since or until, only the files created in that window (in the database db) are read."""
+    store = getStore(repoPath)
+    paths = windowPaths(db, since, until)
+    dirs = None
+    if paths is not None:
+        dirs = sorted(set(splitPath(path)[1] for path in paths), key=issueSortKey)
+    for issueDir, files in store.iterRaw(prefetch, dirs):
+        for name, data in files:
+            path = store.path(issueDir, name)
+            if paths is not None and path not in paths:
+                continue
+            yield path, data
+
+def findRepoCachedFiles(repoPath, cache, db=None, prefetch=0, since=None, until=None):
+    """Like findRepoRawFiles(), but the files in issue directories that haven't
+    changed since they were cached aren't read: they're yielded as
+    (path, (user, cache key, scrubbed text)) instead (see ghscrubcache.py)."""
+    store = getStore(repoPath)
+    paths = windowPaths(db, since, until)
+    dirs = store.issueDirs()
+    if paths is None:
+        cache.present = set(dirs)
     else:
-        baseDir = os.path.dirname(matchedFile)
-        try:
-            jsonFiles = [os.path.join(baseDir, x) for x in os.listdir(baseDir)]
-        except:
-            print("WARN: Error grabbing file", matchedFile, "basedir:", baseDir)
-            return None
-    return jsonFiles
-
-def findRepoJsonFiles(repoPath):
-    issues = [os.path.join(repoPath, x) for x in os.listdir(repoPath)
-              if x.startswith('issue-') and os.path.isdir(os.path.join(repoPath, x))]
-    jsonFiles = []
-    for i in issues:
-        jsonFiles = jsonFiles + [os.path.join(i, x) for x in os.listdir(i)]
-    return jsonFiles
+        windowDirs = set(splitPath(path)[1] for path in paths)
+        dirs = [d for d in dirs if d in windowDirs]
+    fingerprints = {d: store.fingerprint(d) for d in dirs}
+    unchanged = cache.unchangedDirs(fingerprints)
+    print(len(dirs) - len(unchanged), 'of', len(dirs), 'issues changed since the last run')
+    bots = getRepoBots(repoPath)
+    # Both kinds of store read the issue directories in the order of issueDirs()
+    changed = store.iterRaw(prefetch, [d for d in dirs if d not in unchanged])
+    for issueDir in dirs:
+        if issueDir in unchanged:
+            for name, user, key, text in cache.dirSources(issueDir):
+                path = store.path(issueDir, name)
+                if paths is not None and path not in paths:
+                    continue
+                # A bot may have written the same text as someone else
+                if user in bots:
+                    text = None
+                yield path, (user, key, text)
+            continue
+        _, files = next(changed)
+        # Only a run over every file in the directory can replace its cached files
+        if paths is None:
+            cache.readDir(issueDir, fingerprints[issueDir])
+        for name, data in files:
+            path = store.path(issueDir, name)
+            if paths is not None and path not in paths:
+                continue
+            yield path, data
+
+def parseJson(data):
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+
+# Scrubbing (parsing the json, the regular expressions, and converting
+# emoji) takes most of the time. With --jobs, the json files are sent to a
+# pool of processes as bytes, CHUNK_SIZE files at a time. Only IN_FLIGHT
+# chunks per process are queued at once, so memory use doesn't grow with the
+# size of the repository, and chunks are written out in the order they were
+# read, so the output is the same as without --jobs.
+#
+# The scrubbed text is cached (see ghscrubcache.py). The worker processes
+# look up comments in the cache, and only scrub the ones that aren't there;
+# the main process writes what they scrubbed to the cache.
+
+# Number of json files each worker process scrubs at a time
+CHUNK_SIZE = 200
+# Chunks queued per worker process
+IN_FLIGHT = 4
+
+# Scrub caches, by repository path. The worker processes open their own,
+# read-only, in workerCaches.
+scrubCaches = {}
+workerCaches = None
+
+def getScrubCache(repoPath):
+    repoPath = os.path.normpath(repoPath)
+    if repoPath not in scrubCaches:
+        scrubCaches[repoPath] = ScrubCache(repoPath)
+    return scrubCaches[repoPath]
+
+def initWorker():
+    global workerCaches
+    workerCaches = {}
+
+def lookupScrubbed(repoPath, key):
+    """Returns the cached scrubbed text for a key, or None."""
+    if workerCaches is None:
+        return getScrubCache(repoPath).lookup(key)
+    repoPath = os.path.normpath(repoPath)
+    if repoPath not in workerCaches:
+        workerCaches[repoPath] = ScrubCache(repoPath, readOnly=True)
+    return workerCaches[repoPath].lookup(key)
+
+def scrubRecord(path, data, useCache=False):
+    """Returns (path, user, cache key, scrubbed text, whether the text is new)
+    for a json file's bytes, or for (user, key, text) from the cache, which isn't new or old (None).
+    The key and text are None if the file has no body, and the text is None for bots."""
+    if isinstance(data, tuple):
+        return (path,) + data + (None,)
+    repoPath = splitPath(path)[0]
+    soup = parseJson(data)
+    user = soup['user']['login'] if soup and soup.get('user') else None
+    body = soup.get('body') if soup else None
+    if not body:
+        return path, user, None, None, False
+    key = bodyKey(body) if useCache else None
+    # Don't send bot comments to the sentiment model
+    if user in getRepoBots(repoPath):
+        return path, user, key, None, False
+    text = lookupScrubbed(repoPath, key) if useCache else None
+    if text is not None:
+        return path, user, key, text, False
+    # Strip out code, quotes, links, and URLs, and convert emoji (see ghscrub.py)
+    return path, user, key, scrubMarkdown(body), True
+
+def scrubChunk(chunk, useCache=False):
+    """Scrub a list of (path, bytes). This runs in the worker processes."""
+    return [scrubRecord(path, data, useCache) for path, data in chunk]
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def scrubFiles(files, jobs=1, useCache=False):
+    """Yield scrubRecord() for each (path, bytes), in order.
+    With jobs, the files are scrubbed in that many processes."""
+    if jobs <= 1:
+        for path, data in files:
+            yield scrubRecord(path, data, useCache)
+        return
+    pool = Pool(jobs, initWorker)
+    pending = deque()
+    for chunk in chunked(files, CHUNK_SIZE):
+        pending.append(pool.apply_async(scrubChunk, (chunk, useCache)))
+        if len(pending) >= jobs * IN_FLIGHT:
+            for result in pending.popleft().get():
+                yield result
+    while pending:
+        for result in pending.popleft().get():
+            yield result
+    pool.close()
+    pool.join()
+
+def inputJsonFiles(paths, args):
+    """Yield (path, bytes) for the json files to output, for the lines of the input file
+    (or the repository, with --recurse). Unless --no-cache, the scrub caches of the
+    repositories are opened first, and with --recurse, unchanged files come from the cache."""
+    for line in paths:
+        # The database is only needed to find the files in a window
+        db = None
+        if args.recurse and (args.since or args.until):
+            db = openDb(line)
+        if args.recurse and args.no_cache:
+            jsonFiles = findRepoRawFiles(line, db, args.prefetch, args.since, args.until)
+        elif args.recurse:
+            jsonFiles = findRepoCachedFiles(line, getScrubCache(line), db, args.prefetch, args.since, args.until)
+        else:
+            jsonFiles = findRawJsonFiles(line, args.dirs)
+            if jsonFiles and not args.no_cache:
+                getScrubCache(splitPath(line)[0])
+        if not jsonFiles:
+            continue
+        for path, data in jsonFiles:
+            yield path, data
+        if db is not None:
+            db.close()
 
 # File format is relative path to json file (starting with owner/repo), one per line
 def main():
@@ -152,6 +266,16 @@ def main():
                         action="store_true", default=False)
     parser.add_argument("--recurse", help="inFile is a path to a repo; output all comments on all issues",
                         action="store_true", default=False)
+    parser.add_argument("--prefetch", help="with --recurse, read json files ahead in this many threads (useful on network filesystems)",
+                        type=int, default=0)
+    parser.add_argument("--jobs", help="number of processes to scrub comments with",
+                        type=int, default=1)
+    parser.add_argument('--since', help='with --recurse, only output comments from on or after this date (YYYY-MM-DD)',
+                        type=parseDay, default=None)
+    parser.add_argument('--until', help='with --recurse, only output comments from before this date (YYYY-MM-DD)',
+                        type=parseDay, default=None)
+    parser.add_argument('--no-cache', help="don't read or write the cache of scrubbed comments (scrub-cache.sqlite)",
+                        action='store_true', default=False)
     args = parser.parse_args()
 
     # FIXME: I think there's probably a way to make the flags exclusive?
@@ -168,22 +292,23 @@ def main():
 
     jsonCount = 0
     with open(args.outFile, 'w') as commentFile:
-        for line in paths:
-            if args.recurse:
-                jsonFiles = findRepoJsonFiles(line)
-            else:
-                jsonFiles = findJsonFiles(line, args.dirs)
-            if not jsonFiles:
-                continue
-            for json in jsonFiles:
-                text = scrubFile(json)
-                jsonCount = jsonCount + 1
-                if text:
-                    commentFile.write('#' + json + ' . \n')
-                    commentFile.write(text)
-                    commentFile.write('\n.\n')
-                if (jsonCount != 0 and jsonCount % 5000 == 0):
-                    print("Processed", jsonCount, "json files")
+        for json, user, key, text, new in scrubFiles(inputJsonFiles(paths, args), args.jobs, not args.no_cache):
+            jsonCount = jsonCount + 1
+            # Files that weren't read are cached already
+            if new is not None and not args.no_cache:
+                repoPath, issueDir, name = splitPath(json)
+                getScrubCache(repoPath).add(issueDir, name, user, key, text, new)
+            if text:
+                commentFile.write('#' + json + ' . \n')
+                commentFile.write(text)
+                commentFile.write('\n.\n')
+            if (jsonCount != 0 and jsonCount % 5000 == 0):
+                print("Processed", jsonCount, "json files")
+                for cache in scrubCaches.values():
+                    cache.commit()
+    for cache in scrubCaches.values():
+        cache.finish()
+        cache.close()
 
 if __name__ == "__main__":
     main()
@@ -19,13 +19,13 @@ import argparse
 from collections import defaultdict
 from datetime import datetime
 import itertools
-import json
 import os
 import re
 import statistics
 from plotly.offline import download_plotlyjs, init_notebook_mode, iplot, offline
 from plotly.graph_objs import *
-from ghcategorize import getUserDate
+from ghdb import openDb, dateWindow
+from ghevents import loadEvents, toDatetime, addWindowArguments
 
 def labelToNumber(label):
     if re.match('^  Very positive', label):
@@ -112,56 +112,66 @@ def createIssueSentiment(commentSentiment):
                              }
     return combinedIssueSentiment
 
-def createJsonDict(repoPath, issueKeys, debug):
+def windowIssueSentiment(db, issueSentiment, since, until):
+    # Only keep the issues opened from since up to until
+    if since is None and until is None:
+        return issueSentiment
+    condition, params = dateWindow(since, until)
+    issueDirs = set(row[0] for row in db.execute('SELECT dir FROM issues WHERE ' + condition, params))
+    return {key: value for key, value in issueSentiment.items() if key in issueDirs}
+
+def createJsonDict(repoPath, db, issueKeys, debug):
     # issueDict has the issue numbers (e.g. issue-23529) as keys
     # Create a dictionary for each json comment file
     # key (path): (date, user)
-    # First grab lines from the categorized project csv files.
+    # First grab the events from the categorized project files.
     # Ignore any lines with the username bors as merger,
     # since both bors and the user who sent a command to bors
     # will be marked as a merger for the same json PR comment file.
+    # (Mergers are skipped altogether, as are bors' lines in the other files.)
     jsonDict = defaultdict(list)
-    for f in ['contributors.txt', 'mergers.txt', 'reporters.txt', 'responders.txt', 'reviewers.txt', 'submitters.txt']:
-        with open(os.path.join(repoPath, f)) as tabsFile:
-            lines = tabsFile.read().splitlines()
-        fileTuples = [l.split('\t')[1:] for l in lines if len(l.split('\t')) > 3 and (f != 'mergers.txt' and l.split('\t')[2] != 'bors')]
-        for f in fileTuples:
-            date = f[0]
-            username = f[1]
-            path = f[2]
-            jsonDict[path] = (datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ"), username)
+    events = loadEvents(repoPath)
+    rows = events.where('contributor', 'reporter', 'responder', 'reviewer', 'submitter')
+    for time, user, path in zip(events.time[rows].tolist(), events.user[rows].tolist(),
+                                events.path[rows].tolist()):
+        username = events.users[user]
+        if username == 'bors':
+            continue
+        jsonDict[events.paths[path]] = (toDatetime(time), username)
     dictSize = len(jsonDict)
     if debug:
         print('Added', len(jsonDict), 'categorized json files')
 
     # It's possible that an issue or PR's first json file has no comments,
     # so manually add the date and username of the person that opened this issue.
+    issues = {path: (user, date) for path, user, date in db.execute('SELECT path, user, created_at FROM issues')}
     for k in [os.path.join(repoPath, key, key + '.json') for key in issueKeys if os.path.join(repoPath, key, key + '.json') not in jsonDict.keys()]:
-        with open(k) as issueFile:
-            issueJson = json.load(issueFile)
-        user, date = getUserDate(issueJson)
+        if k not in issues:
+            print('WARN:', k, 'is not in the analytics database, run ghdb.py to update it')
+            continue
+        user, date = issues[k]
         jsonDict[k] = (datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ"), user)
     if debug:
         print('Added', len(jsonDict) - dictSize, 'uncategorized json files')
     return jsonDict
 
-def graphSentiment(repoPath, debug):
+def graphSentiment(repoPath, db, debug, since=None, until=None):
     sentimentDict = createSentimentDict(repoPath)
     commentSentiment = createSentimentCounts(sentimentDict)
-    combinedIssueSentiment = createIssueSentiment(commentSentiment)
+    combinedIssueSentiment = windowIssueSentiment(db, createIssueSentiment(commentSentiment), since, until)
 
     if debug:
         print('Have', len(commentSentiment), 'sentiment json files')
-    jsonDict = createJsonDict(repoPath, combinedIssueSentiment.keys(), True)
+    jsonDict = createJsonDict(repoPath, db, combinedIssueSentiment.keys(), True)
     
+    urls = dict(db.execute('SELECT path, html_url FROM issues'))
+
     # List: [date, issue path (for now), (combinedIssueSentiment 5 tuple)]
     coords = []
     for key, value in combinedIssueSentiment.items():
         try:
             path = os.path.join(repoPath, key, key + '.json')
-            with open(path) as issueFile:
-                issueJson = json.load(issueFile)
-            url = issueJson['html_url']
+            url = urls[path]
             coords.append((jsonDict[path][0], key, value, url))
         except:
             key2 = os.path.join(repoPath, key, key + '.json')
@@ -236,10 +246,10 @@ def graphSentiment(repoPath, debug):
     fig = Figure(data=data, layout=layout)
     return offline.plot(fig, show_link=False, auto_open=False, include_plotlyjs=False, output_type='div')
 
-def htmlSentimentStats(repoPath):
+def htmlSentimentStats(repoPath, db, since=None, until=None):
     sentimentDict = createSentimentDict(repoPath)
     commentSentiment = createSentimentCounts(sentimentDict)
-    combinedIssueSentiment = createIssueSentiment(commentSentiment)
+    combinedIssueSentiment = windowIssueSentiment(db, createIssueSentiment(commentSentiment), since, until)
 
     htmlString = ''
     htmlString = htmlString + '<p>' + "On average, an issue or pull request in " + repoPath + " contains:" + '\n'
@@ -267,12 +277,15 @@ def htmlSentimentStats(repoPath):
 def main():
     parser = argparse.ArgumentParser(description='Output statistics comparing sentiment of multiple communities')
     parser.add_argument('repoPath', help='github repository name')
+    addWindowArguments(parser)
     args = parser.parse_args()
 
     repoPath = args.repoPath
-    html = graphSentiment(repoPath, True)
+    db = openDb(repoPath)
+    html = graphSentiment(repoPath, db, True, args.since, args.until)
     print(html)
-    print(htmlSentimentStats(repoPath))
+    print(htmlSentimentStats(repoPath, db, args.since, args.until))
+    db.close()
 
 if __name__ == "__main__":
     main()
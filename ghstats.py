@@ -35,9 +35,13 @@
 #  - contributors.txt
 #  - reviewers.txt
 #  - mergers.txt
+#
+# through the events table ghcategorize.py writes (see ghevents.py).
+#
+# With --since and --until, the graphs only cover activity in that window
+# (e.g. --since 2016-01-01 --until 2016-04-01 for the first quarter of 2016).
 
 import os
-import re
 import statistics
 import argparse
 import numpy
@@ -46,44 +50,43 @@ from plotly.offline import download_plotlyjs, init_notebook_mode, iplot, offline
 from plotly.graph_objs import *
 from ghcategorize import jsonIsPullRequest, jsonIsPullRequestComment
 from ghreport import overwritehtml
+from ghevents import loadEvents, toDatetime, addWindowArguments
+from ghbots import loadBots
+from ghdb import openDb
 from ghsentimentstats import graphSentiment
 from ghsentimentstats import htmlSentimentStats
 
-def issueDir(longerDir):
-    return re.sub(r'(.*?issue-[0-9]+).*', '\g<1>', longerDir)
-
-def prOpenTimes(owner, repo):
+# With since or until, only pull requests opened in that window are counted,
+# including the ones merged after it.
+def prOpenTimes(owner, repo, events=None, since=None, until=None):
     repoPath = os.path.join(owner, repo)
-    with open(os.path.join(repoPath, 'contributors.txt')) as contributorsFile:
-        contributors = contributorsFile.read().split('\n')
-    with open(os.path.join(repoPath, 'mergers.txt')) as mergersFile:
-        mergers = mergersFile.read().split('\n')
+    if events is None:
+        events = loadEvents(repoPath)
+    opened = events.window(since, until)
+    contributors = opened.where('contributor')
+    mergers = events.where('merger')
+    allContributors = set(events.issue[events.where('contributor')].tolist())
 
-    # Get rid of any misformated lines
-    mergers = [m for m in mergers if len(m.split('\t')) > 3]
-    # The fourth item on the line is the file name
-    # For mergers, it may be a comment-*.json
+    # For mergers, the file may be a comment-*.json
     # For contributors, it may be a pr_*.json
     # Use the issue-* directory as the key
-    d = {issueDir(c.split('\t')[3]): [c.split('\t')[1]] for c in contributors if len(c.split('\t')) > 3}
+    d = {issue: [time] for issue, time in zip(opened.issue[contributors].tolist(),
+                                              opened.time[contributors].tolist())}
 
     # Note: we could have two mergers because someone asked bors to merge
     # something for them.  This will add a bit of noise to the data, but we
     # expect bors to be fast, so the time difference shouldn't matter.
     # If we've already recorded a merger, skip the insertion.
-    for m in mergers:
-        if len(m.split('\t')) < 3:
-            continue
-        key = issueDir(m.split('\t')[3])
+    for key, time in zip(events.issue[mergers].tolist(), events.time[mergers].tolist()):
         if not key in d.keys():
-            print("Someone marked in mergers.txt as merger for unmerged issue", key)
+            if not key in allContributors:
+                print("Someone marked in mergers.txt as merger for unmerged issue", events.issues[key])
             continue
         if len(d[key]) == 2:
             continue
-        d[key].append(m.split('\t')[1])
+        d[key].append(time)
 
-    coords = [(datetime.strptime(value[0], "%Y-%m-%dT%H:%M:%SZ"),
-               datetime.strptime(value[1], "%Y-%m-%dT%H:%M:%SZ"))
+    coords = [(toDatetime(value[0]), toDatetime(value[1]))
                for k, value in d.items()]
     coords.sort()
     return coords
@@ -153,15 +156,14 @@ def graphMergeDelay(coords):
     return offline.plot(fig, show_link=False, include_plotlyjs=False, output_type='div')
 
 # Create a bar chart showing the ways different newcomers get involved
-def graphNewcomers(repoPath, newcomers):
-    # Sometimes we get bad data?
-    newcomers = [x for x in newcomers if len(x.split('\t')) >= 4]
+def graphNewcomers(repoPath, events):
+    # For each first interaction, pull out the filename
+    newcomers = [os.path.basename(events.paths[p]) for p in events.path[events.where('first')].tolist()]
 
-    issue = [x for x in newcomers if x.split('\t')[2].startswith('issue')]
-    comment = [x for x in newcomers if x.split('\t')[2].startswith('comment')]
-    pull = [x for x in newcomers if jsonIsPullRequest(x.split('\t')[2])]
-    commentPR = [x for x in newcomers if jsonIsPullRequestComment(x.split('\t')[2])]
-    # For each line, pull out the filename (third item)
+    issue = [x for x in newcomers if x.startswith('issue')]
+    comment = [x for x in newcomers if x.startswith('comment')]
+    pull = [x for x in newcomers if jsonIsPullRequest(x)]
+    commentPR = [x for x in newcomers if jsonIsPullRequestComment(x)]
     data = [
         Bar(x=['Opened an issue', 'Commented on an issue<BR>opened by someone else', 'Opened a pull request', 'Commented on a pull request<BR>opened by someone else'],
             y= [len(issue), len(comment), len(pull), len(commentPR)],
@@ -172,35 +174,26 @@ def graphNewcomers(repoPath, newcomers):
     fig = Figure(data=data, layout=layout)
     return offline.plot(fig, show_link=False, include_plotlyjs=False, output_type='div')
 
-def sortContributors(data):
-    """Returns a dictionary with username as the key to return a list of contributions,
-    sorted in order by date."""
+def sortContributors(events, role):
+    """Returns a dictionary with username as the key to return a list of contributions
+    in a role, sorted in order by date."""
+    rows = events.where(role)
+    # Sort by user, then date
+    rows = rows[numpy.lexsort((events.time[rows], events.user[rows]))]
     dates = {}
-    for line in data.split('\n'):
-        lineSplit = line.split('\t')
-        if len(lineSplit) < 4:
-            continue
-        user = lineSplit[2]
-        startDate = datetime.strptime(lineSplit[1], "%Y-%m-%dT%H:%M:%SZ")
-        if user in dates:
-            dates[user].append(startDate)
-        else:
-            dates[user] = [startDate]
-    for user, date in dates.items():
-        dates[user].sort()
+    for user, time in zip(events.user[rows].tolist(), events.time[rows].tolist()):
+        dates.setdefault(events.users[user], []).append(toDatetime(time))
     return dates
 
-def getRampTime(newcomers, contributionDates, contributionType):
+def getRampTime(events, contributionDates, contributionType):
     deltaContribution = []
     noContribution = []
 
-    for line in newcomers:
-        lineSplit = line.split('\t')
-        # FIXME: for some reason there's some blank lines in our data
-        if len(lineSplit) < 4:
-            continue
-        user = lineSplit[0]
-        startDate = datetime.strptime(lineSplit[3], "%Y-%m-%dT%H:%M:%SZ")
+    newcomers = events.where('first')
+    for user, time, path in zip(events.user[newcomers].tolist(), events.time[newcomers].tolist(),
+                                events.path[newcomers].tolist()):
+        user = events.users[user]
+        startDate = toDatetime(time)
         # Find the time it took for a user to start contributing
         # in a particular way from the date of their first interaction
         # with the project. Note their first interaction could be this
@@ -212,7 +205,7 @@ def getRampTime(newcomers, contributionDates, contributionType):
         delta = nextDate - startDate
         if delta.days < 0:
             print('Negative delta for user', user, 'for', contributionType, 'on', nextDate)
-            print('first contribution was on', startDate, 'file', os.path.join(lineSplit[1], lineSplit[2]))
+            print('first contribution was on', startDate, 'file', events.paths[path])
             continue
         deltaContribution.append(delta.days)
 
@@ -234,12 +227,11 @@ def graphRampTime(deltas, nocontribs, graphtitle, xtitle, filename):
     fig = Figure(data=data, layout=layout)
     return offline.plot(fig, show_link=False, include_plotlyjs=False, output_type='div')
 
-# FIXME Maybe look for the word 'bot' in the user description?
-def getBots():
-    return ['bors', 'bors-servo', 'googlebot', 'highfive', 'k8s-ci-robot', 'k8s-merge-robot', 'k8s-reviewable', 'rust-highfive', 'rfcbot']
+# See ghbots.py for how bots are found
+def getBots(repoPath):
+    return sorted(loadBots(repoPath))
 
-def graphFrequency(data, graphtitle, xtitle, filename):
-    botNames = getBots()
+def graphFrequency(data, botNames, graphtitle, xtitle, filename):
     data = sorted(data, key=lambda tup: tup[2], reverse=True)
     # Filter out any bots
     bots = [x for x in data if x[3] in botNames]
@@ -342,12 +334,11 @@ def getFrequency(contributorDates):
 # Hint: read file into memory with .read() and then use re.findall(pattern, file contents)
 # A box plot would be good to show median, quartiles, max/min, and perhaps the underlying data?
 # https://plot.ly/python/box-plots/
-def createGraphs(owner, repo, htmldir):
+def createGraphs(owner, repo, htmldir, since=None, until=None):
     repoPath = os.path.join(owner, repo)
-    # No clue why readline is returning single characters, so let's do it this way:
-    with open(os.path.join(repoPath, 'first-interactions.txt')) as newcomersFile:
-        newcomers = newcomersFile.read().split('\n')
-    html = {'newcomers-ramp': graphNewcomers(repoPath, newcomers)}
+    allEvents = loadEvents(repoPath)
+    events = allEvents.window(since, until)
+    html = {'newcomers-ramp': graphNewcomers(repoPath, events)}
 
     info = [['responder', 'Bug triaging', 'a contributor comments on an issue opened by another person'],
             ['merger', 'Merger', 'a contributor merges a pull request'],
@@ -356,25 +347,25 @@ def createGraphs(owner, repo, htmldir):
            ]
 
     for i in info:
-        with open(os.path.join(repoPath, i[0] + 's.txt')) as f:
-            contributors = f.read()
-        i.append(sortContributors(contributors))
-        deltaResponse, noResponse = getRampTime(newcomers, i[3], i[0])
+        i.append(sortContributors(events, i[0]))
+        deltaResponse, noResponse = getRampTime(events, i[3], i[0])
         html[i[0] + '-ramp'] = graphRampTime(deltaResponse, noResponse,
                       '%s ramp up time for newcomers to<br>' % i[1] + repoPath,
                       '<br>Number of days before %s' % i[2],
                       os.path.join(repoPath, i[0] + 's-rampup.html'))
         freq, nodata = getFrequency(i[3])
-        html[i[0] + '-freq'] = graphFrequency(freq,
+        html[i[0] + '-freq'] = graphFrequency(freq, getBots(repoPath),
                       '%s frequency for contributors to<br>' % i[1] + repoPath,
                       '<br>Length of time (weeks) spent in that role',
                       os.path.join(repoPath, i[0] + 's-frequency.html'))
-    coords = prOpenTimes(owner, repo)
+    coords = prOpenTimes(owner, repo, allEvents, since, until)
     html['mergetime'] = graphMergeDelay(coords)
     if 'all-comments-sentiment.txt' in os.listdir(repoPath):
         html['sentimentwarning'] = '<p><b>**WARNING** The sentiment model is not very good at classifying sentences yet. Take these graphs with a giant lump of salt.</b></p>'
-        html['sentimentgraph'] = graphSentiment(repoPath, False)
-        html['sentimentstats'] = htmlSentimentStats(repoPath)
+        db = openDb(repoPath)
+        html['sentimentgraph'] = graphSentiment(repoPath, db, False, since, until)
+        html['sentimentstats'] = htmlSentimentStats(repoPath, db, since, until)
+        db.close()
     else:
         html['sentimentwarning'] = ''
         html['sentimentgraph'] = '<p>More data coming soon! Click another tab.</p>'
@@ -389,8 +380,9 @@ def main():
     parser.add_argument('repository', help='github repository name')
     parser.add_argument('owner', help='github username of repository owner')
     parser.add_argument('htmldir', help='directory where report templates and project reports are stored')
+    addWindowArguments(parser)
     args = parser.parse_args()
-    createGraphs(args.owner, args.repository, args.htmldir)
+    createGraphs(args.owner, args.repository, args.htmldir, args.since, args.until)
 
 if __name__ == "__main__":
     main()
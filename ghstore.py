@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library is how the analysis scripts read the scraped json.
+#
+# ghscraper.py writes every issue, comment, and pull request to its own file:
+#
+# .
+# |-- github owner
+#     |-- repository name
+#         |-- issue-<id>
+#         |   |-- issue-<id>.json
+#         |   |-- comment-<id>.json
+#         |   |-- pr-<id>.json
+#         |   |-- pr-comment-<id>.json
+#
+# For big repositories, that's millions of small files, and every pass over
+# the data pays for a directory listing and an open/close per file.
+# The json can instead be packed into a segment store:
+#
+# .
+# |-- github owner
+#     |-- repository name
+#         |-- segments
+#             |-- index.sqlite
+#             |-- segment-00000.zz
+#             |-- segment-00001.zz
+#             |-- ...
+#
+# Segments are append-only files of zlib compressed json, each up to
+# SEGMENT_SIZE bytes. The index is a SQLite database that maps each issue
+# directory and file name to a segment, offset, and length. Files are packed
+# one issue at a time, so reading a whole repository is a sequential read
+# through the segments.
+#
+# Both layouts have the same reader API (see DirectoryStore), and openStore()
+# picks the segment store if there is one. Paths written to the output
+# files (e.g. owner/repo/issue-<id>/comment-<id>.json) are the same for
+# both, so the output doesn't depend on how the json is stored.
+#
+# To pack a scraped repository, or to unpack it back into directories:
+#
+# python ghstore.py GITHUB_REPO_NAME GITHUB_OWNER_NAME pack [--remove]
+# python ghstore.py GITHUB_REPO_NAME GITHUB_OWNER_NAME unpack [--remove]
+#
+# Packing only appends files that are new or have changed since they were
+# last packed, so re-run it after scraping more data. --remove deletes the
+# source (the issue directories, or the segment store) once it's converted.
+# The scraper always writes issue directories, even after pack --remove.
+# Until they're packed again, the segment store reads the files in them that
+# are newer than their packed copies (or were never packed) from the
+# directories, so scripts see the new json straight away. Once a repository
+# is packed, keeping the issue directories around (pack without --remove)
+# means every read lists them, so remove them for the fastest reads.
+
+import os
+import json
+import zlib
+import hashlib
+import shutil
+import sqlite3
+import argparse
+from itertools import groupby
+from ghwalk import issueSortKey, jsonEntries, jsonFiles, walkContents
+import ghwalk
+
+STORE_DIR = 'segments'
+INDEX_NAME = 'index.sqlite'
+SEGMENT_SIZE = 256*1024*1024
+
+class DirectoryStore:
+    """Reads json from the issue directories ghscraper.py writes.
+
+    Issue directories are named by their directory name (issue-<id>),
+    and files by their file name (e.g. comment-<id>.json)."""
+
+    def __init__(self, repoPath):
+        self.repoPath = repoPath
+
+    def path(self, issueDir, name=None):
+        """The path scripts use to refer to an issue directory or file."""
+        if name is None:
+            return os.path.join(self.repoPath, issueDir)
+        return os.path.join(self.repoPath, issueDir, name)
+
+    def issueDirs(self):
+        """Returns a list of issue directory names, sorted by id."""
+        return ghwalk.issueDirs(self.repoPath)
+
+    def files(self, issueDir):
+        """Returns a list of json file names in an issue directory, sorted by name."""
+        return jsonFiles(self.path(issueDir))
+
+    def load(self, issueDir, name):
+        """Returns the decoded json in a file."""
+        with open(self.path(issueDir, name)) as f:
+            return json.load(f)
+
+    def raw(self, issueDir, name):
+        """Returns a file's json as bytes."""
+        with open(self.path(issueDir, name), 'rb') as f:
+            return f.read()
+
+    def iterRaw(self, prefetch=0, dirs=None):
+        """Yield (issue directory name, [(file name, bytes), ...]) for every issue,
+        or only the issue directories in dirs (sorted by id).
+        With prefetch, that many threads read ahead (see ghwalk.py)."""
+        return walkContents(self.repoPath, prefetch, dirs)
+
+    def iterIssues(self, prefetch=0):
+        """Yield (issue directory name, [(file name, json), ...]) for every issue."""
+        for issueDir, files in self.iterRaw(prefetch):
+            yield issueDir, [(name, json.loads(data.decode('utf-8'))) for (name, data) in files]
+
+    def fingerprint(self, issueDir):
+        """Returns a string that changes whenever a file in the issue directory
+        is added, removed, or rewritten, without reading the files."""
+        h = hashlib.sha1()
+        for entry in jsonEntries(self.path(issueDir)):
+            st = entry.stat()
+            h.update(('%s %d %d\n' % (entry.name, st.st_size, st.st_mtime_ns)).encode('utf-8'))
+        return h.hexdigest()
+
+def createIndex(db):
+    # issues remembers the order issues were packed in, so that iterIssues()
+    # reads segments in order even after objects have been replaced.
+    db.execute('''CREATE TABLE IF NOT EXISTS issues (
+                    seq INTEGER PRIMARY KEY,
+                    dir TEXT UNIQUE NOT NULL)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS objects (
+                    dir TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    PRIMARY KEY (dir, name))''')
+    db.commit()
+
+class SegmentStore(DirectoryStore):
+    """Reads (and appends) json in compressed segment files.
+
+    The scraper always writes issue directories, so json scraped since the
+    last pack is read from them: a file that is newer than its packed copy,
+    or was never packed, hides the packed copy until it's packed again."""
+
+    def __init__(self, repoPath):
+        DirectoryStore.__init__(self, repoPath)
+        self.storePath = os.path.join(repoPath, STORE_DIR)
+        if not os.path.exists(self.storePath):
+            os.makedirs(self.storePath)
+        self.db = sqlite3.connect(os.path.join(self.storePath, INDEX_NAME))
+        createIndex(self.db)
+        self.readers = {}
+        self.writer = None
+        self.loose = None
+
+    def segmentPath(self, segment):
+        return os.path.join(self.storePath, 'segment-%05d.zz' % segment)
+
+    def packedDirs(self):
+        """Returns a list of the packed issue directory names, in the order they were packed."""
+        return [row[0] for row in self.db.execute('SELECT dir FROM issues ORDER BY seq')]
+
+    def issueDirs(self):
+        # Issue directories that were never packed come after the packed ones,
+        # as they would once they're packed.
+        packed = self.packedDirs()
+        known = set(packed)
+        return packed + [d for d in ghwalk.issueDirs(self.repoPath) if d not in known]
+
+    def looseDirs(self):
+        """Returns the set of issue directory names on disk, listed once per store."""
+        if self.loose is None:
+            self.loose = set(ghwalk.issueDirs(self.repoPath))
+        return self.loose
+
+    def looseEntries(self, issueDir, packedTimes):
+        """Returns a dictionary of file names to os.DirEntry for the json files in
+        an issue directory that are newer than their packed copies, or were never packed."""
+        dirPath = self.path(issueDir)
+        if not os.path.isdir(dirPath):
+            return {}
+        return {e.name: e for e in jsonEntries(dirPath)
+                if e.name not in packedTimes or e.stat().st_mtime > packedTimes[e.name]}
+
+    def files(self, issueDir):
+        names = set(self.packedTimes(issueDir))
+        names.update(self.looseEntries(issueDir, {}))
+        return sorted(names)
+
+    def read(self, segment, offset, length):
+        """Returns the uncompressed bytes of one object."""
+        if segment not in self.readers:
+            self.readers[segment] = open(self.segmentPath(segment), 'rb')
+        f = self.readers[segment]
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+    def raw(self, issueDir, name):
+        """Returns a file's json as bytes."""
+        row = self.db.execute('SELECT segment, offset, length, mtime FROM objects WHERE dir = ? AND name = ?',
+                              (issueDir, name)).fetchone()
+        if not row:
+            return DirectoryStore.raw(self, issueDir, name)
+        # Only look for a newer copy if the issue directory is still there
+        if issueDir in self.looseDirs():
+            try:
+                if os.path.getmtime(self.path(issueDir, name)) > row[3]:
+                    return DirectoryStore.raw(self, issueDir, name)
+            except OSError:
+                pass
+        return self.read(*row[:3])
+
+    def load(self, issueDir, name):
+        return json.loads(self.raw(issueDir, name).decode('utf-8'))
+
+    def packedRows(self, dirs=None):
+        """Yield (issue directory name, [(file name, segment, offset, length, mtime), ...])
+        for every packed issue (or the packed issues in dirs), in segment order."""
+        if dirs is None:
+            rows = self.db.execute('''SELECT o.dir, o.name, o.segment, o.offset, o.length, o.mtime
+                                      FROM objects o JOIN issues i ON o.dir = i.dir
+                                      ORDER BY i.seq, o.name''')
+            for issueDir, group in groupby(rows, key=lambda row: row[0]):
+                yield issueDir, [row[1:] for row in group]
+            return
+        # Look the issues up one at a time, rather than scanning the whole index
+        seqs = []
+        for issueDir in dirs:
+            row = self.db.execute('SELECT seq FROM issues WHERE dir = ?', (issueDir,)).fetchone()
+            if row:
+                seqs.append((row[0], issueDir))
+        for seq, issueDir in sorted(seqs):
+            yield issueDir, self.db.execute('''SELECT name, segment, offset, length, mtime
+                                               FROM objects WHERE dir = ? ORDER BY name''',
+                                            (issueDir,)).fetchall()
+
+    def iterRaw(self, prefetch=0, dirs=None):
+        """Yield (issue directory name, [(file name, bytes), ...]) for every issue
+        (or the issues in dirs), in the order of issueDirs().
+        Segments are read sequentially, so there's nothing to prefetch."""
+        if dirs is not None:
+            dirs = set(dirs)
+        loose = set(ghwalk.issueDirs(self.repoPath))
+        packed = set()
+        for issueDir, rows in self.packedRows(dirs):
+            packed.add(issueDir)
+            newer = {}
+            if issueDir in loose:
+                newer = self.looseEntries(issueDir, {row[0]: row[4] for row in rows})
+            files = [(name, self.read(segment, offset, length))
+                     for (name, segment, offset, length, mtime) in rows if name not in newer]
+            if newer:
+                files.extend(ghwalk.readFiles(newer.values()))
+                files.sort(key=lambda f: f[0])
+            yield issueDir, files
+        for issueDir in sorted(loose - packed, key=issueSortKey):
+            if dirs is None or issueDir in dirs:
+                yield ghwalk.readIssue(self.repoPath, issueDir)
+
+    def iterIssues(self, prefetch=0):
+        for issueDir, files in self.iterRaw():
+            yield issueDir, [(name, json.loads(data.decode('utf-8'))) for (name, data) in files]
+
+    def fingerprint(self, issueDir):
+        # Files are replaced by appending them, so their location changes.
+        h = hashlib.sha1()
+        packedTimes = {}
+        for name, segment, offset, length, mtime in self.db.execute(
+                'SELECT name, segment, offset, length, mtime FROM objects WHERE dir = ? ORDER BY name',
+                (issueDir,)):
+            h.update(('%s %d %d %d\n' % (name, segment, offset, length)).encode('utf-8'))
+            packedTimes[name] = mtime
+        newer = self.looseEntries(issueDir, packedTimes)
+        for name in sorted(newer):
+            st = newer[name].stat()
+            h.update(('%s %d %d\n' % (name, st.st_size, st.st_mtime_ns)).encode('utf-8'))
+        return h.hexdigest()
+
+    def packedTimes(self, issueDir):
+        """Returns a dictionary of file names to the modification time of the packed file."""
+        return dict(self.db.execute('SELECT name, mtime FROM objects WHERE dir = ?', (issueDir,)))
+
+    def append(self, issueDir, name, data, mtime):
+        """Append a file's bytes to the last segment, replacing any packed copy of the file."""
+        compressed = zlib.compress(data)
+        if self.writer is None:
+            last = self.db.execute('SELECT MAX(segment) FROM objects').fetchone()[0]
+            self.segment = last or 0
+            self.writer = open(self.segmentPath(self.segment), 'ab')
+        if self.writer.tell() > 0 and self.writer.tell() + len(compressed) > SEGMENT_SIZE:
+            self.writer.close()
+            self.segment += 1
+            self.writer = open(self.segmentPath(self.segment), 'ab')
+        offset = self.writer.tell()
+        self.writer.write(compressed)
+        self.db.execute('INSERT OR IGNORE INTO issues (dir) VALUES (?)', (issueDir,))
+        self.db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)',
+                        (issueDir, name, self.segment, offset, len(compressed), mtime))
+
+    def commit(self):
+        """Make sure appended data is on disk before the index points to it."""
+        if self.writer is not None:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            # Readers may have cached a shorter file.
+            self.readers.pop(self.segment, None)
+        self.db.commit()
+
+def hasSegmentStore(repoPath):
+    return os.path.exists(os.path.join(repoPath, STORE_DIR, INDEX_NAME))
+
+def openStore(repoPath):
+    """Returns a reader for a scraped repository's json, whichever way it's stored."""
+    if hasSegmentStore(repoPath):
+        return SegmentStore(repoPath)
+    return DirectoryStore(repoPath)
+
+# Stores opened by getStore(), by repository path
+openStores = {}
+
+def getStore(repoPath):
+    """Like openStore(), but reuses a store that's already open."""
+    if repoPath not in openStores:
+        openStores[repoPath] = openStore(repoPath)
+    return openStores[repoPath]
+
+def changedDirs(store, db):
+    """Compares the issue directories' fingerprints against the ones saved in
+    db's dirs table (dir, fingerprint) the last time they were read.
+    Returns (all issue directory names sorted by id, their fingerprints,
+    the directories that are new or changed, the directories that were removed)."""
+    issueDirs = sorted(store.issueDirs(), key=issueSortKey)
+    stored = dict(db.execute('SELECT dir, fingerprint FROM dirs'))
+    fingerprints = {d: store.fingerprint(d) for d in issueDirs}
+    changed = [d for d in issueDirs if stored.get(d) != fingerprints[d]]
+    removed = [d for d in stored if d not in fingerprints]
+    return issueDirs, fingerprints, changed, removed
+
+def splitPath(path):
+    """Split a json file path (owner/repo/issue-<id>/comment-<id>.json)
+    into (repository path, issue directory name, file name)."""
+    issuePath, name = os.path.split(path)
+    repoPath, issueDir = os.path.split(issuePath)
+    return repoPath, issueDir, name
+
+def loadPath(path):
+    """Returns the json in a file, given the path scripts use to refer to it."""
+    repoPath, issueDir, name = splitPath(path)
+    return getStore(repoPath).load(issueDir, name)
+
+def pack(repoPath, remove=False):
+    """Append new and changed files in the issue directories to the segment store."""
+    source = DirectoryStore(repoPath)
+    store = SegmentStore(repoPath)
+    packed = 0
+    processed = 0
+    # Pack in the order the scripts read issues in, so that reads are sequential.
+    issueDirs = source.issueDirs()
+    for issueDir in issueDirs:
+        packedTimes = store.packedTimes(issueDir)
+        for name in source.files(issueDir):
+            path = source.path(issueDir, name)
+            mtime = os.path.getmtime(path)
+            if name in packedTimes and packedTimes[name] >= mtime:
+                continue
+            with open(path, 'rb') as f:
+                store.append(issueDir, name, f.read(), mtime)
+            packed += 1
+        processed += 1
+        if (processed % 1000) == 0:
+            store.commit()
+            print('Packed', processed, 'issues')
+    store.commit()
+    print('Packed', packed, 'files from', len(issueDirs), 'issues')
+    if remove:
+        for issueDir in issueDirs:
+            shutil.rmtree(source.path(issueDir))
+
+def unpack(repoPath, remove=False):
+    """Write the segment store back out to issue directories."""
+    store = SegmentStore(repoPath)
+    unpacked = 0
+    processed = 0
+    for issueDir, rows in store.packedRows():
+        dirPath = store.path(issueDir)
+        if not os.path.exists(dirPath):
+            os.makedirs(dirPath)
+        # Files scraped since the last pack are newer than their packed copies
+        newer = store.looseEntries(issueDir, {row[0]: row[4] for row in rows})
+        for name, segment, offset, length, mtime in rows:
+            if name in newer:
+                continue
+            path = os.path.join(dirPath, name)
+            with open(path, 'wb') as f:
+                f.write(store.read(segment, offset, length))
+            # Keep the modification time, so that packing again doesn't re-append it.
+            os.utime(path, (mtime, mtime))
+            unpacked += 1
+        processed += 1
+        if (processed % 1000) == 0:
+            print('Unpacked', processed, 'issues')
+    store.db.close()
+    print('Unpacked', unpacked, 'files from', processed, 'issues')
+    if remove:
+        shutil.rmtree(store.storePath)
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert scraped github data between issue directories and compressed segment files.')
+    parser.add_argument('repository', help='github repository name')
+    parser.add_argument('owner', help='github username of repository owner')
+    parser.add_argument('command', help='pack issue directories into segments, or unpack segments into issue directories',
+                        choices=['pack', 'unpack'])
+    parser.add_argument('--remove', help='delete the issue directories (pack) or segments (unpack) afterwards',
+                        action='store_true', default=False)
+    args = parser.parse_args()
+
+    repoPath = os.path.join(args.owner, args.repository)
+    if args.command == 'pack':
+        pack(repoPath, args.remove)
+    else:
+        if not hasSegmentStore(repoPath):
+            print('No segment store in', repoPath)
+            return
+        unpack(repoPath, args.remove)
+
+if __name__ == "__main__":
+    main()
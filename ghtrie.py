@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library builds one regular expression that matches any of a list of
+# strings, for searching text for many strings at once.
+#
+# A plain alternation (a|b|c|...) makes the regex engine try every string at
+# every position in the text. Instead, the strings are put in a trie, and the
+# regular expression follows the trie: strings that share a prefix share the
+# start of the pattern, so each position only tries the branches that match
+# the next character. Adding strings doesn't multiply the time it takes to
+# scan the text.
+#
+# At each position, the longest string that matches is preferred, e.g. with
+# '/lgtm' and '/lgtm cancel', '/lgtm cancel' matches the whole command.
+
+import re
+
+def triePattern(node):
+    """Returns the pattern for a trie node. The '' key marks the end of a string."""
+    branches = [re.escape(ch) + triePattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ''
+    if '' in node:
+        # The string can end here, or go on to a longer one
+        return '(?:' + '|'.join(branches) + ')?'
+    if len(branches) == 1:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')'
+
+def trieRegex(strings):
+    """Returns a regular expression (as a string, to be embedded in a larger pattern)
+    that matches any of the strings, preferring the longest."""
+    trie = {}
+    for s in strings:
+        if not s:
+            continue
+        node = trie
+        for ch in s:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+    pattern = triePattern(trie)
+    if not pattern:
+        # Never match
+        return '(?!)'
+    return pattern
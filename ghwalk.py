@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Sarah Sharp <sharp@otter.technology>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This library walks the issue directories ghscraper.py writes:
+#
+# .
+# |-- github owner
+#     |-- repository name
+#         |-- issue-<id>
+#         |   |-- issue-<id>.json
+#         |   |-- comment-<id>.json
+#         |   |-- pr-<id>.json
+#         |   |-- pr-comment-<id>.json
+#
+# Directories are listed with os.scandir, which gets the file types from the
+# directory listing instead of a stat() per entry. Issue directories come out
+# sorted by id, and files by name, so every script sees the same order.
+#
+# On a network filesystem, each file open is a round trip. walkContents() can
+# read issue directories ahead of the caller in a pool of threads.
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+ISSUE = 'issue'
+COMMENT = 'comment'
+PR = 'pr'
+REVIEW_COMMENT = 'pr-comment'
+
+# Issue directories read ahead per prefetch thread
+READ_AHEAD = 4
+
+def fileKind(name):
+    """Returns ISSUE, COMMENT, PR, or REVIEW_COMMENT for a json file name, or None."""
+    if name.startswith('comment-'):
+        return COMMENT
+    if name.startswith('pr-'):
+        if name.startswith('pr-comment-'):
+            return REVIEW_COMMENT
+        if name[3:4].isdigit():
+            return PR
+        return None
+    if name.startswith('issue-'):
+        return ISSUE
+    return None
+
+def issueSortKey(issueDir):
+    """Sort issue directories by id, which is the order github created them in."""
+    number = issueDir[len('issue-'):]
+    if number.isdigit():
+        return (0, int(number), '')
+    return (1, 0, issueDir)
+
+def issueDirs(repoPath):
+    """Returns the sorted list of issue directory names in a repository."""
+    names = [e.name for e in os.scandir(repoPath) if e.name.startswith('issue-') and e.is_dir()]
+    return sorted(names, key=issueSortKey)
+
+def jsonEntries(dirPath):
+    """Returns the os.DirEntry for each json file in a directory, sorted by name."""
+    files = [e for e in os.scandir(dirPath) if e.name.endswith('.json') and e.is_file()]
+    return sorted(files, key=lambda e: e.name)
+
+def jsonFiles(dirPath):
+    """Returns the sorted list of json file names in a directory."""
+    return [e.name for e in jsonEntries(dirPath)]
+
+def readFiles(entries):
+    """Returns [(file name, bytes), ...] for a list of os.DirEntry."""
+    files = []
+    for entry in entries:
+        with open(entry.path, 'rb') as f:
+            files.append((entry.name, f.read()))
+    return files
+
+def readIssue(repoPath, issueDir):
+    return issueDir, readFiles(jsonEntries(os.path.join(repoPath, issueDir)))
+
+def walkContents(repoPath, prefetch=0, dirs=None):
+    """Yield (issue directory name, [(json file name, bytes), ...]) for every issue, in order.
+    With prefetch, that many threads read the issues ahead of the caller.
+    With dirs, only those issue directories are read, in that order."""
+    if dirs is None:
+        dirs = issueDirs(repoPath)
+    if not prefetch:
+        for issueDir in dirs:
+            yield readIssue(repoPath, issueDir)
+        return
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        pending = deque()
+        for issueDir in dirs:
+            pending.append(pool.submit(readIssue, repoPath, issueDir))
+            if len(pending) >= prefetch * READ_AHEAD:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
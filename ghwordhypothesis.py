@@ -24,6 +24,8 @@
 #    python ghcategorize.py repo owner
 #  - info from owner/repo/submitters.txt
 #
+# With --since and --until, only contributions and reviews in that window are counted.
+#
 # Plan:
 #  - sort PR submitters (or issue submitters, later) into dict - username, list of (PR directory, created by date)
 #  - sort all-comments.txt into dict - directory, list of (json file, username, date)
@@ -31,45 +33,36 @@
 #  - two populations - those who are thanked, those who aren't - did they submit again is success criteria
 #  - plug total and number of successes for each population into http://www.evanmiller.org/ab-testing/chi-squared.html
 
-from ghstats import issueDir
-from operator import itemgetter
 import os
 import re
-import json
 import argparse
-from datetime import datetime
+import numpy
+from ghstore import openStore
+from ghdb import openDb
+from ghevents import loadEvents, roleForFile, toDatetime, addWindowArguments
 
-def createContributionDict(repoPath, fileList):
+def createContributionDict(repoPath, fileList, since=None, until=None):
     contribDict = {}
-    lines = []
-    for x in fileList:
-        with open(os.path.join(repoPath, x)) as f:
-            lines = lines + f.read().split('\n')
+    events = loadEvents(repoPath).window(since, until)
+    rows = events.where(*[roleForFile(x) for x in fileList])
 
     # key (username): date, issue directory
-    contribs = [(x.split('\t')[2],
-                 datetime.strptime(x.split('\t')[1], "%Y-%m-%dT%H:%M:%SZ"),
-                 issueDir(x.split('\t')[3]))
-                for x in lines if len(x.split('\t')) > 3]
-    contribs = sorted(contribs, key=itemgetter(1))
-    for c in contribs:
-        contribDict.setdefault( c[0], [] ).append((c[1], c[2]))
+    # A stable sort keeps same-date contributions in file order.
+    rows = rows[numpy.argsort(events.time[rows], kind='mergesort')]
+    for user, time, issue in zip(events.user[rows].tolist(), events.time[rows].tolist(),
+                                 events.issue[rows].tolist()):
+        contribDict.setdefault(events.users[user], []).append((toDatetime(time), events.issues[issue]))
     return contribDict
 
-def createReviewerDict(repoPath, fileList):
+def createReviewerDict(repoPath, fileList, since=None, until=None):
     contribDict = {}
-    lines = []
-    for x in fileList:
-        with open(os.path.join(repoPath, x)) as f:
-            lines = lines + f.read().split('\n')
+    events = loadEvents(repoPath).window(since, until)
+    rows = events.where(*[roleForFile(x) for x in fileList])
 
     # key (json file path): date, user
-    contribs = [(x.split('\t')[3],
-                 datetime.strptime(x.split('\t')[1], "%Y-%m-%dT%H:%M:%SZ"),
-                 x.split('\t')[2])
-                for x in lines if len(x.split('\t')) > 3]
-    for c in contribs:
-        contribDict[c[0]] = [(c[1], c[2])]
+    for path, time, user in zip(events.path[rows].tolist(), events.time[rows].tolist(),
+                                events.user[rows].tolist()):
+        contribDict[events.paths[path]] = [(toDatetime(time), events.users[user])]
     return contribDict
 
 def createCommentDict(repoPath):
@@ -91,23 +84,29 @@ def main():
     parser.add_argument('--reporters', help='intead of looking and PR submitters and reviewers, look at bug reporters and responders', type=bool, default=False)
     parser.add_argument('--printmissing', help="print issues where contributors didn't experience the word", type=bool, default=False)
     parser.add_argument('--skipopen', help="don't count any issues or pull requests that are still open", type=bool, default=False)
+    addWindowArguments(parser)
     args = parser.parse_args()
 
     repoPath = os.path.join(args.owner, args.repository)
+    store = openStore(repoPath)
     # Grab both merged and not merged pull requests
 
     # PR key (username): [(date, issue directory), ... ]
     if args.reporters:
-        contribDict = createContributionDict(repoPath, ['reporters.txt'])
+        contribDict = createContributionDict(repoPath, ['reporters.txt'], args.since, args.until)
     else:
-        contribDict = createContributionDict(repoPath, ['contributors.txt', 'submitters.txt'])
+        contribDict = createContributionDict(repoPath, ['contributors.txt', 'submitters.txt'], args.since, args.until)
     # Reviews key (json file path): [(date, user)]
     if args.reporters:
-        reviewDict = createReviewerDict(repoPath, ['responders.txt'])
+        reviewDict = createReviewerDict(repoPath, ['responders.txt'], args.since, args.until)
     else:
-        reviewDict = createReviewerDict(repoPath, ['reviewers.txt'])
+        reviewDict = createReviewerDict(repoPath, ['reviewers.txt'], args.since, args.until)
     # Reviews key (json file path): multiline comment string
     commentDict = createCommentDict(repoPath)
+    if args.skipopen:
+        db = openDb(repoPath)
+        issueStates = dict(db.execute('SELECT dir, state FROM issues'))
+        db.close()
 
     thanked = 0
     noThanked = 0
@@ -117,9 +116,10 @@ def main():
         # Grab the user's first contribution to the project
         firstPR = value[0]
         issueDir = firstPR[1]
+        issueName = os.path.basename(issueDir)
         tflag = False
         reviewComments = 0
-        for c in [os.path.join(issueDir, x) for x in os.listdir(issueDir)]:
+        for c in [store.path(issueName, x) for x in store.files(issueName)]:
             # Ignore any files where the PR creator commented
             if c not in reviewDict.keys():
                 continue
@@ -138,7 +138,7 @@ def main():
                 thankedSuccess = thankedSuccess + 1
         else:
             if args.printmissing:
-                for c in [os.path.join(issueDir, x) for x in os.listdir(issueDir)]:
+                for c in [store.path(issueName, x) for x in store.files(issueName)]:
                     if c not in reviewDict.keys() or c not in commentDict.keys():
                         continue
                     print(commentDict[c])
@@ -150,11 +150,7 @@ def main():
                 continue
             # Skip any issues that have comments but are still open.
             if args.skipopen:
-                for jsonFile in os.listdir(issueDir):
-                    if jsonFile.startswith('issue-'):
-                        with open(os.path.join(issueDir, jsonFile)) as issueFile:
-                            issueJson = json.load(issueFile)
-                if issueJson['state'] ==  'open':
+                if issueStates.get(issueName) ==  'open':
                     if args.printmissing:
                         print("Issue still open:", issueDir)
                         continue